@@ -1,7 +1,17 @@
 import fire
 
 import greensenti.band_arithmetic as ba
-from greensenti import dhus, raster
+from greensenti import (
+    catalog,
+    change,
+    dhus,
+    mosaic,
+    pipeline,
+    raster,
+    sample,
+    stats,
+    tiles,
+)
 
 
 def cli():
@@ -23,10 +33,27 @@ def cli():
             "ndyi": ba.ndyi,
             "osavi": ba.osavi,
         },
-        "raster": {"apply-mask": raster.apply_mask, "transform-image": raster.transform_image},
+        "raster": {
+            "apply-mask": raster.apply_mask,
+            "transform-image": raster.transform_image,
+            "overviews": raster.build_overviews,
+            "quicklook": raster.quicklook,
+            "stats": stats.raster_stats,
+            "mosaic": mosaic.mosaic,
+            "tiles": tiles.generate_tiles,
+            "change": change.change_detection,
+        },
         "download": {
             "by-title": dhus.download_by_title,
             "by-geometry": dhus.download_by_geometry,
+            "stream": dhus.stream,
+            "offline": dhus.retrieve_offline,
+            "find-band": dhus.find_band,
+        },
+        "download-and-process": pipeline.download_and_process,
+        "sample": sample.sample,
+        "catalog": {
+            "products": catalog.products,
         },
     }
     fire.Fire(cli_map)
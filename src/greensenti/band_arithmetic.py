@@ -1,13 +1,44 @@
 from pathlib import Path
+from typing import Sequence
 
 import numpy as np
 import rasterio
+from rasterio import mask
+from sentinelsat import read_geojson
 
-from greensenti.raster import rescale_band
+from greensenti.compute import evaluate
+from greensenti.raster import project_shape, rescale_band, stretch_limits, write_raster
+from greensenti.stats import raster_stats
 
 # Allow division by zero.
 np.seterr(divide="ignore", invalid="ignore")
 
+# Scene classification (SCL) band's cloud-related values: cloud shadows, medium and high probability clouds, thin
+# cirrus and snow.
+SCL_CLOUD_VALUES = [3, 8, 9, 10, 11]
+
+# Band arithmetic expressions of indices, evaluated by `compute.evaluate`. Variables are named after bands (e.g., b8a
+# for B8A), besides coefficients (e.g., Y of OSAVI).
+INDEX_EXPRESSIONS = {
+    "bri": "(1 / b3 - 1 / b5) / b8",
+    "bsi": "((b11 + b4) - (b8 + b2)) / ((b11 + b4) + (b8 + b2))",
+    "cri1": "(1 / b2) / (1 / b3)",
+    "evi": "(2.5 * (b8 - b4)) / ((b8 + 6 * b4 - 7.5 * b2) + 1)",
+    "evi2": "2.4 * ((b8 - b4) / (b8 + b4 + 1.0))",
+    "mndwi": "(b3 - b11) / (b3 + b11)",
+    "moisture": "(b8a - b11) / (b8a + b11)",
+    "ndre": "(b9 - b5) / (b9 + b5)",
+    "ndsi": "(b3 - b11) / (b3 + b11)",
+    "ndvi": "(b8 - b4) / (b8 + b4)",
+    "ndwi": "(b3 - b8) / (b3 + b8)",
+    "ndyi": "(b3 - b2) / (b3 + b2)",
+    "osavi": "(1 + Y) * (b8 - b4) / (b8 + b4 + Y)",
+    "ri": "(b4 - b3) / (b4 + b3)",
+}
+
+# Thresholds of indices output as binary masks, e.g., NDSI values above 0.42 are regarded as snow.
+INDEX_THRESHOLDS = {"ndsi": 0.42}
+
 
 def read(filename: str | Path) -> tuple[np.ndarray, dict]:
     """
@@ -22,6 +53,83 @@ def read(filename: str | Path) -> tuple[np.ndarray, dict]:
     return B, kwargs
 
 
+def read_band(filename: str | Path) -> tuple[np.ndarray, dict]:
+    """
+    Read raster data from file, keeping no data (zero) values. Invalid pixels are masked once when the output is
+    computed, see `valid_mask` and `masked`.
+
+    :param filename: Path to input file.
+    :return: Raster d-array and metadata.
+    """
+    with rasterio.open(filename) as f:
+        return f.read().astype(np.float32), f.meta
+
+
+def _resize_nearest(band: np.ndarray, shape: tuple[int, ...]) -> np.ndarray:
+    rows = np.arange(shape[-2]) * band.shape[-2] // shape[-2]
+    cols = np.arange(shape[-1]) * band.shape[-1] // shape[-1]
+    return band[..., rows[:, None], cols]
+
+
+def valid_mask(
+    *bands: np.ndarray, scl: np.ndarray | None = None, scl_classes: Sequence[int] = SCL_CLOUD_VALUES
+) -> np.ndarray:
+    """
+    Computes the validity mask of a product: pixels with data in every band, and optionally not of the given SCL
+    classes.
+
+    ..note:: In Sentinel-2 Level-2A products, zero values are reserved for 'No Data'.
+
+    :param bands: Band arrays. Coarser bands, e.g., 20m bands of 10m indices, are resampled (nearest) to the shape of
+     the finest one.
+    :param scl: SCL band array. It is resampled (nearest) to the shape of the bands if needed.
+    :param scl_classes: SCL classes masked as not valid, e.g., clouds.
+    :return: Boolean mask, true for valid pixels.
+    """
+    shape = max((band.shape for band in bands), key=np.prod)
+    valid = np.logical_and.reduce(
+        [(band if band.shape == shape else _resize_nearest(band, shape)) != 0 for band in bands]
+    )
+    if scl is not None:
+        if scl.shape != valid.shape:
+            scl = _resize_nearest(scl, valid.shape)
+        valid &= ~np.isin(scl, scl_classes)
+    return valid
+
+
+def read_valid_mask(*bands: Path, scl: Path | None = None, scl_classes: Sequence[int] = SCL_CLOUD_VALUES) -> np.ndarray:
+    """
+    Reads the validity mask of a product at a resolution, to be shared by every index computed from its bands.
+
+    :param bands: Paths to bands, at the same resolution.
+    :param scl: Path to SCL band.
+    :param scl_classes: SCL classes masked as not valid, e.g., clouds.
+    :return: Boolean mask, true for valid pixels.
+    """
+    valid = None
+    for band in bands:
+        with rasterio.open(band) as f:
+            band_valid = f.read() != 0
+        valid = band_valid if valid is None else valid & band_valid
+    if scl is not None:
+        with rasterio.open(scl) as f:
+            return valid_mask(valid, scl=f.read(), scl_classes=scl_classes)
+    return valid
+
+
+def masked(index: np.ndarray, valid: np.ndarray) -> np.ndarray:
+    """
+    Sets pixels not valid or not finite (e.g., divided by zero) as no data (NaN), in a single pass.
+
+    :param index: Index array.
+    :param valid: Validity mask, see `valid_mask`.
+    :return: Index array as float32.
+    """
+    if valid.shape != index.shape:
+        raise ValueError(f"Validity mask of shape {valid.shape} does not match index of shape {index.shape}.")
+    return np.where(valid & np.isfinite(index), index, np.float32(np.nan)).astype(np.float32, copy=False)
+
+
 def cloud_cover_percentage(b3: Path, b4: Path, b11: Path, tau: float = 0.2, *, output: Path | None = None) -> float:
     """
     Computes cloud percentage of an image based on:
@@ -54,8 +162,7 @@ def cloud_cover_percentage(b3: Path, b4: Path, b11: Path, tau: float = 0.2, *, o
 
     if output:
         kwargs.update(driver="GTiff", dtype=rasterio.float32, count=1)
-        with rasterio.open(output, "w", **kwargs) as f:
-            f.write(is_cloud.astype(rasterio.float32))
+        write_raster(output, is_cloud.astype(rasterio.float32), kwargs)
 
     return cc_percentage
 
@@ -68,25 +175,46 @@ def cloud_mask(scl: Path, *, output: Path | None = None) -> np.ndarray:
     :param output: Path to output file.
     :return: Cloud cover mask (0 - no cloud, 1 - cloud).
     """
-    scl_cloud_values = [3, 8, 9, 10, 11]  # Classification band's cloud-related values.
-
     with rasterio.open(scl, "r") as f:
         kwargs = f.meta
         mask = f.read()
 
     # Calculate cloud mask from Sentinel's cloud related values.
-    mask = np.isin(mask, scl_cloud_values).astype(np.int8)
+    mask = np.isin(mask, SCL_CLOUD_VALUES).astype(np.int8)
 
     cloud_mask_10m, output_kwargs = rescale_band(mask, kwargs)
 
     if output:
         output_kwargs.update(driver="GTiff", dtype=rasterio.int8, count=1)
-        with rasterio.open(output, "w", **output_kwargs) as f:
-            f.write(cloud_mask_10m)
+        write_raster(output, cloud_mask_10m, output_kwargs)
 
     return cloud_mask_10m
 
 
+def aoi_cloud_percentage(scl: Path, geojson: Path, geojson_crs: str = "epsg:4326") -> float:
+    """
+    Computes the cloud percentage of an image inside an area of interest, based on the SCL raster provided by Sentinel.
+    Only the window of the SCL band covering the area is read.
+
+    :param scl: SCL band for Sentinel-2 (20m).
+    :param geojson: Area of interest in GeoJSON format.
+    :param geojson_crs: Coordinate reference system of the GeoJSON file.
+    :return: Percentage of cloudy pixels over valid ones inside the area. Areas without valid pixels return 100.
+    """
+    geometry = read_geojson(geojson)["features"][0]["geometry"]
+    with rasterio.open(scl, "r") as f:
+        aoi = project_shape(geometry, scs=geojson_crs, dcs=str(f.crs))
+        try:
+            classes, _ = mask.mask(f, shapes=[aoi], crop=True, filled=False)
+        except ValueError:
+            # Area of interest outside the image
+            return 100.0
+
+    valid = ~np.ma.getmaskarray(classes) & (classes.data != 0)
+    cloudy = valid & np.isin(classes.data, SCL_CLOUD_VALUES)
+    return 100 * np.count_nonzero(cloudy) / np.count_nonzero(valid) if valid.any() else 100.0
+
+
 def true_color(r: Path, g: Path, b: Path, *, output: Path | None = None) -> np.ndarray:
     """
     Computes true color image composite (RGB).
@@ -102,23 +230,28 @@ def true_color(r: Path, g: Path, b: Path, *, output: Path | None = None) -> np.n
     blue, _ = read(b)
 
     # Compose true color image.
-    # Adjust each band by the min-max, so it will plot as RGB.
     rgb_image_raw = np.concatenate((red, green, blue), axis=0)
 
-    max_pixel_value = rgb_image_raw.max(initial=0)
+    if output:
+        kwargs.update(driver="GTiff", dtype=rasterio.float32, nodata=0, count=3)
+        write_raster(output, rgb_image_raw, kwargs)
+        # Statistics of the output are streamed and cached next to it, so renderers, e.g. `quicklook`, reuse them.
+        limits = stretch_limits(raster_stats(output))
+        max_pixel_value = max((high for _, high in limits), default=0) if limits else 0
+    else:
+        max_pixel_value = np.nanmax(rgb_image_raw, initial=0)
+
+    # Adjust the bands by their maximum, so it will plot as RGB.
     rgb_image = np.multiply(rgb_image_raw, 255.0)
     rgb_image = np.divide(rgb_image, max_pixel_value)
     rgb_image = rgb_image.astype(np.uint8)
 
-    if output:
-        kwargs.update(driver="GTiff", dtype=rasterio.float32, nodata=0, count=3)
-        with rasterio.open(output, "w", **kwargs) as rgb:
-            rgb.write(rgb_image_raw)
-
     return rgb_image
 
 
-def moisture(b8a: Path, b11: Path, *, output: Path | None = None) -> np.ndarray:
+def moisture(
+    b8a: Path, b11: Path, *, valid: np.ndarray | None = None, backend: str | None = None, output: Path | None = None
+) -> np.ndarray:
     """
     Compute moisture index.
 
@@ -129,26 +262,28 @@ def moisture(b8a: Path, b11: Path, *, output: Path | None = None) -> np.ndarray:
 
     :param b8a: B8A band for Sentinel-2 (60m).
     :param b11: B11 band for Sentinel-2 (60m).
+    :param valid: Validity mask of the product, see `read_valid_mask`. Computed from the bands if not provided.
+    :param backend: Compute backend, see `compute.get_backend`.
     :param output: Path to output file.
     :return: Moisture index.
     """
-    band_8a, kwargs = read(b8a)
-    band_11, _ = read(b11)
+    band_8a, kwargs = read_band(b8a)
+    band_11, _ = read_band(b11)
 
-    moisture = (band_8a - band_11) / (band_8a + band_11)
+    moisture = evaluate(INDEX_EXPRESSIONS["moisture"], backend, b8a=band_8a, b11=band_11)
 
-    moisture[moisture == np.inf] = np.nan
-    moisture[moisture == -np.inf] = np.nan
+    moisture = masked(moisture, valid_mask(band_8a, band_11) if valid is None else valid)
 
     if output:
         kwargs.update(driver="GTiff", dtype=rasterio.float32, nodata=np.nan, count=1)
-        with rasterio.open(output, "w", **kwargs) as f:
-            f.write(moisture.astype(rasterio.float32))
+        write_raster(output, moisture, kwargs)
 
     return moisture
 
 
-def ndvi(b4: Path, b8: Path, *, output: Path | None = None) -> np.ndarray:
+def ndvi(
+    b4: Path, b8: Path, *, valid: np.ndarray | None = None, backend: str | None = None, output: Path | None = None
+) -> np.ndarray:
     """
     Compute Normalized Difference Vegetation Index (NDVI).
 
@@ -161,26 +296,28 @@ def ndvi(b4: Path, b8: Path, *, output: Path | None = None) -> np.ndarray:
 
     :param b4: RED - B04 band for Sentinel-2 (10m).
     :param b8: NIR - B08 band for Sentinel-2 (10m).
+    :param valid: Validity mask of the product, see `read_valid_mask`. Computed from the bands if not provided.
+    :param backend: Compute backend, see `compute.get_backend`.
     :param output: Path to output file.
     :return: NDVI index.
     """
-    red, kwargs = read(b4)
-    nir, _ = read(b8)
+    red, kwargs = read_band(b4)
+    nir, _ = read_band(b8)
 
-    ndvi = (nir - red) / (nir + red)
+    ndvi = evaluate(INDEX_EXPRESSIONS["ndvi"], backend, b4=red, b8=nir)
 
-    ndvi[ndvi == np.inf] = np.nan
-    ndvi[ndvi == -np.inf] = np.nan
+    ndvi = masked(ndvi, valid_mask(red, nir) if valid is None else valid)
 
     if output:
         kwargs.update(driver="GTiff", dtype=rasterio.float32, nodata=np.nan, count=1)
-        with rasterio.open(output, "w", **kwargs) as f:
-            f.write(ndvi.astype(rasterio.float32))
+        write_raster(output, ndvi, kwargs)
 
     return ndvi
 
 
-def ndsi(b3: Path, b11: Path, *, output: Path | None = None) -> np.ndarray:
+def ndsi(
+    b3: Path, b11: Path, *, valid: np.ndarray | None = None, backend: str | None = None, output: Path | None = None
+) -> np.ndarray:
     """
     Compute Normalized Difference Snow Index (NDSI) index.
     Values above 0.42 are usually snow.
@@ -189,27 +326,29 @@ def ndsi(b3: Path, b11: Path, *, output: Path | None = None) -> np.ndarray:
 
     :param b3: GREEN - B03 band for Sentinel-2 (20m).
     :param b11: SWIR - B11 band for Sentinel-2 (20m).
+    :param valid: Validity mask of the product, see `read_valid_mask`. Computed from the bands if not provided.
+    :param backend: Compute backend, see `compute.get_backend`.
     :param output: Path to output file.
     :return: NDSI index.
     """
-    band_3, kwargs = read(b3)
-    band_11, _ = read(b11)
+    band_3, kwargs = read_band(b3)
+    band_11, _ = read_band(b11)
 
-    ndsi = (band_3 - band_11) / (band_3 + band_11)
-    ndsi = (ndsi > 0.42) * 1.0  # TODO - apply threshold (values above 0.42 are regarded as snowy)
+    ndsi = evaluate(INDEX_EXPRESSIONS["ndsi"], backend, b3=band_3, b11=band_11)
+    ndsi = (ndsi > INDEX_THRESHOLDS["ndsi"]) * 1.0
 
-    ndsi[ndsi == np.inf] = np.nan
-    ndsi[ndsi == -np.inf] = np.nan
+    ndsi = masked(ndsi, valid_mask(band_3, band_11) if valid is None else valid)
 
     if output:
         kwargs.update(driver="GTiff", dtype=rasterio.float32, nodata=np.nan, count=1)
-        with rasterio.open(output, "w", **kwargs) as f:
-            f.write(ndsi.astype(rasterio.float32))
+        write_raster(output, ndsi, kwargs)
 
     return ndsi
 
 
-def ndwi(b3: Path, b8: Path, *, output: Path | None = None) -> np.ndarray:
+def ndwi(
+    b3: Path, b8: Path, *, valid: np.ndarray | None = None, backend: str | None = None, output: Path | None = None
+) -> np.ndarray:
     """
     Compute Normalized Difference Water Index (NDWI) index.
 
@@ -222,155 +361,185 @@ def ndwi(b3: Path, b8: Path, *, output: Path | None = None) -> np.ndarray:
 
     :param b3: GREEN - B03 band for Sentinel-2 (10m).
     :param b8: NIR - B08 band for Sentinel-2 (10m).
+    :param valid: Validity mask of the product, see `read_valid_mask`. Computed from the bands if not provided.
+    :param backend: Compute backend, see `compute.get_backend`.
     :param output: Path to output file.
     :return: NDWI index.
     """
-    band_3, kwargs = read(b3)
-    band_8, _ = read(b8)
+    band_3, kwargs = read_band(b3)
+    band_8, _ = read_band(b8)
 
-    ndwi = (band_3 - band_8) / (band_3 + band_8)
+    ndwi = evaluate(INDEX_EXPRESSIONS["ndwi"], backend, b3=band_3, b8=band_8)
 
-    ndwi[ndwi == np.inf] = np.nan
-    ndwi[ndwi == -np.inf] = np.nan
+    ndwi = masked(ndwi, valid_mask(band_3, band_8) if valid is None else valid)
 
     if output:
         kwargs.update(driver="GTiff", dtype=rasterio.float32, nodata=np.nan, count=1)
-        with rasterio.open(output, "w", **kwargs) as gtif:
-            gtif.write(ndwi.astype(rasterio.float32))
+        write_raster(output, ndwi, kwargs)
 
     return ndwi
 
 
-def evi2(b4: Path, b8: Path, *, output: Path | None = None) -> np.ndarray:
+def evi2(
+    b4: Path, b8: Path, *, valid: np.ndarray | None = None, backend: str | None = None, output: Path | None = None
+) -> np.ndarray:
     """
     Compute Enhanced Vegetation Index 2 (EVI2) index.
 
     :param b4: B04 band for Sentinel-2 (10m).
     :param b8: B08 band for Sentinel-2 (10m).
+    :param valid: Validity mask of the product, see `read_valid_mask`. Computed from the bands if not provided.
+    :param backend: Compute backend, see `compute.get_backend`.
     :param output: Path to output file.
     :return: EVI2 index.
     """
-    band_4, kwargs = read(b4)
-    band_8, _ = read(b8)
+    band_4, kwargs = read_band(b4)
+    band_8, _ = read_band(b8)
 
-    evi2 = 2.4 * ((band_8 - band_4) / (band_8 + band_4 + 1.0))
+    evi2 = evaluate(INDEX_EXPRESSIONS["evi2"], backend, b4=band_4, b8=band_8)
 
-    evi2[evi2 == np.inf] = np.nan
-    evi2[evi2 == -np.inf] = np.nan
+    evi2 = masked(evi2, valid_mask(band_4, band_8) if valid is None else valid)
 
     if output:
         kwargs.update(driver="GTiff", dtype=rasterio.float32, nodata=np.nan, count=1)
-        with rasterio.open(output, "w", **kwargs) as f:
-            f.write(evi2.astype(rasterio.float32))
+        write_raster(output, evi2, kwargs)
 
     return evi2
 
 
-def osavi(b4: Path, b8: Path, Y: float = 0.16, *, output: Path | None = None) -> np.ndarray:
+def osavi(
+    b4: Path,
+    b8: Path,
+    Y: float = 0.16,
+    *,
+    valid: np.ndarray | None = None,
+    backend: str | None = None,
+    output: Path | None = None,
+) -> np.ndarray:
     """
     Optimized Soil Adjusted Vegetation Index (OSAVI) index.
 
     :param b4: B04 band for Sentinel-2 (10m).
     :param b8: B08 band for Sentinel-2 (10m).
     :param Y: Y coefficient.
+    :param valid: Validity mask of the product, see `read_valid_mask`. Computed from the bands if not provided.
+    :param backend: Compute backend, see `compute.get_backend`.
     :param output: Path to output file.
     :return: OSAVI index.
     """
-    band_4, kwargs = read(b4)
-    band_8, _ = read(b8)
+    band_4, kwargs = read_band(b4)
+    band_8, _ = read_band(b8)
 
-    osavi = (1 + Y) * (band_8 - band_4) / (band_8 + band_4 + Y)
+    osavi = evaluate(INDEX_EXPRESSIONS["osavi"], backend, b4=band_4, b8=band_8, Y=Y)
 
-    osavi[osavi == np.inf] = np.nan
-    osavi[osavi == -np.inf] = np.nan
+    osavi = masked(osavi, valid_mask(band_4, band_8) if valid is None else valid)
 
     if output:
         kwargs.update(driver="GTiff", dtype=rasterio.float32, nodata=np.nan, count=1)
-        with rasterio.open(output, "w", **kwargs) as f:
-            f.write(osavi.astype(rasterio.float32))
+        write_raster(output, osavi, kwargs)
 
     return osavi
 
 
-def ndre(b5: Path, b9: Path, *, output: Path | None = None) -> np.ndarray:
+def ndre(
+    b5: Path, b9: Path, *, valid: np.ndarray | None = None, backend: str | None = None, output: Path | None = None
+) -> np.ndarray:
     """
     Normalized Difference NIR/Rededge Normalized Difference Red-Edge (NDRE) index.
 
     :param b5: B05 band for Sentinel-2 (60m).
     :param b9: B09 band for Sentinel-2 (60m).
+    :param valid: Validity mask of the product, see `read_valid_mask`. Computed from the bands if not provided.
+    :param backend: Compute backend, see `compute.get_backend`.
     :param output: Path to output file.
     :return: NDRE index.
     """
-    band_5, kwargs = read(b5)
-    band_9, _ = read(b9)
+    band_5, kwargs = read_band(b5)
+    band_9, _ = read_band(b9)
 
-    ndre = (band_9 - band_5) / (band_9 + band_5)
+    ndre = evaluate(INDEX_EXPRESSIONS["ndre"], backend, b5=band_5, b9=band_9)
 
-    ndre[ndre == np.inf] = np.nan
-    ndre[ndre == -np.inf] = np.nan
+    ndre = masked(ndre, valid_mask(band_5, band_9) if valid is None else valid)
 
     if output:
         kwargs.update(driver="GTiff", dtype=rasterio.float32, nodata=np.nan, count=1)
-        with rasterio.open(output, "w", **kwargs) as f:
-            f.write(ndre.astype(rasterio.float32))
+        write_raster(output, ndre, kwargs)
 
     return ndre
 
 
-def mndwi(b3: Path, b11: Path, *, output: Path | None = None) -> np.ndarray:
+def mndwi(
+    b3: Path, b11: Path, *, valid: np.ndarray | None = None, backend: str | None = None, output: Path | None = None
+) -> np.ndarray:
     """
     Modified NDWI (MNDWI) index.
 
     :param b3: B03 band for Sentinel-2 (20m).
     :param b11: B11 band for Sentinel-2 (20m).
+    :param valid: Validity mask of the product, see `read_valid_mask`. Computed from the bands if not provided.
+    :param backend: Compute backend, see `compute.get_backend`.
     :param output: Path to output file.
     :return: MNDWI index.
     """
-    band_3, kwargs = read(b3)
-    band_11, _ = read(b11)
+    band_3, kwargs = read_band(b3)
+    band_11, _ = read_band(b11)
 
-    mndwi = (band_3 - band_11) / (band_3 + band_11)
+    mndwi = evaluate(INDEX_EXPRESSIONS["mndwi"], backend, b3=band_3, b11=band_11)
 
-    mndwi[mndwi == np.inf] = np.nan
-    mndwi[mndwi == -np.inf] = np.nan
+    mndwi = masked(mndwi, valid_mask(band_3, band_11) if valid is None else valid)
 
     if output:
         kwargs.update(driver="GTiff", dtype=rasterio.float32, nodata=np.nan, count=1)
-        with rasterio.open(output, "w", **kwargs) as f:
-            f.write(mndwi.astype(rasterio.float32))
+        write_raster(output, mndwi, kwargs)
 
     return mndwi
 
 
-def bri(b3: Path, b5: Path, b8: Path, *, output: Path | None = None) -> np.ndarray:
+def bri(
+    b3: Path,
+    b5: Path,
+    b8: Path,
+    *,
+    valid: np.ndarray | None = None,
+    backend: str | None = None,
+    output: Path | None = None,
+) -> np.ndarray:
     """
     Browning Reflectance Index (BRI) index.
 
     :param b3: B03 band for Sentinel-2 (10m).
     :param b5: B05 band for Sentinel-2 (20m).
     :param b8: B08 band for Sentinel-2 (10m).
+    :param valid: Validity mask of the product, see `read_valid_mask`. Computed from the bands if not provided.
+    :param backend: Compute backend, see `compute.get_backend`.
     :param output: Path to output file.
     :return: BRI index.
     """
-    band_3, kwargs = read(b3)
-    band_5, kwargs_5 = read(b5)
+    band_3, kwargs = read_band(b3)
+    band_5, kwargs_5 = read_band(b5)
     band_5, _ = rescale_band(band_5, kwargs_5)
-    band_8, _ = read(b8)
+    band_8, _ = read_band(b8)
 
-    bri = (1 / band_3 - 1 / band_5) / band_8
+    bri = evaluate(INDEX_EXPRESSIONS["bri"], backend, b3=band_3, b5=band_5, b8=band_8)
 
-    bri[bri == np.inf] = np.nan
-    bri[bri == -np.inf] = np.nan
+    bri = masked(bri, valid_mask(band_3, band_5, band_8) if valid is None else valid)
 
     if output:
         kwargs.update(driver="GTiff", dtype=rasterio.float32, nodata=np.nan, count=1)
-        with rasterio.open(output, "w", **kwargs) as f:
-            f.write(bri.astype(rasterio.float32))
+        write_raster(output, bri, kwargs)
 
     return bri
 
 
-def evi(b2: Path, b4: Path, b8: Path, *, output: Path | None = None) -> np.ndarray:
+def evi(
+    b2: Path,
+    b4: Path,
+    b8: Path,
+    *,
+    valid: np.ndarray | None = None,
+    backend: str | None = None,
+    output: Path | None = None,
+) -> np.ndarray:
     """
     Compute Enhanced Vegetation Index (EVI) index.
     Its value ranges from -1 to 1, with healthy vegetation generally around 0.20 to 0.80.
@@ -383,27 +552,29 @@ def evi(b2: Path, b4: Path, b8: Path, *, output: Path | None = None) -> np.ndarr
     :param b2: B02 band for Sentinel-2 (10m).
     :param b4: B04 band for Sentinel-2 (10m).
     :param b8: B08 band for Sentinel-2 (10m).
+    :param valid: Validity mask of the product, see `read_valid_mask`. Computed from the bands if not provided.
+    :param backend: Compute backend, see `compute.get_backend`.
     :param output: Path to output file.
     :return: EVI index.
     """
-    band_2, kwargs = read(b2)
-    band_4, _ = read(b4)
-    band_8, _ = read(b8)
+    band_2, kwargs = read_band(b2)
+    band_4, _ = read_band(b4)
+    band_8, _ = read_band(b8)
 
-    evi = (2.5 * (band_8 - band_4)) / ((band_8 + 6 * band_4 - 7.5 * band_2) + 1)
+    evi = evaluate(INDEX_EXPRESSIONS["evi"], backend, b2=band_2, b4=band_4, b8=band_8)
 
-    evi[evi == np.inf] = np.nan
-    evi[evi == -np.inf] = np.nan
+    evi = masked(evi, valid_mask(band_2, band_4, band_8) if valid is None else valid)
 
     if output:
         kwargs.update(driver="GTiff", dtype=rasterio.float32, nodata=np.nan, count=1)
-        with rasterio.open(output, "w", **kwargs) as f:
-            f.write(evi.astype(rasterio.float32))
+        write_raster(output, evi, kwargs)
 
     return evi
 
 
-def ndyi(b2: Path, b3: Path, *, output: Path | None = None) -> np.ndarray:
+def ndyi(
+    b2: Path, b3: Path, *, valid: np.ndarray | None = None, backend: str | None = None, output: Path | None = None
+) -> np.ndarray:
     """
     Compute Normalized Difference Yellow Index (NDYI) index.
 
@@ -411,76 +582,89 @@ def ndyi(b2: Path, b3: Path, *, output: Path | None = None) -> np.ndarray:
 
     :param b2: B02 band for Sentinel-2 (10m).
     :param b3: B03 band for Sentinel-2 (10m).
+    :param valid: Validity mask of the product, see `read_valid_mask`. Computed from the bands if not provided.
+    :param backend: Compute backend, see `compute.get_backend`.
     :param output: Path to output file.
     :return: NDYI index.
     """
-    band_2, kwargs = read(b2)
-    band_3, _ = read(b3)
+    band_2, kwargs = read_band(b2)
+    band_3, _ = read_band(b3)
 
-    ndyi = (band_3 - band_2) / (band_3 + band_2)
+    ndyi = evaluate(INDEX_EXPRESSIONS["ndyi"], backend, b2=band_2, b3=band_3)
 
-    ndyi[ndyi == np.inf] = np.nan
-    ndyi[ndyi == -np.inf] = np.nan
+    ndyi = masked(ndyi, valid_mask(band_2, band_3) if valid is None else valid)
 
     if output:
         kwargs.update(driver="GTiff", dtype=rasterio.float32, nodata=np.nan, count=1)
-        with rasterio.open(output, "w", **kwargs) as f:
-            f.write(ndyi.astype(rasterio.float32))
+        write_raster(output, ndyi, kwargs)
 
     return ndyi
 
 
-def ri(b3: Path, b4: Path, *, output: Path | None = None) -> np.ndarray:
+def ri(
+    b3: Path, b4: Path, *, valid: np.ndarray | None = None, backend: str | None = None, output: Path | None = None
+) -> np.ndarray:
     """
     Compute Normalized Difference Red/Green Redness (RI) index.
 
     :param b3: B03 band for Sentinel-2 (10m).
     :param b4: B04 band for Sentinel-2 (10m).
+    :param valid: Validity mask of the product, see `read_valid_mask`. Computed from the bands if not provided.
+    :param backend: Compute backend, see `compute.get_backend`.
     :param output: Path to output file.
     :return: RI index.
     """
-    band_3, kwargs = read(b3)
-    band_4, _ = read(b4)
+    band_3, kwargs = read_band(b3)
+    band_4, _ = read_band(b4)
 
-    ri = (band_4 - band_3) / (band_4 + band_3)
+    ri = evaluate(INDEX_EXPRESSIONS["ri"], backend, b3=band_3, b4=band_4)
 
-    ri[ri == np.inf] = np.nan
-    ri[ri == -np.inf] = np.nan
+    ri = masked(ri, valid_mask(band_3, band_4) if valid is None else valid)
 
     if output:
         kwargs.update(driver="GTiff", dtype=rasterio.float32, nodata=np.nan, count=1)
-        with rasterio.open(output, "w", **kwargs) as f:
-            f.write(ri.astype(rasterio.float32))
+        write_raster(output, ri, kwargs)
 
     return ri
 
 
-def cri1(b2: Path, b3: Path, *, output: Path | None = None) -> np.ndarray:
+def cri1(
+    b2: Path, b3: Path, *, valid: np.ndarray | None = None, backend: str | None = None, output: Path | None = None
+) -> np.ndarray:
     """
     Compute Carotenoid Reflectance (CRI1) index.
 
     :param b2: B02 band for Sentinel-2 (10m).
     :param b3: B03 band for Sentinel-2 (10m).
+    :param valid: Validity mask of the product, see `read_valid_mask`. Computed from the bands if not provided.
+    :param backend: Compute backend, see `compute.get_backend`.
     :param output: Path to output file.
     :return: CRI1 index.
     """
-    band_2, kwargs = read(b2)
-    band_3, _ = read(b3)
+    band_2, kwargs = read_band(b2)
+    band_3, _ = read_band(b3)
 
-    cri1 = (1 / band_2) / (1 / band_3)
+    cri1 = evaluate(INDEX_EXPRESSIONS["cri1"], backend, b2=band_2, b3=band_3)
 
-    cri1[cri1 == np.inf] = np.nan
-    cri1[cri1 == -np.inf] = np.nan
+    cri1 = masked(cri1, valid_mask(band_2, band_3) if valid is None else valid)
 
     if output:
         kwargs.update(driver="GTiff", dtype=rasterio.float32, nodata=np.nan, count=1)
-        with rasterio.open(output, "w", **kwargs) as f:
-            f.write(cri1.astype(rasterio.float32))
+        write_raster(output, cri1, kwargs)
 
     return cri1
 
 
-def bsi(b2: Path, b4: Path, b8: Path, b11: Path, *, output: Path | None = None) -> np.ndarray:
+def bsi(
+    b2: Path,
+    b4: Path,
+    b8: Path,
+    b11: Path,
+    *,
+    valid: np.ndarray | None = None,
+    backend: str | None = None,
+    output: Path | None = None,
+) -> np.ndarray:
     """
     Bare Soil Index (BSI) is a numerical indicator to capture soil variations.
 
@@ -488,23 +672,23 @@ def bsi(b2: Path, b4: Path, b8: Path, b11: Path, *, output: Path | None = None)
     :param b4: RED band (B04 for Sentinel-2 (10m)).
     :param b8: NIR band (B08 for Sentinel-2 (10m)).
     :param b11: SWIR band (B11 for Sentinel-2 (20m)).
+    :param valid: Validity mask of the product, see `read_valid_mask`. Computed from the bands if not provided.
+    :param backend: Compute backend, see `compute.get_backend`.
     :param output: Path to output file.
     :return: BSI index.
     """
-    band_2, kwargs = read(b2)
-    band_4, _ = read(b4)
-    band_8, _ = read(b8)
-    band_11, kwargs_11 = read(b11)
+    band_2, kwargs = read_band(b2)
+    band_4, _ = read_band(b4)
+    band_8, _ = read_band(b8)
+    band_11, kwargs_11 = read_band(b11)
     band_11, _ = rescale_band(band_11, kwargs_11)
 
-    bsi = ((band_11 + band_4) - (band_8 + band_2)) / ((band_11 + band_4) + (band_8 + band_2))
+    bsi = evaluate(INDEX_EXPRESSIONS["bsi"], backend, b2=band_2, b4=band_4, b8=band_8, b11=band_11)
 
-    bsi[bsi == np.inf] = np.nan
-    bsi[bsi == -np.inf] = np.nan
+    bsi = masked(bsi, valid_mask(band_2, band_4, band_8, band_11) if valid is None else valid)
 
     if output:
         kwargs.update(driver="GTiff", dtype=rasterio.float32, nodata=np.nan, count=1)
-        with rasterio.open(output, "w", **kwargs) as gtif:
-            gtif.write(bsi.astype(rasterio.float32))
+        write_raster(output, bsi, kwargs)
 
     return bsi
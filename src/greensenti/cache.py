@@ -0,0 +1,188 @@
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where files are placed by hardlink or copy.
+    fcntl = None
+
+# Linux ioctl to clone a file (reflink), sharing its blocks copy-on-write, e.g., in Btrfs or XFS.
+FICLONE = 0x40049409
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_size(size: str | int) -> int:
+    """
+    Parses a size in bytes, with an optional unit, e.g., "500M" or "50G".
+
+    :param size: Size.
+    :return: Size in bytes.
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*", str(size), flags=re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid size {size}, expected a number of bytes with an optional unit, e.g., 50G.")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def max_cache_size() -> int | None:
+    """
+    Gets the size cap of the product cache.
+
+    :return: Taken from enviroment as GREENSENTI_PRODUCT_CACHE_SIZE if available, in bytes. Defaults to no cap.
+    """
+    size = os.environ.get("GREENSENTI_PRODUCT_CACHE_SIZE")
+    return parse_size(size) if size else None
+
+
+def object_path(cache: Path, md5: str) -> Path:
+    """
+    Gets the location of a file in the cache, which is addressed by its content.
+
+    :param cache: Cache folder.
+    :param md5: Hexadecimal MD5 checksum of the file.
+    :return: Path to cached file.
+    """
+    return Path(cache, "objects", md5[:2], md5.lower())
+
+
+def link_file(source: Path, target: Path) -> None:
+    """
+    Places a file at another path without copying its data if possible: by reflink, which is safe to modify, else by
+    hardlink, else by copy. The target is replaced atomically.
+
+    :param source: Path to source file.
+    :param target: Path to target file.
+    """
+    target = Path(target)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(f"{target.name}.{os.getpid()}.{threading.get_ident()}.link")
+    tmp.unlink(missing_ok=True)
+
+    try:
+        if fcntl is None:
+            raise OSError("Reflinks are not supported")
+        with open(source, "rb") as src, open(tmp, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    except OSError:
+        tmp.unlink(missing_ok=True)
+        try:
+            os.link(source, tmp)
+        except OSError:
+            shutil.copyfile(source, tmp)
+
+    os.replace(tmp, target)
+
+
+def get(cache: Path, md5: str | None, target: Path) -> bool:
+    """
+    Places a cached file at a path, marking it as recently used.
+
+    :param cache: Cache folder.
+    :param md5: Hexadecimal MD5 checksum of the file.
+    :param target: Path to place the file at.
+    :return: True if the file was cached.
+    """
+    if not md5:
+        return False
+    cached = object_path(cache, md5)
+    try:
+        link_file(cached, target)
+        # Access time (set explicitly, as filesystems may not update it) tracks the least recently used files.
+        os.utime(cached, ns=(time.time_ns(), cached.stat().st_mtime_ns))
+    except FileNotFoundError:
+        # Not cached, or evicted meanwhile
+        return False
+    return True
+
+
+def put(cache: Path, md5: str | None, source: Path, max_size: int | None = None) -> None:
+    """
+    Adds a downloaded file to the cache, evicting the least recently used files above the size cap.
+
+    :param cache: Cache folder.
+    :param md5: Hexadecimal MD5 checksum of the file.
+    :param source: Path to file.
+    :param max_size: Size cap of the cache, in bytes. Defaults to `max_cache_size`.
+    """
+    if not md5:
+        return
+    cached = object_path(cache, md5)
+    if not cached.is_file():
+        link_file(source, cached)
+    evict(cache, max_size if max_size is not None else max_cache_size())
+
+
+def evict(cache: Path, max_size: int | None) -> int:
+    """
+    Removes the least recently used files of the cache until it fits a size cap. Files already placed in outputs by
+    hardlink or reflink are kept there.
+
+    Files hardlinked to outputs take no disk space of their own, so they are not counted in the cache size nor
+    evicted, until their outputs are removed. Reflinked files can't be told apart from copies, so they are counted.
+
+    :param cache: Cache folder.
+    :param max_size: Size cap of the cache, in bytes. If not provided, nothing is removed.
+    :return: Number of bytes removed.
+    """
+    if max_size is None:
+        return 0
+
+    objects = []
+    for path in Path(cache, "objects").glob("*/*"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        if stat.st_nlink == 1:
+            objects.append((stat.st_atime_ns, stat.st_size, path))
+
+    size = sum(object_size for _, object_size, _ in objects)
+    removed = 0
+    for _, object_size, path in sorted(objects, key=lambda x: x[0]):
+        if size - removed <= max_size:
+            break
+        path.unlink(missing_ok=True)
+        removed += object_size
+    return removed
+
+
+def _index_path(cache: Path, key: str) -> Path:
+    return Path(cache, "index", f"{key}.json")
+
+
+def get_product(cache: Path, key: str) -> dict | None:
+    """
+    Gets the cached files of a product whose checksums are not known before downloading it, e.g., a DHuS zip file.
+
+    :param cache: Cache folder.
+    :param key: Product identity, e.g., its DHuS id.
+    :return: Product entry, with the name and checksum of its files, or None if not cached.
+    """
+    index = _index_path(cache, key)
+    if not index.is_file():
+        return None
+    with open(index) as f:
+        return json.load(f)
+
+
+def put_product(cache: Path, key: str, **entry) -> None:
+    """
+    Records the files of a product in the cache index, after adding them with `put`.
+
+    :param cache: Cache folder.
+    :param key: Product identity, e.g., its DHuS id.
+    :param entry: Product entry, e.g., `title="<title>", files={"<title>.zip": "<md5>"}`.
+    """
+    index = _index_path(cache, key)
+    index.parent.mkdir(parents=True, exist_ok=True)
+    tmp = index.with_name(f"{index.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(entry, f)
+    os.replace(tmp, index)
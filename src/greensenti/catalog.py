@@ -0,0 +1,229 @@
+import json
+import os
+import re
+import sqlite3
+from contextlib import closing, contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, List
+
+import pandas as pd
+
+# Product statuses, in the order a product goes through them.
+STATUSES = ("queried", "triggered", "failed", "cloudy", "downloaded", "unzipped", "processed")
+
+# Statuses of products whose data is available locally.
+READY_STATUSES = ("downloaded", "unzipped", "processed")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    title TEXT PRIMARY KEY,
+    uuid TEXT,
+    tile TEXT,
+    sensing_date TEXT,
+    cloud_cover REAL,
+    footprint TEXT,
+    metadata TEXT,
+    status TEXT NOT NULL DEFAULT 'queried',
+    path TEXT,
+    updated TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS products_tile_date ON products (tile, sensing_date);
+CREATE INDEX IF NOT EXISTS products_uuid ON products (uuid);
+CREATE TABLE IF NOT EXISTS outputs (
+    title TEXT NOT NULL REFERENCES products (title),
+    name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    updated TEXT NOT NULL,
+    PRIMARY KEY (title, name)
+);
+"""
+
+TILE_PATTERN = re.compile(r"_T(\d{2}[A-Z]{3})_")
+
+
+@contextmanager
+def connect(catalog: Path) -> Iterator[sqlite3.Connection]:
+    """
+    Opens the local product catalog, creating it if needed. Changes are committed on exit.
+
+    :param catalog: Path to SQLite catalog file.
+    :return: SQLite connection.
+    """
+    Path(catalog).parent.mkdir(parents=True, exist_ok=True)
+    with closing(sqlite3.connect(catalog, timeout=30)) as conn:
+        conn.row_factory = sqlite3.Row
+        conn.executescript(SCHEMA)
+        with conn:
+            yield conn
+
+
+def get_tile(title: str) -> str | None:
+    """
+    Gets the MGRS tile of a Sentinel-2 product from its title.
+
+    :param title: Sentinel-2 product title, e.g., S2B_MSIL2A_20221005T105819_N0400_R094_T30SUF_20221005T135951.
+    :return: Tile id, e.g., 30SUF.
+    """
+    match = TILE_PATTERN.search(title)
+    return match.group(1) if match else None
+
+
+def register_products(catalog: Path, products_df: pd.DataFrame) -> None:
+    """
+    Adds the products of a query to the catalog, or updates their metadata if they are already in it.
+    The status of known products is kept.
+
+    :param catalog: Path to SQLite catalog file.
+    :param products_df: Products dataframe, as returned by `SentinelAPI.to_dataframe`.
+    """
+    records = json.loads(products_df.to_json(orient="records", date_format="iso"))
+    now = datetime.now().isoformat()
+    with connect(catalog) as conn:
+        conn.executemany(
+            """
+            INSERT INTO products (title, uuid, tile, sensing_date, cloud_cover, footprint, metadata, updated)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (title) DO UPDATE SET
+                uuid = excluded.uuid,
+                tile = excluded.tile,
+                sensing_date = excluded.sensing_date,
+                cloud_cover = excluded.cloud_cover,
+                footprint = excluded.footprint,
+                metadata = excluded.metadata
+            """,
+            [
+                (
+                    record["title"],
+                    record.get("uuid", record.get("id")),
+                    get_tile(record["title"]),
+                    record.get("beginposition"),
+                    record.get("cloudcoverpercentage"),
+                    record.get("footprint"),
+                    json.dumps(record),
+                    now,
+                )
+                for record in records
+            ],
+        )
+
+
+def set_status(catalog: Path, title: str, status: str, path: Path | None = None) -> None:
+    """
+    Updates the status of a product in the catalog.
+
+    :param catalog: Path to SQLite catalog file.
+    :param title: Sentinel-2 product title.
+    :param status: New status, one of `STATUSES`.
+    :param path: Location of the product files.
+    """
+    if status not in STATUSES:
+        raise ValueError(f"Unknown status {status}, expected one of {STATUSES}.")
+    with connect(catalog) as conn:
+        conn.execute(
+            """
+            INSERT INTO products (title, tile, status, path, updated) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (title) DO UPDATE SET
+                status = excluded.status, path = coalesce(excluded.path, path), updated = excluded.updated
+            """,
+            (title, get_tile(title), status, str(path) if path else None, datetime.now().isoformat()),
+        )
+
+
+def add_output(catalog: Path, title: str, name: str, path: Path) -> None:
+    """
+    Records a file processed from a product, e.g., an index, and marks the product as processed.
+
+    :param catalog: Path to SQLite catalog file.
+    :param title: Sentinel-2 product title.
+    :param name: Output name, e.g., "ndvi".
+    :param path: Path to output file.
+    """
+    now = datetime.now().isoformat()
+    with connect(catalog) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO outputs (title, name, path, updated) VALUES (?, ?, ?, ?)",
+            (title, name, str(path), now),
+        )
+        conn.execute("UPDATE products SET status = 'processed', updated = ? WHERE title = ?", (now, title))
+
+
+def ready_products(catalog: Path, titles: List[str]) -> dict[str, dict]:
+    """
+    Finds the products already available locally.
+
+    :param catalog: Path to SQLite catalog file.
+    :param titles: Sentinel-2 product titles.
+    :return: Dictionary of titles of the products that are downloaded, unzipped or processed to their status and
+     location.
+    """
+    with connect(catalog) as conn:
+        conn.execute("CREATE TEMP TABLE wanted (title TEXT PRIMARY KEY)")
+        conn.executemany("INSERT OR IGNORE INTO wanted VALUES (?)", [(title,) for title in titles])
+        rows = conn.execute(
+            f"""
+            SELECT products.title, status, path FROM products JOIN wanted ON products.title = wanted.title
+            WHERE status IN ({",".join("?" * len(READY_STATUSES))})
+            """,
+            READY_STATUSES,
+        ).fetchall()
+    return {row["title"]: {"status": row["status"], "path": row["path"]} for row in rows}
+
+
+def products(
+    tile: str | None = None,
+    month: str | None = None,
+    status: str | List[str] | None = None,
+    *,
+    catalog: Path = os.environ.get("GREENSENTI_CATALOG", None),
+) -> List[dict]:
+    """
+    Searches the local catalog, without touching the filesystem or the remote API.
+
+    :param tile: MGRS tile, e.g., 30SUF.
+    :param month: Sensing month %Y-%m, e.g., 2022-10.
+    :param status: Product status or list of statuses, e.g., "downloaded". Use "ready" for downloaded, unzipped or
+     processed.
+    :param catalog: Path to SQLite catalog file. Taken from enviroment as GREENSENTI_CATALOG if available.
+    :return: List of products, with their status, location and processed outputs.
+    """
+    if not catalog:
+        raise ValueError("A catalog file is required, set it with `--catalog` or GREENSENTI_CATALOG.")
+
+    statuses = READY_STATUSES if status == "ready" else [status] if isinstance(status, str) else status
+
+    query = "SELECT * FROM products WHERE 1 = 1"
+    params: list = []
+    if tile:
+        query += " AND tile = ?"
+        params.append(tile.removeprefix("T"))
+    if month:
+        query += " AND sensing_date LIKE ?"
+        params.append(f"{month}%")
+    if statuses:
+        query += f" AND status IN ({','.join('?' * len(statuses))})"
+        params.extend(statuses)
+
+    with connect(catalog) as conn:
+        rows = conn.execute(query + " ORDER BY sensing_date, title", params).fetchall()
+        outputs = conn.execute(
+            f"SELECT title, name, path FROM outputs WHERE title IN (SELECT title FROM ({query}))", params
+        ).fetchall()
+
+    processed: dict[str, dict] = {}
+    for output in outputs:
+        processed.setdefault(output["title"], {})[output["name"]] = output["path"]
+
+    return [
+        {
+            "title": row["title"],
+            "uuid": row["uuid"],
+            "tile": row["tile"],
+            "sensing_date": row["sensing_date"],
+            "cloud_cover": row["cloud_cover"],
+            "status": row["status"],
+            "path": row["path"],
+            "outputs": processed.get(row["title"], {}),
+        }
+        for row in rows
+    ]
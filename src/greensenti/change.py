@@ -0,0 +1,110 @@
+from contextlib import ExitStack
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.features import geometry_mask
+from rasterio.warp import Resampling, transform_bounds
+from sentinelsat import read_geojson
+from shapely.geometry import box
+
+from greensenti.mosaic import aligned_grid, warped, windows
+from greensenti.raster import (
+    build_overviews,
+    default_overviews,
+    project_shape,
+    write_profile,
+)
+from greensenti.stats import raster_stats
+
+# Change between two dates, computed pixel by pixel.
+CHANGE_OPERATIONS = ("difference", "ratio")
+
+
+def change_detection(
+    before: Path,
+    after: Path,
+    output: Path,
+    *,
+    operation: str = "difference",
+    geojson: Path | None = None,
+    geojson_crs: str = "epsg:4326",
+    crs: str | None = None,
+    resolution: float | None = None,
+    resampling: str = "nearest",
+    window_size: int = 512,
+) -> list[dict]:
+    """
+    Computes the change of an index between two dates, e.g., ΔNDVI, as the difference (after - before) or ratio
+    (after / before) of two rasters.
+
+    Rasters may have different grids, e.g., cropped by different shapes or in different CRS. Both are reprojected onto
+    a canonical grid, snapped to multiples of the resolution as Sentinel-2 tiles, that covers their intersection. The
+    change is computed window by window, so memory usage doesn't depend on the size of the rasters.
+
+    :param before: Path to index raster of the first date.
+    :param after: Path to index raster of the second date.
+    :param output: Path to output file.
+    :param operation: Change operation, one of "difference" or "ratio".
+    :param geojson: Area of interest in GeoJSON format. If provided, the change is only computed inside it.
+    :param geojson_crs: Coordinate reference system of the GeoJSON file.
+    :param crs: Coordinate reference system of the output. Defaults to the one of the first raster.
+    :param resolution: Resolution of the output. Defaults to the one of the first raster.
+    :param resampling: Resampling method, one of `rasterio.enums.Resampling`.
+    :param window_size: Size in pixels of the windows the change is computed by.
+    :return: Statistics of the change raster, see `stats.raster_stats`.
+    """
+    if operation not in CHANGE_OPERATIONS:
+        raise ValueError(f"Unknown change operation {operation}, expected one of {CHANGE_OPERATIONS}.")
+
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+
+    with rasterio.open(before) as first, rasterio.open(after) as second:
+        crs = crs or first.crs
+        resolution = resolution or first.res[0]
+        extent = box(*transform_bounds(first.crs, crs, *first.bounds)).intersection(
+            box(*transform_bounds(second.crs, crs, *second.bounds))
+        )
+
+    aoi = None
+    if geojson:
+        geom = read_geojson(geojson)["features"][0]["geometry"]
+        aoi = project_shape(geom, scs=geojson_crs, dcs=str(crs))
+        extent = extent.intersection(aoi)
+    if extent.is_empty:
+        raise ValueError(f"Rasters {before} and {after} don't overlap.")
+
+    kwargs = {
+        "driver": "GTiff",
+        "dtype": rasterio.float32,
+        "count": 1,
+        "nodata": np.nan,
+        **aligned_grid(extent.bounds, crs, resolution),
+    }
+
+    with ExitStack() as stack, rasterio.open(output, "w", **write_profile(kwargs)) as dst:
+        sources = [
+            stack.enter_context(warped(stack.enter_context(rasterio.open(filename)), kwargs, Resampling[resampling]))
+            for filename in (before, after)
+        ]
+
+        for window in windows(dst.width, dst.height, window_size):
+            first, second = (vrt.read(1, window=window, masked=True).astype(np.float32) for vrt in sources)
+            valid = ~(np.ma.getmaskarray(first) | np.ma.getmaskarray(second))
+            if aoi is not None:
+                valid &= geometry_mask(
+                    [aoi], out_shape=(window.height, window.width), transform=dst.window_transform(window), invert=True
+                )
+
+            if operation == "difference":
+                change = second.data - first.data
+            else:
+                change = second.data / first.data
+            dst.write(np.where(valid & np.isfinite(change), change, np.float32(np.nan)), 1, window=window)
+
+    levels, overview_resampling = default_overviews()
+    if levels != "none":
+        build_overviews(output, levels=levels, resampling=overview_resampling)
+
+    return raster_stats(output)
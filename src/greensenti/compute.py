@@ -0,0 +1,86 @@
+import multiprocessing
+import os
+from functools import lru_cache
+from typing import Callable
+
+import numpy as np
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Backends band arithmetic expressions are evaluated with. NumPy is always available, numexpr and Numba evaluate them
+# with multiple threads, without temporary arrays for every operator.
+BACKENDS = ("numpy", "numexpr", "numba")
+
+_INSTALLED = {"numpy": True, "numexpr": numexpr is not None, "numba": numba is not None}
+_WARNED = set()
+
+
+def get_backend(backend: str | None = None) -> str:
+    """
+    Gets the compute backend to use, falling back to NumPy if it is not installed.
+
+    :param backend: Backend name, one of `BACKENDS`. Taken from enviroment as GREENSENTI_COMPUTE_BACKEND if not
+     provided, defaults to "numpy".
+    :return: Backend name.
+    """
+    backend = (backend or os.environ.get("GREENSENTI_COMPUTE_BACKEND") or "numpy").lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown compute backend {backend}, expected one of {BACKENDS}.")
+    if not _INSTALLED[backend]:
+        if backend not in _WARNED:
+            _WARNED.add(backend)
+            print(f"Warning: {backend} is not installed, falling back to numpy. Use `pip install {backend}`.")
+        return "numpy"
+    return backend
+
+
+def mp_context() -> multiprocessing.context.BaseContext:
+    """
+    Gets the multiprocessing context of process pools. Threads of the Numba (and numexpr) backends are not fork-safe,
+    so workers are started from a fork server where available.
+
+    :return: Multiprocessing context.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context()
+
+
+@lru_cache(maxsize=None)
+def _numba_kernel(expression: str, names: tuple[str, ...]) -> Callable:
+    # Expressions are the constant formulas of `band_arithmetic`, compiled once per process.
+    function = eval(f"lambda {', '.join(names)}: {expression}")
+    signature = f"float32({', '.join(['float32'] * len(names))})"
+    return numba.vectorize([signature], target="parallel")(function)
+
+
+def evaluate(expression: str, backend: str | None = None, **variables: np.ndarray | float) -> np.ndarray:
+    """
+    Evaluates an arithmetic expression of bands, e.g., "(b8 - b4) / (b8 + b4)", element-wise.
+
+    Expressions only use arithmetic operators, so the same definition is valid for every backend. Results are equal
+    up to float32 rounding, as numexpr and Numba may compute intermediate values with double precision.
+
+    :param expression: Arithmetic expression of the variables.
+    :param backend: Backend name, see `get_backend`.
+    :param variables: Band arrays and scalar coefficients, by name.
+    :return: Result array as float32.
+    """
+    backend = get_backend(backend)
+    if backend == "numexpr":
+        result = numexpr.evaluate(expression, local_dict=variables)
+    elif backend == "numba":
+        names = tuple(sorted(variables))
+        kernel = _numba_kernel(expression, names)
+        result = kernel(*[np.asarray(variables[name], dtype=np.float32) for name in names])
+    else:
+        result = eval(expression, {"__builtins__": {}}, variables)
+    return np.asarray(result, dtype=np.float32)
@@ -1,12 +1,41 @@
+import asyncio
+import hashlib
 import json
 import os
+import re
+import shutil
+import sys
+import threading
+import time
 import zipfile
-from datetime import datetime
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Iterator, List, Union
+from typing import AsyncIterator, Iterator, List, Union
+from urllib.parse import urlparse
 
+import numpy as np
+import pandas as pd
+import shapely.wkt
 from sentinelsat.exceptions import LTAError, LTATriggered
 from sentinelsat.sentinel import SentinelAPI, geojson_to_wkt, read_geojson
+from shapely.geometry import box
+
+from greensenti import cache as download_cache
+from greensenti import catalog as product_catalog
+from greensenti import lta
+from greensenti.band_arithmetic import aoi_cloud_percentage
+from greensenti.manifest import (
+    b64_to_hex,
+    complete_entries,
+    get_entry,
+    md5sum,
+    read_manifest,
+    update_entry,
+)
+from greensenti.raster import apply_mask
+from greensenti.storage import GCLOUD_BUCKET, Blob, LocalMirror, StorageBackend
 
 try:
     GCLOUD_DISABLED = False
@@ -28,6 +57,20 @@ def download_by_title(
     dhus_password: str = os.environ.get("DHUS_PASSWORD", None),
     dhus_host: str = os.environ.get("DHUS_HOST", None),
     gcloud: Path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS", None),
+    mirror: Path | None = os.environ.get("GREENSENTI_MIRROR", None),
+    shared_cache: Path | None = os.environ.get("GREENSENTI_PRODUCT_CACHE", None),
+    bands: List[str] | None = None,
+    resolution: int | None = None,
+    workers: int = 4,
+    max_per_host: int | None = None,
+    unzip_workers: int = 2,
+    catalog: Path | None = os.environ.get("GREENSENTI_CATALOG", None),
+    query_cache_ttl: int = 3600,
+    refresh: bool = False,
+    split_days: int | None = None,
+    split_degrees: float | None = None,
+    extract: str = "all",
+    wait_offline: bool = False,
 ) -> Iterator[dict]:
     """
     Downloads Sentinel-2 products from DHuS (Data Hub Service) or Google Cloud by a text match with the product title.
@@ -45,6 +88,31 @@ def download_by_title(
     :param dhus_password: Password from dhus service. Taken from enviroment as DHUS_PASSWORD if available.
     :param dhus_host: Host from dhus service. Taken from enviroment as DHUS_HOST if available.
     :param gcloud: Google Cloud credentials file. Taken from enviroment as GOOGLE_APPLICATION_CREDENTIALS if available.
+    :param mirror: Folder with a local mirror of the Google Cloud bucket to download products from, see
+     `greensenti.storage.LocalMirror`. Taken from enviroment as GREENSENTI_MIRROR if available.
+    :param shared_cache: Folder of a download cache shared by every output folder of the node, see
+     `greensenti.cache`. Taken from enviroment as GREENSENTI_PRODUCT_CACHE if available.
+    :param bands: Band names to download from Google Cloud or extract from DHuS products, e.g., ["B04", "B08", "SCL"].
+     Defaults to every band.
+    :param resolution: Resolution in meters of the bands to download from Google Cloud or extract from DHuS products.
+     Defaults to every resolution.
+    :param workers: Number of concurrent downloads.
+    :param max_per_host: Maximum concurrent downloads from the same DHuS host. Defaults to `workers`.
+    :param unzip_workers: Number of concurrent extractions of DHuS products.
+    :param catalog: Local SQLite product catalog. Queried products are recorded in it, and those already downloaded
+     to the output folder are not downloaded again, and yielded with their "path". Taken from enviroment as
+     GREENSENTI_CATALOG if available.
+    :param query_cache_ttl: Seconds query results are cached for. Queries of past date ranges are cached
+     indefinitely. Use 0 to disable the cache.
+    :param refresh: Ignore cached query results and search again.
+    :param split_days: Maximum days of the date range of each DHuS sub-query, see `query_products`. Defaults to
+     `QUERY_SPLIT_DAYS`, use 0 to not split by date.
+    :param split_degrees: Maximum size in degrees of the area of each DHuS sub-query. Defaults to
+     `QUERY_SPLIT_DEGREES`, use 0 to not split by area.
+    :param extract: How DHuS products are extracted, one of "all", "bands" (only the files selected by `bands` and
+     `resolution`) or "none" (bands are read from the zip file, see `find_band`).
+    :param wait_offline: Wait for offline products to be retrieved from the Long Term Archive and download them,
+     see `retrieve_offline`. Otherwise, they are yielded as "triggered" and can be retrieved later.
     :return: Yields an iterator of dictionaries with the product metadata and download status
     """
     yield from download(
@@ -59,6 +127,20 @@ def download_by_title(
         dhus_password=dhus_password,
         dhus_host=dhus_host,
         gcloud=gcloud,
+        mirror=mirror,
+        shared_cache=shared_cache,
+        bands=bands,
+        resolution=resolution,
+        workers=workers,
+        max_per_host=max_per_host,
+        unzip_workers=unzip_workers,
+        catalog=catalog,
+        query_cache_ttl=query_cache_ttl,
+        refresh=refresh,
+        split_days=split_days,
+        split_degrees=split_degrees,
+        extract=extract,
+        wait_offline=wait_offline,
     )
 
 
@@ -74,6 +156,24 @@ def download_by_geometry(
     dhus_password: str = os.environ.get("DHUS_PASSWORD", None),
     dhus_host: str = os.environ.get("DHUS_HOST", None),
     gcloud: Path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS", None),
+    mirror: Path | None = os.environ.get("GREENSENTI_MIRROR", None),
+    shared_cache: Path | None = os.environ.get("GREENSENTI_PRODUCT_CACHE", None),
+    bands: List[str] | None = None,
+    resolution: int | None = None,
+    workers: int = 4,
+    max_per_host: int | None = None,
+    unzip_workers: int = 2,
+    catalog: Path | None = os.environ.get("GREENSENTI_CATALOG", None),
+    query_cache_ttl: int = 3600,
+    refresh: bool = False,
+    split_days: int | None = None,
+    split_degrees: float | None = None,
+    extract: str = "all",
+    wait_offline: bool = False,
+    crop: bool = False,
+    max_aoi_clouds: float | None = None,
+    min_coverage: float = 0,
+    all_baselines: bool = False,
 ) -> Iterator[dict]:
     """
     Downloads Sentinel-2 products from DHuS (Data Hub Service) or Google Cloud by a given geometry in GeoJSON format.
@@ -91,6 +191,40 @@ def download_by_geometry(
     :param dhus_password: Password from dhus service. Taken from enviroment as DHUS_PASSWORD if available.
     :param dhus_host: Host from dhus service. Taken from enviroment as DHUS_HOST if available.
     :param gcloud: Google Cloud credentials file. Taken from enviroment as GOOGLE_APPLICATION_CREDENTIALS if available.
+    :param mirror: Folder with a local mirror of the Google Cloud bucket to download products from, see
+     `greensenti.storage.LocalMirror`. Taken from enviroment as GREENSENTI_MIRROR if available.
+    :param shared_cache: Folder of a download cache shared by every output folder of the node, see
+     `greensenti.cache`. Taken from enviroment as GREENSENTI_PRODUCT_CACHE if available.
+    :param bands: Band names to download from Google Cloud or extract from DHuS products, e.g., ["B04", "B08", "SCL"].
+     Defaults to every band.
+    :param resolution: Resolution in meters of the bands to download from Google Cloud or extract from DHuS products.
+     Defaults to every resolution.
+    :param workers: Number of concurrent downloads.
+    :param max_per_host: Maximum concurrent downloads from the same DHuS host. Defaults to `workers`.
+    :param unzip_workers: Number of concurrent extractions of DHuS products.
+    :param catalog: Local SQLite product catalog. Queried products are recorded in it, and those already downloaded
+     to the output folder are not downloaded again, and yielded with their "path". Taken from enviroment as
+     GREENSENTI_CATALOG if available.
+    :param query_cache_ttl: Seconds query results are cached for. Queries of past date ranges are cached
+     indefinitely. Use 0 to disable the cache.
+    :param refresh: Ignore cached query results and search again.
+    :param split_days: Maximum days of the date range of each DHuS sub-query, see `query_products`. Defaults to
+     `QUERY_SPLIT_DAYS`, use 0 to not split by date.
+    :param split_degrees: Maximum size in degrees of the area of each DHuS sub-query. Defaults to
+     `QUERY_SPLIT_DEGREES`, use 0 to not split by area.
+    :param extract: How DHuS products are extracted, one of "all", "bands" (only the files selected by `bands` and
+     `resolution`) or "none" (bands are read from the zip file, see `find_band`).
+    :param wait_offline: Wait for offline products to be retrieved from the Long Term Archive and download them,
+     see `retrieve_offline`. Otherwise, they are yielded as "triggered" and can be retrieved later.
+    :param crop: Crop the bands of each product by the GeoJSON geometry as soon as it is downloaded, and remove the
+     full tile files, see `crop_product`.
+    :param max_aoi_clouds: Max cloud percentage inside the GeoJSON geometry, according to the SCL band. Products above
+     it are yielded as "cloudy". From Google Cloud (or a mirror) the SCL band is fetched first, and the rest of bands
+     only for products below it. From DHuS, cloudy products are removed once downloaded. Percentages are recorded in
+     the manifest, so cloudy products are not downloaded again in later runs.
+    :param min_coverage: Min percentage of the GeoJSON geometry covered by the product footprint. Products at the edge
+     of an orbit may only cover a sliver of it.
+    :param all_baselines: Download every processing baseline of the same datatake, instead of only the latest one.
     :return: Yields an iterator of dictionaries with the product metadata and download status
     """
     yield from download(
@@ -105,6 +239,24 @@ def download_by_geometry(
         dhus_password=dhus_password,
         dhus_host=dhus_host,
         gcloud=gcloud,
+        mirror=mirror,
+        shared_cache=shared_cache,
+        bands=bands,
+        resolution=resolution,
+        workers=workers,
+        max_per_host=max_per_host,
+        unzip_workers=unzip_workers,
+        catalog=catalog,
+        query_cache_ttl=query_cache_ttl,
+        refresh=refresh,
+        split_days=split_days,
+        split_degrees=split_degrees,
+        extract=extract,
+        wait_offline=wait_offline,
+        crop=crop,
+        max_aoi_clouds=max_aoi_clouds,
+        min_coverage=min_coverage,
+        all_baselines=all_baselines,
     )
 
 
@@ -121,6 +273,24 @@ def download(
     dhus_password: str = os.environ.get("DHUS_PASSWORD", None),
     dhus_host: str = os.environ.get("DHUS_HOST", None),
     gcloud: Path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS", None),
+    mirror: Path | None = os.environ.get("GREENSENTI_MIRROR", None),
+    shared_cache: Path | None = os.environ.get("GREENSENTI_PRODUCT_CACHE", None),
+    bands: List[str] | None = None,
+    resolution: int | None = None,
+    workers: int = 4,
+    max_per_host: int | None = None,
+    unzip_workers: int = 2,
+    catalog: Path | None = os.environ.get("GREENSENTI_CATALOG", None),
+    query_cache_ttl: int = 3600,
+    refresh: bool = False,
+    split_days: int | None = None,
+    split_degrees: float | None = None,
+    extract: str = "all",
+    wait_offline: bool = False,
+    crop: bool = False,
+    max_aoi_clouds: float | None = None,
+    min_coverage: float = 0,
+    all_baselines: bool = False,
 ) -> Iterator[dict]:
     """
     Downloads Sentinel-2 products from DHuS (Data Hub Service) or Google Cloud.
@@ -139,11 +309,45 @@ def download(
     :param dhus_password: Password from dhus service. Taken from enviroment as DHUS_PASSWORD if available.
     :param dhus_host: Host from dhus service. Taken from enviroment as DHUS_HOST if available.
     :param gcloud: Google Cloud credentials file. Taken from enviroment as GOOGLE_APPLICATION_CREDENTIALS if available.
+    :param mirror: Folder with a local mirror of the Google Cloud bucket to download products from, see
+     `greensenti.storage.LocalMirror`. Taken from enviroment as GREENSENTI_MIRROR if available.
+    :param shared_cache: Folder of a download cache shared by every output folder of the node, see
+     `greensenti.cache`. Taken from enviroment as GREENSENTI_PRODUCT_CACHE if available.
+    :param bands: Band names to download from Google Cloud or extract from DHuS products, e.g., ["B04", "B08", "SCL"].
+     Defaults to every band.
+    :param resolution: Resolution in meters of the bands to download from Google Cloud or extract from DHuS products.
+     Defaults to every resolution.
+    :param workers: Number of concurrent downloads.
+    :param max_per_host: Maximum concurrent downloads from the same DHuS host. Defaults to `workers`.
+    :param unzip_workers: Number of concurrent extractions of DHuS products.
+    :param catalog: Local SQLite product catalog. Queried products are recorded in it, and those already downloaded
+     to the output folder are not downloaded again, and yielded with their "path". Taken from enviroment as
+     GREENSENTI_CATALOG if available.
+    :param query_cache_ttl: Seconds query results are cached for. Queries of past date ranges are cached
+     indefinitely. Use 0 to disable the cache.
+    :param refresh: Ignore cached query results and search again.
+    :param split_days: Maximum days of the date range of each DHuS sub-query, see `query_products`. Defaults to
+     `QUERY_SPLIT_DAYS`, use 0 to not split by date.
+    :param split_degrees: Maximum size in degrees of the area of each DHuS sub-query. Defaults to
+     `QUERY_SPLIT_DEGREES`, use 0 to not split by area.
+    :param extract: How DHuS products are extracted, one of "all", "bands" (only the files selected by `bands` and
+     `resolution`) or "none" (bands are read from the zip file, see `find_band`).
+    :param wait_offline: Wait for offline products to be retrieved from the Long Term Archive and download them,
+     see `retrieve_offline`. Otherwise, they are yielded as "triggered" and can be retrieved later.
+    :param crop: Crop the bands of each product by the GeoJSON geometry as soon as it is downloaded, and remove the
+     full tile files, see `crop_product`.
+    :param max_aoi_clouds: Max cloud percentage inside the GeoJSON geometry, according to the SCL band. Products above
+     it are yielded as "cloudy". From Google Cloud (or a mirror) the SCL band is fetched first, and the rest of bands
+     only for products below it. From DHuS, cloudy products are removed once downloaded. Percentages are recorded in
+     the manifest, so cloudy products are not downloaded again in later runs.
+    :param min_coverage: Min percentage of the GeoJSON geometry covered by the product footprint. Products at the edge
+     of an orbit may only cover a sliver of it.
+    :param all_baselines: Download every processing baseline of the same datatake, instead of only the latest one.
     :return: Yields an iterator of dictionaries with the product metadata and download status
     """
     # Only use Google Cloud as backend is credentials are passed
     # and the optional dependency is installed
-    if gcloud and GCLOUD_DISABLED:
+    if gcloud and GCLOUD_DISABLED and not mirror:
         print(
             "Error: Missing required Google Cloud dependencies to download from GCloud, use `pip install greensenti[gcloud]` to install them."
         )
@@ -153,7 +357,7 @@ def download(
     if isinstance(from_date, str):
         from_date = datetime.strptime(from_date, "%Y-%m-%d")
     elif not from_date:
-        from_date = datetime(1970, 1, 1)
+        from_date = SENTINEL2_EPOCH
 
     if isinstance(to_date, str):
         to_date = datetime.strptime(to_date, "%Y-%m-%d")
@@ -163,8 +367,7 @@ def download(
     # Load geojson file* and download products for an interval of dates.
     #  *see: http://geojson.io/
     if geojson:
-        geojson = read_geojson(geojson)
-        footprint = geojson_to_wkt(geojson)
+        footprint = geojson_to_wkt(read_geojson(geojson))
     else:
         footprint = None
 
@@ -178,9 +381,441 @@ def download(
 
     print("Searching for products in scene")
 
+    # Get the list of products.
+    products_df = query_products(
+        sentinel_api,
+        footprint=footprint,
+        text_match=text_match,
+        from_date=from_date,
+        to_date=to_date,
+        max_clouds=max_clouds,
+        ttl=query_cache_ttl,
+        refresh=refresh,
+        split_days=QUERY_SPLIT_DAYS if split_days is None else split_days,
+        split_degrees=QUERY_SPLIT_DEGREES if split_degrees is None else split_degrees,
+    )
+    if products_df.empty:
+        # Empty query results have no columns to filter by.
+        print(f"Found 0 scenes between {from_date} and {to_date}")
+        return
+    if skip:
+        products_df = products_df[~products_df["title"].isin(skip)]
+    # Products are filtered by their metadata before any download.
+    if min_coverage and footprint:
+        coverage = 100 * footprint_coverage(products_df["footprint"], footprint)
+        products_df = products_df[coverage >= min_coverage]
+    if not all_baselines and not products_df.empty:
+        products_df = latest_baselines(products_df)
+    ready = {}
+    if catalog and not products_df.empty:
+        product_catalog.register_products(catalog, products_df)
+        # Only products available in this output folder are skipped, not those downloaded to another one.
+        ready = {
+            title: product["path"]
+            for title, product in product_catalog.ready_products(catalog, list(products_df["title"])).items()
+            if _is_available(output, title, product["path"])
+        }
+        if ready:
+            print(f"Skipping {len(ready)} scenes already available in catalog")
+    # Cloud percentages over the area of interest are recorded in the manifest with a hash of the area.
+    aoi = hashlib.sha256(footprint.encode()).hexdigest() if max_aoi_clouds is not None and footprint else None
+    cloudy = {}
+    if aoi:
+        # Products found cloudy over the same area in previous runs are not downloaded again, unless the threshold
+        # was raised above their cloud percentage.
+        cloudy = {
+            title: entry["aoi_cloud_percentage"]
+            for title, entry in read_manifest(output).items()
+            if entry.get("status") == "cloudy"
+            and entry.get("aoi") == aoi
+            and entry.get("aoi_cloud_percentage", -1) > max_aoi_clouds
+        }
+    ready_df = products_df[products_df["title"].isin(ready)]
+    cloudy_df = products_df[products_df["title"].isin(cloudy)]
+    products_df = products_df[~products_df["title"].isin(ready) & ~products_df["title"].isin(cloudy)]
+    ids = products_df.index
+
+    print(f"Found {len(ids)} scenes between {from_date} and {to_date}")
+
+    # Products already available, or known to be cloudy, are yielded without downloading them again.
+    for record in json.loads(ready_df.to_json(orient="records", date_format="iso")):
+        yield {**record, "status": "ok", "path": ready[record["title"]]}
+    for record in json.loads(cloudy_df.to_json(orient="records", date_format="iso")):
+        yield {**record, "status": "cloudy", "aoi_cloud_percentage": cloudy[record["title"]]}
+
+    # Product metadata is serialized once and indexed, to merge it with each download result.
+    records = json.loads(products_df.to_json(orient="records", date_format="iso"))
+
+    def cloud_percentage(title: str) -> float:
+        # Percentages are reused from the manifest, as the SCL band may be removed once the product is cropped.
+        entry = get_entry(output, title) or {}
+        if entry.get("aoi") == aoi and "aoi_cloud_percentage" in entry:
+            return entry["aoi_cloud_percentage"]
+        percentage = aoi_cloud_percentage(find_band(Path(output, title), "SCL", 20), geojson)
+        update_entry(output, title, aoi=aoi, aoi_cloud_percentage=percentage)
+        return percentage
+
+    def finish(title: str, product: dict) -> dict:
+        if product["status"] == "ok" and aoi:
+            if "aoi_cloud_percentage" not in product:
+                try:
+                    product = {**product, "aoi_cloud_percentage": cloud_percentage(title)}
+                except FileNotFoundError as e:
+                    product = {**product, "status": "failed", "error": str(e)}
+        if product["status"] == "ok" and aoi and product["aoi_cloud_percentage"] > max_aoi_clouds:
+            # Bands of products cloudy over the area of interest are not used.
+            shutil.rmtree(Path(output, title), ignore_errors=True)
+            Path(output, f"{title}.zip").unlink(missing_ok=True)
+            update_entry(output, title, status="cloudy", aoi=aoi, aoi_cloud_percentage=product["aoi_cloud_percentage"])
+            product = {**product, "status": "cloudy"}
+        if crop and geojson and product["status"] == "ok" and not (get_entry(output, title) or {}).get("cropped"):
+            crop_product(output, title, geojson, bands=bands, resolution=resolution)
+        if catalog:
+            _catalog_status(catalog, title, product["status"], output)
+        return product
+
+    if not gcloud and not mirror:
+        products = {record["uuid"]: record for record in records}
+        for product in copernicous_download(
+            ids,
+            sentinel_api,
+            output=output,
+            workers=workers,
+            max_per_host=max_per_host,
+            unzip_workers=unzip_workers,
+            extract=extract,
+            bands=bands,
+            resolution=resolution,
+            shared_cache=shared_cache,
+        ):
+            product_json = products[product["uuid"]]
+            product = finish(product_json["title"], product)
+            # Offline products are tracked to be downloaded once retrieved, see `retrieve_offline`. Failures are LTA
+            # requests not accepted (e.g. quota exceeded), which are requested again later.
+            if product["status"] in ("triggered", "failed"):
+                lta.track(
+                    output,
+                    product["uuid"],
+                    product_json["title"],
+                    "triggered" if product["status"] == "triggered" else "queued",
+                )
+            yield {**product_json, **product}
+
+        if wait_offline:
+            for product in retrieve_offline(
+                output,
+                api=sentinel_api,
+                workers=workers,
+                max_per_host=max_per_host,
+                unzip_workers=unzip_workers,
+                extract=extract,
+                bands=bands,
+                resolution=resolution,
+                catalog=catalog,
+                shared_cache=shared_cache,
+            ):
+                yield {**products.get(product["uuid"], {}), **finish(product["title"], product)}
+    else:
+        gcloud_api = LocalMirror(mirror) if mirror else gcloud_bucket()
+        # Google cloud doesn't utilize ids, only titles
+        products = {record["title"]: record for record in records}
+
+        cloud_percentages = {}
+        if aoi:
+            # Only the SCL band is fetched first, and the rest of bands only for products not cloudy over the area.
+            manifest = read_manifest(output)
+            for title in products:
+                if manifest.get(title, {}).get("aoi") == aoi and "aoi_cloud_percentage" in manifest[title]:
+                    cloud_percentages[title] = manifest[title]["aoi_cloud_percentage"]
+            for product in gcloud_download(
+                [title for title in products if title not in cloud_percentages],
+                gcloud_api,
+                output=output,
+                bands=["SCL"],
+                resolution=20,
+                workers=workers,
+                shared_cache=shared_cache,
+            ):
+                if product["status"] == "ok":
+                    cloud_percentages[product["title"]] = cloud_percentage(product["title"])
+
+            for title, percentage in cloud_percentages.items():
+                if percentage > max_aoi_clouds:
+                    product = finish(title, {"title": title, "status": "ok", "aoi_cloud_percentage": percentage})
+                    yield {**products.pop(title), **product}
+
+        for product in gcloud_download(
+            list(products),
+            gcloud_api,
+            output=output,
+            bands=bands,
+            resolution=resolution,
+            workers=workers,
+            shared_cache=shared_cache,
+        ):
+            if product["title"] in cloud_percentages:
+                product["aoi_cloud_percentage"] = cloud_percentages[product["title"]]
+            yield {**products[product["title"]], **finish(product["title"], product)}
+
+
+async def download_async(*args, **kwargs) -> AsyncIterator[dict]:
+    """
+    Asynchronous version of `download`, with the same parameters.
+
+    Searches and transfers run on worker threads, so the event loop is free while they wait and several downloads
+    (e.g. of different areas) can run concurrently, consuming products as soon as they are ready::
+
+        async for product in download_async(geojson, "2022-10-01", "2022-10-10", output=output):
+            ...
+
+    :return: Yields an asynchronous iterator of dictionaries with the product metadata and download status
+    """
+    products = download(*args, **kwargs)
+    try:
+        while (product := await asyncio.to_thread(next, products, None)) is not None:
+            yield product
+    finally:
+        products.close()
+
+
+def stream(
+    geojson: Path = None,
+    text_match: str | None = "*",
+    from_date: Union[str, datetime] = None,
+    to_date: Union[str, datetime] = None,
+    **kwargs,
+) -> None:
+    """
+    Downloads Sentinel-2 products like `download`, writing each result to the standard output as a JSON line (NDJSON)
+    as soon as it is ready, so it can be processed while the rest are still downloading. Messages go to the standard
+    error.
+
+    :param geojson: GeoJSON file with product geometries.
+    :param text_match: Regular expresion to match the product filename.
+    :param from_date: From date %Y-%m-%d (begin date).
+    :param to_date: To date %Y-%m-%d (end date).
+    :param kwargs: Other parameters of `download`, e.g., `output` or `max_clouds`.
+    :return: None
+    """
+    stdout = sys.stdout
+
+    async def write_products():
+        async for product in download_async(geojson, text_match, from_date, to_date, **kwargs):
+            print(json.dumps(product, default=str), file=stdout, flush=True)
+
+    with redirect_stdout(sys.stderr):
+        asyncio.run(write_products())
+
+
+# First Sentinel-2 launch, there are no products sensed before.
+SENTINEL2_EPOCH = datetime(2015, 6, 23)
+
+# Sub-queries of large searches cover at most these days and degrees, see `query_products`.
+QUERY_SPLIT_DAYS = 90
+QUERY_SPLIT_DEGREES = 2.0
+
+# Days products may take to be published in DHuS after sensing. Date ranges ending before are considered closed.
+QUERY_INGESTION_DAYS = 7
+
+
+def query_cache_dir() -> Path:
+    """
+    Gets the folder where query results are cached.
+
+    :return: Taken from enviroment as GREENSENTI_CACHE_DIR if available, defaults to `~/.cache/greensenti`.
+    """
+    return Path(os.environ.get("GREENSENTI_CACHE_DIR") or Path.home() / ".cache" / "greensenti") / "queries"
+
+
+def query_cache_key(**params) -> str:
+    """
+    Computes the cache key of a query from its normalized parameters.
+
+    :param params: Query parameters. Footprints are normalized so equivalent geometries share the key.
+    :return: Hexadecimal key.
+    """
+    footprint = params.get("footprint")
+    if footprint:
+        params["footprint"] = hashlib.sha256(shapely.wkt.loads(footprint).normalize().wkt.encode()).hexdigest()
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def split_date_range(from_date: datetime, to_date: datetime, days: int | None) -> List[tuple[datetime, datetime]]:
+    """
+    Splits a date range into consecutive ranges of at most a number of days.
+
+    :param from_date: From date (begin date).
+    :param to_date: To date (end date).
+    :param days: Maximum days of each range. If not provided, the range is not split.
+    :return: List of (from, to) dates.
+    """
+    if not days:
+        return [(from_date, to_date)]
+    ranges = []
+    start = from_date
+    while start < to_date:
+        end = min(start + timedelta(days=days), to_date)
+        ranges.append((start, end))
+        start = end
+    return ranges or [(from_date, to_date)]
+
+
+def split_footprint(footprint: str | None, degrees: float | None) -> List[str | None]:
+    """
+    Splits an area of interest into the parts inside each cell of a regular grid.
+
+    :param footprint: Area of interest in WKT format (EPSG:4326).
+    :param degrees: Size of the grid cells in degrees. If not provided, the area is not split.
+    :return: List of areas in WKT format.
+    """
+    if not footprint or not degrees:
+        return [footprint]
+    geometry = shapely.wkt.loads(footprint)
+    min_x, min_y, max_x, max_y = geometry.bounds
+    if max(max_x - min_x, max_y - min_y) <= degrees:
+        return [footprint]
+
+    parts = []
+    for x in np.arange(min_x, max_x, degrees):
+        for y in np.arange(min_y, max_y, degrees):
+            part = geometry.intersection(box(x, y, x + degrees, y + degrees))
+            # Cells only touching the area give lines or points.
+            if part.area > 0:
+                parts.append(part.wkt)
+    return parts
+
+
+def footprint_coverage(footprints: pd.Series, footprint: str) -> np.ndarray:
+    """
+    Computes the fraction of an area of interest covered by each product footprint.
+
+    :param footprints: Product footprints in WKT format, e.g., the "footprint" column of `query_products`.
+    :param footprint: Area of interest in WKT format.
+    :return: Array of covered fractions, from 0 to 1. Points or lines are either covered or not.
+    """
+    area = shapely.from_wkt(footprint)
+    geometries = shapely.from_wkt(np.asarray(footprints, dtype=object))
+    if area.area == 0:
+        return shapely.intersects(geometries, area).astype(float)
+    return shapely.area(shapely.intersection(geometries, area)) / area.area
+
+
+# Titles of products of the same datatake and tile differ only in their processing baseline and generation time.
+DATATAKE_PATTERN = re.compile(r"_N(?P<baseline>\d{4})(?P<tile>_R\d{3}_T\w{5})_\d{8}T\d{6}$")
+
+
+def latest_baselines(products_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Keeps only the latest processing baseline of products of the same datatake and tile, e.g., reprocessed ones.
+
+    :param products_df: Products dataframe, as returned by `query_products`.
+    :return: Products dataframe without previous baselines.
+    """
+    titles = products_df["title"]
+    datatakes = titles.str.replace(DATATAKE_PATTERN, r"\g<tile>", regex=True)
+    baselines = titles.str.extract(DATATAKE_PATTERN)["baseline"].fillna("")
+    latest = baselines.groupby(datatakes).transform("max")
+    return products_df[(baselines == latest) & ~(datatakes + baselines).duplicated()]
+
+
+def query_products(
+    api: SentinelAPI,
+    footprint: str | None,
+    text_match: str | None,
+    from_date: datetime,
+    to_date: datetime,
+    max_clouds: int = 100,
+    *,
+    ttl: int = 3600,
+    refresh: bool = False,
+    split_days: int | None = QUERY_SPLIT_DAYS,
+    split_degrees: float | None = QUERY_SPLIT_DEGREES,
+    workers: int = 4,
+) -> pd.DataFrame:
+    """
+    Searches Sentinel-2 L2A products in DHuS, caching the results on disk.
+
+    Long date ranges and large areas are split into sub-queries (see `split_date_range` and `split_footprint`), which
+    run concurrently and are merged without duplicates, so they don't hit the server paging limits or time out.
+
+    Results of each sub-query are reused for `ttl` seconds. Sub-queries whose date range ended more than
+    `QUERY_INGESTION_DAYS` ago are cached indefinitely, as their results are not expected to change, so searching again
+    a long range only queries its last days.
+
+    :param api: Sentinelsat API object.
+    :param footprint: Area of interest in WKT format.
+    :param text_match: Filename pattern.
+    :param from_date: From date (begin date).
+    :param to_date: To date (end date).
+    :param max_clouds: Max cloud percentage.
+    :param ttl: Seconds results are cached for. Use 0 to disable the cache.
+    :param refresh: Ignore cached results and search again.
+    :param split_days: Maximum days of the date range of each sub-query. Use 0 to not split by date.
+    :param split_degrees: Maximum size in degrees of the area of each sub-query. Use 0 to not split by area.
+    :param workers: Number of concurrent sub-queries.
+    :return: Products dataframe.
+    """
+    queries = [
+        (area, start, end)
+        # Date ranges are only split from the Sentinel-2 launch, as there are no products before.
+        for start, end in split_date_range(max(from_date, SENTINEL2_EPOCH), to_date, split_days)
+        for area in split_footprint(footprint, split_degrees)
+    ]
+    if len(queries) == 1:
+        return _query_products(api, footprint, text_match, from_date, to_date, max_clouds, ttl=ttl, refresh=refresh)
+
+    def run_query(query: tuple[str | None, datetime, datetime]) -> pd.DataFrame:
+        area, start, end = query
+        return _query_products(api, area, text_match, start, end, max_clouds, ttl=ttl, refresh=refresh)
+
+    print(f"Splitting search into {len(queries)} queries")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        frames = list(pool.map(run_query, queries))
+
+    # Products are indexed by id, and appear in several sub-queries if they intersect several areas or dates.
+    products_df = pd.concat(frames)
+    return products_df[~products_df.index.duplicated()]
+
+
+def _query_products(
+    api: SentinelAPI,
+    footprint: str | None,
+    text_match: str | None,
+    from_date: datetime,
+    to_date: datetime,
+    max_clouds: int = 100,
+    *,
+    ttl: int = 3600,
+    refresh: bool = False,
+) -> pd.DataFrame:
+    """
+    Runs a single DHuS query, caching its results on disk.
+    """
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+    # Products are published some days after sensing, so recent ranges may still get new results.
+    closed = to_date < today - timedelta(days=QUERY_INGESTION_DAYS)
+    key = query_cache_key(
+        host=getattr(api, "api_url", None),
+        footprint=footprint,
+        filename=text_match,
+        from_date=from_date.isoformat(),
+        # Open ranges usually end "now", which changes on every call, so they are keyed by their end day.
+        to_date=to_date.isoformat() if closed else to_date.date().isoformat(),
+        max_clouds=max_clouds,
+    )
+    # Results are cached as JSON, which unlike pickle files can't run code if the cache folder is shared.
+    cache_file = query_cache_dir() / f"{key}.json"
+
+    if ttl > 0 and not refresh and cache_file.is_file():
+        age = datetime.now().timestamp() - cache_file.stat().st_mtime
+        if closed or age < ttl:
+            print("Using cached query results")
+            with open(cache_file) as f:
+                return pd.read_json(f, orient="table")
+
     # Search is limited to those scenes that intersect with the AOI
     # (area of interest) polygon.
-    products = sentinel_api.query(
+    products = api.query(
         area=footprint,
         filename=text_match,
         producttype="S2MSI2A",
@@ -188,88 +823,535 @@ def download(
         cloudcoverpercentage=(0, max_clouds),
         date=(from_date, to_date),
     )
+    products_df = api.to_dataframe(products)
 
-    # Get the list of products.
-    products_df = sentinel_api.to_dataframe(products)
-    if skip:
-        products_df = products_df[~products_df["title"].isin(skip)]
-    ids = products_df.index
+    if ttl > 0:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        products_df.to_json(tmp_file, orient="table", date_format="iso")
+        os.replace(tmp_file, cache_file)
 
-    print(f"Found {len(ids)} scenes between {from_date} and {to_date}")
+    return products_df
 
-    if not gcloud:
-        for product in copernicous_download(ids, sentinel_api, output=output):
-            product_json_str = products_df[products_df["id"] == product["id"]].to_json(
-                orient="records", date_format="iso"
-            )
-            product_json = json.loads(product_json_str)[0]  # Pandas gives a list of elements always
-            yield {**product_json, **product}
-    else:
-        gcloud_api = gcloud_bucket()
-        # Google cloud doesn't utilize ids, only titles
-        titles = products_df["title"]
-        for product in gcloud_download(titles, gcloud_api, output=output):
-            product_json_str = products_df[products_df["title"] == product["title"]].to_json(
-                orient="records", date_format="iso"
-            )
-            product_json = json.loads(product_json_str)[0]  # Pandas gives a list of elements always
-            yield {**product_json, **product}
+
+def _catalog_status(catalog: Path, title: str, download_status: str, output: Path) -> None:
+    """
+    Records the result of a product download in the catalog.
+    """
+    status = {"ok": "downloaded", "triggered": "triggered", "cloudy": "cloudy"}.get(download_status, "failed")
+    if status == "downloaded" and Path(output, title).is_dir():
+        status = "unzipped"
+    product_catalog.set_status(
+        catalog,
+        title,
+        status,
+        path=Path(output).resolve() / title if status in product_catalog.READY_STATUSES else None,
+    )
 
 
-def copernicous_download(ids: List[str], api: SentinelAPI, output: Path = Path(".")) -> Iterator[dict]:
+def _is_available(output: Path, title: str, path: str | None) -> bool:
     """
-    Downloads a list of Sentinel-2 products by a list of titles from Google Cloud.
+    Checks if a product recorded in the catalog is available in an output folder, extracted or zipped.
+    """
+    folder = Path(output).resolve() / title
+    return path is not None and Path(path) == folder and (folder.is_dir() or folder.with_name(f"{title}.zip").is_file())
+
+
+# Image files of L2A products, e.g. GRANULE/<granule>/IMG_DATA/R10m/T30SUF_20221005T105819_B04_10m.jp2, or .tif once
+# cropped, see `crop_product`.
+BAND_FILE_PATTERN = re.compile(r"_(?P<band>[A-Z0-9]+)_(?P<resolution>\d+)m\.(?:jp2|tif)$")
+
+# How DHuS products are extracted: every file, only the requested bands, or none (bands are read from the zip file).
+EXTRACT_MODES = ("all", "bands", "none")
+
+# Download slots per host and limit, shared by every download running in the process with the same limit.
+_HOST_SLOTS: dict[tuple[str, int], threading.BoundedSemaphore] = {}
+_HOST_SLOTS_LOCK = threading.Lock()
+
+
+def _host_slots(url: str, max_per_host: int) -> threading.BoundedSemaphore:
+    """
+    Gets the semaphore limiting concurrent downloads from the host of an URL.
 
-    :param titles: Sentinel-2 product ids.
+    Downloads with a different limit get their own semaphore, so a later call with a higher limit, e.g.,
+    `download_and_process` with more `io_workers` after a `download` with one worker, is not bound by the first one.
+
+    :param url: Service URL.
+    :param max_per_host: Maximum concurrent downloads from the host.
+    :return: Host semaphore.
+    """
+    key = (urlparse(str(url)).netloc, max_per_host)
+    with _HOST_SLOTS_LOCK:
+        if key not in _HOST_SLOTS:
+            _HOST_SLOTS[key] = threading.BoundedSemaphore(max_per_host)
+        return _HOST_SLOTS[key]
+
+
+def copernicous_download(
+    ids: List[str],
+    api: SentinelAPI,
+    output: Path = Path("."),
+    *,
+    workers: int = 4,
+    max_per_host: int | None = None,
+    unzip_workers: int = 2,
+    extract: str = "all",
+    bands: List[str] | None = None,
+    resolution: int | None = None,
+    shared_cache: Path | None = None,
+) -> Iterator[dict]:
+    """
+    Downloads a list of Sentinel-2 products by a list of ids from DHuS.
+
+    Products are downloaded concurrently and unzipped on a separate pool, so extraction doesn't block the network.
+    Downloads are only started while the products yielded are consumed, with at most `workers + unzip_workers`
+    products downloading or unzipping at a time.
+    Complete products are recorded in the output folder manifest and skipped in later runs, while partial downloads
+    are resumed by sentinelsat.
+
+    Products can be left zipped (`extract="none"`), as GDAL reads bands straight from the archive, or only the
+    requested bands extracted (`extract="bands"`), which saves most of the disk usage and time of a full extraction.
+
+    :param ids: Sentinel-2 product ids.
     :param api: Sentinelsat API object.
     :param output: Output folder.
-    :return: Yields an iterator of dictionaries with the product status
+    :param workers: Number of concurrent downloads.
+    :param max_per_host: Maximum concurrent downloads from the same DHuS host, shared by every download of the process.
+     Defaults to `workers`.
+    :param unzip_workers: Number of concurrent extractions.
+    :param extract: How products are extracted, one of "all", "bands" or "none".
+    :param bands: Band names to extract with `extract="bands"`, e.g., ["B04", "B08", "SCL"].
+    :param resolution: Resolution in meters of the bands to extract with `extract="bands"`, e.g., 10.
+    :param shared_cache: Folder of a download cache shared by every output folder, see `greensenti.cache`. Cached
+     products are placed in the output folder without downloading them.
+    :return: Yields an iterator of dictionaries with the product status, in completion order
     """
+    if extract not in EXTRACT_MODES:
+        raise ValueError(f"Unknown extract mode {extract}, expected one of {EXTRACT_MODES}.")
+    if extract != "bands":
+        bands = resolution = None
 
-    for id_ in ids:
-        try:
-            product_info = api.download(id_, str(output))
+    slots = _host_slots(api.api_url, max_per_host or workers)
 
-            unzip_product(output, product_info["title"])
-
-            # If there is no error, yield "ok"
+    # Products verified in previous runs are not downloaded again, only extracted if more bands are requested.
+    complete = complete_entries(output)
+    pending_ids = []
+    extract_ids = []
+    for id_ in ids:
+        entry = complete.get(id_)
+        if entry is None:
+            pending_ids.append(id_)
+        elif (
+            extract != "none"
+            and not is_extracted(entry, bands, resolution)
+            and Path(output, f"{entry['title']}.zip").is_file()
+        ):
+            extract_ids.append(id_)
+        else:
             yield {
                 "uuid": id_,
                 "status": "ok",
             }
-        except LTATriggered:
-            yield {
-                "uuid": id_,
-                "status": "triggered",
-            }
-        except LTAError:
-            yield {
-                "uuid": id_,
-                "status": "failed",
-            }
+
+    def download_product(id_: str) -> dict:
+        if shared_cache and (cached := download_cache.get_product(shared_cache, id_)):
+            if all(download_cache.get(shared_cache, md5, Path(output, name)) for name, md5 in cached["files"].items()):
+                return cached
+        with slots:
+            product_info = api.download(id_, str(output))
+        if shared_cache and product_info.get("md5"):
+            # Zip files are addressed by their DHuS MD5, which is only known once downloaded, so they are also indexed
+            # by product id.
+            name, md5 = f"{product_info['title']}.zip", product_info["md5"].lower()
+            download_cache.put(shared_cache, md5, Path(output, name))
+            download_cache.put_product(
+                shared_cache, id_, title=product_info["title"], md5=product_info["md5"], files={name: md5}
+            )
+        return product_info
+
+    download_pool = ThreadPoolExecutor(max_workers=workers)
+    unzip_pool = ThreadPoolExecutor(max_workers=unzip_workers)
+    titles: dict[str, dict] = {}
+    try:
+        pending = {}
+        for id_ in extract_ids:
+            titles[id_] = complete[id_]
+            pending[unzip_pool.submit(unzip_product, output, titles[id_]["title"], bands, resolution)] = ("unzip", id_)
+
+        queue = iter(pending_ids)
+
+        def submit_downloads():
+            # Downloads are started as products are consumed, so they don't pile up on disk if the consumer is slow.
+            while len(pending) < workers + unzip_workers and (id_ := next(queue, None)) is not None:
+                pending[download_pool.submit(download_product, id_)] = ("download", id_)
+
+        submit_downloads()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, id_ = pending.pop(future)
+                try:
+                    product_info = future.result()
+                except LTATriggered:
+                    yield {
+                        "uuid": id_,
+                        "status": "triggered",
+                    }
+                except LTAError:
+                    yield {
+                        "uuid": id_,
+                        "status": "failed",
+                    }
+                else:
+                    if stage == "download" and extract != "none":
+                        unzipping = unzip_pool.submit(unzip_product, output, product_info["title"], bands, resolution)
+                        pending[unzipping] = ("unzip", id_)
+                        titles[id_] = product_info
+                    else:
+                        # Zip files are checked against the DHuS MD5 by sentinelsat while downloading.
+                        product_info = titles.pop(id_, product_info)
+                        update_entry(
+                            output,
+                            product_info["title"],
+                            status="complete",
+                            source="dhus",
+                            uuid=id_,
+                            md5=product_info.get("md5"),
+                        )
+                        # If there is no error, yield "ok"
+                        yield {
+                            "uuid": id_,
+                            "status": "ok",
+                        }
+            submit_downloads()
+    finally:
+        download_pool.shutdown(cancel_futures=True)
+        unzip_pool.shutdown(cancel_futures=True)
+
+
+def retrieve_offline(
+    output: Path = Path("."),
+    *,
+    dhus_username: str = os.environ.get("DHUS_USERNAME", None),
+    dhus_password: str = os.environ.get("DHUS_PASSWORD", None),
+    dhus_host: str = os.environ.get("DHUS_HOST", None),
+    max_active: int = 4,
+    base_delay: float = 300,
+    max_delay: float = 3 * 3600,
+    max_attempts: int | None = None,
+    max_rejections: int = 10,
+    workers: int = 4,
+    max_per_host: int | None = None,
+    unzip_workers: int = 2,
+    extract: str = "all",
+    bands: List[str] | None = None,
+    resolution: int | None = None,
+    catalog: Path | None = os.environ.get("GREENSENTI_CATALOG", None),
+    shared_cache: Path | None = os.environ.get("GREENSENTI_PRODUCT_CACHE", None),
+    api: SentinelAPI | None = None,
+) -> Iterator[dict]:
+    """
+    Downloads the offline products of an output folder as soon as they are retrieved from the Long Term Archive (LTA).
+
+    Offline products found by `download` are tracked in the output folder (see `greensenti.lta`), so retrievals are
+    resumed after a restart. Their online status is polled with exponential backoff, and at most `max_active`
+    retrievals are requested at a time, as DHuS limits them per user. Runs until every tracked product is downloaded
+    or given up.
+
+    :param output: Output folder.
+    :param dhus_username: Username from dhus service. Taken from enviroment as DHUS_USERNAME if available.
+    :param dhus_password: Password from dhus service. Taken from enviroment as DHUS_PASSWORD if available.
+    :param dhus_host: Host from dhus service. Taken from enviroment as DHUS_HOST if available.
+    :param max_active: Maximum number of retrievals requested at the same time.
+    :param base_delay: Seconds between the first checks of a product, doubled on every check.
+    :param max_delay: Maximum seconds between checks of a product.
+    :param max_attempts: Number of checks before giving up on a product. Defaults to never giving up.
+    :param max_rejections: Number of rejected retrieval or download requests (e.g. quota exceeded) before giving up
+     on a product.
+    :param workers: Number of concurrent downloads.
+    :param max_per_host: Maximum concurrent downloads from the same DHuS host. Defaults to `workers`.
+    :param unzip_workers: Number of concurrent extractions.
+    :param extract: How products are extracted, one of "all", "bands" or "none".
+    :param bands: Band names to extract with `extract="bands"`, e.g., ["B04", "B08", "SCL"].
+    :param resolution: Resolution in meters of the bands to extract with `extract="bands"`, e.g., 10.
+    :param catalog: Local SQLite product catalog. Taken from enviroment as GREENSENTI_CATALOG if available.
+    :param shared_cache: Folder of a download cache shared by every output folder of the node, see
+     `greensenti.cache`. Taken from enviroment as GREENSENTI_PRODUCT_CACHE if available.
+    :param api: Sentinelsat API object. Defaults to a new one with the given credentials.
+    :return: Yields an iterator of dictionaries with the product status, as they are downloaded or given up
+    """
+    if max_active < 1:
+        raise ValueError(f"At least one active retrieval is required, got max_active={max_active}.")
+    api = api or SentinelAPI(dhus_username, dhus_password, dhus_host, show_progressbars=False)
+    retry = {"base_delay": base_delay, "max_delay": max_delay}
+
+    def check_attempts(entry: dict) -> dict | None:
+        if entry.get("rejections", 0) >= max_rejections:
+            error = f"Product requests rejected {entry['rejections']} times"
+        elif max_attempts is not None and entry["attempts"] >= max_attempts:
+            error = f"Product not retrieved after {entry['attempts']} attempts"
+        else:
+            return None
+        lta.remove_request(output, entry["uuid"])
+        if catalog:
+            _catalog_status(catalog, entry["title"], "failed", output)
+        return {
+            "uuid": entry["uuid"],
+            "title": entry["title"],
+            "status": "failed",
+            "error": error,
+        }
+
+    while state := lta.read_state(output):
+        now = time.time()
+        due = sorted((entry for entry in state.values() if entry["next_check"] <= now), key=lambda e: e["next_check"])
+
+        online = []
+        for entry in [entry for entry in due if entry["status"] == "triggered"]:
+            if api.is_online(entry["uuid"]):
+                online.append(entry["uuid"])
+            elif result := check_attempts(lta.retry_later(output, entry["uuid"], **retry)):
+                yield result
+
+        # Queued products are requested as active retrievals finish.
+        active = sum(entry["status"] == "triggered" for entry in state.values()) - len(online)
+        queued = [entry for entry in due if entry["status"] == "queued"][: max(max_active - active, 0)]
+        for i, entry in enumerate(queued):
+            try:
+                triggered = api.trigger_offline_retrieval(entry["uuid"])
+            except LTAError:
+                # Requests are not accepted (e.g. quota exceeded), so the rest of the queue waits too.
+                rejected = lta.retry_later(output, entry["uuid"], rejections=entry.get("rejections", 0) + 1, **retry)
+                if result := check_attempts(rejected):
+                    yield result
+                for waiting in queued[i + 1 :]:
+                    lta.retry_later(output, waiting["uuid"], **retry)
+                break
+            if triggered:
+                lta.update_request(output, entry["uuid"], status="triggered", attempts=0, next_check=now + base_delay)
+            else:
+                online.append(entry["uuid"])
+
+        for product in copernicous_download(
+            online,
+            api,
+            output=output,
+            workers=workers,
+            max_per_host=max_per_host,
+            unzip_workers=unzip_workers,
+            extract=extract,
+            bands=bands,
+            resolution=resolution,
+            shared_cache=shared_cache,
+        ):
+            entry = state[product["uuid"]]
+            if product["status"] == "ok":
+                lta.remove_request(output, entry["uuid"])
+                if catalog:
+                    _catalog_status(catalog, entry["title"], "ok", output)
+                yield {"title": entry["title"], **product}
+            else:
+                # Products may go offline again, or their download not be accepted, before being downloaded.
+                if product["status"] == "triggered":
+                    entry = lta.retry_later(output, entry["uuid"], status="triggered", **retry)
+                else:
+                    rejections = entry.get("rejections", 0) + 1
+                    entry = lta.retry_later(output, entry["uuid"], status="queued", rejections=rejections, **retry)
+                if result := check_attempts(entry):
+                    yield result
+
+        if not online and (state := lta.read_state(output)):
+            # Queued products without a free retrieval slot wait for the next check of the active ones.
+            active = sum(entry["status"] == "triggered" for entry in state.values())
+            next_check = min(
+                (
+                    entry["next_check"]
+                    for entry in state.values()
+                    if entry["status"] == "triggered" or active < max_active
+                ),
+                default=now + base_delay,
+            )
+            time.sleep(max(next_check - time.time(), 0))
 
 
-def unzip_product(output_folder: Path, title: str) -> None:
+def is_extracted(entry: dict | None, bands: List[str] | None = None, resolution: int | None = None) -> bool:
+    """
+    Checks if the extracted files of a product, according to its manifest entry, include a selection of bands.
+
+    :param entry: Manifest entry of the product.
+    :param bands: Band names, e.g., ["B04", "B08", "SCL"]. If not provided, every band.
+    :param resolution: Resolution in meters of the bands, e.g., 10. If not provided, every resolution.
+    :return: True if every selected file was extracted.
+    """
+    if not entry or not entry.get("unzipped"):
+        return False
+    selections = entry.get("extracted") or []
+    return any(
+        (selection.get("bands") is None or (bands is not None and set(bands) <= set(selection["bands"])))
+        and selection.get("resolution") in (None, resolution)
+        for selection in ([selections] if isinstance(selections, dict) else selections)
+    )
+
+
+def unzip_product(
+    output_folder: Path, title: str, bands: List[str] | None = None, resolution: int | None = None
+) -> None:
     """
     Unzip a downloaded product inside the same folder
 
+    Products extracted before with other bands keep their files, and only the missing ones are extracted.
+
     :param output_folder: Output folder.
     :param title: Sentinel-2 product title.
+    :param bands: Band names to extract, e.g., ["B04", "B08", "SCL"]. If not provided, every band is extracted.
+    :param resolution: Resolution in meters of the bands to extract, e.g., 10. If not provided, every resolution is
+     extracted.
 
     :return: None
     """
-    # Make sure the output folder exists.
     data_dir = Path(output_folder, title)
-    data_dir.mkdir(parents=True, exist_ok=True)
-
     zip_filename = Path(output_folder, title + ".zip")
+    selection = {"bands": sorted(bands) if bands else None, "resolution": resolution}
 
-    # We assume the file is already unzip correctly
-    if Path(data_dir, title).is_dir():
+    entry = get_entry(output_folder, title)
+    if data_dir.is_dir() and is_extracted(entry, bands, resolution):
         return
+    # Folders not recorded as extracted are leftovers of an interrupted extraction.
+    merge = data_dir.is_dir() and entry and entry.get("unzipped")
+    previous = entry.get("extracted") if merge else []
+    previous = [previous] if isinstance(previous, dict) else previous
+
+    # Extract to a temporary folder that is moved once complete, so a half extracted product is never taken
+    # as complete.
+    partial_dir = Path(output_folder, f"{title}.partial")
+    shutil.rmtree(partial_dir, ignore_errors=True)
 
     with zipfile.ZipFile(zip_filename, "r") as zip_file:
-        zip_file.extractall(data_dir)
+        members = [info for info in zip_file.infolist() if not info.is_dir()]
+        if bands or resolution:
+            # Members are selected like Google Cloud blobs, by their name relative to the product folder.
+            by_name = {info.filename.split("/", 1)[-1]: info for info in members}
+            members = [by_name[name] for name in select_blobs(list(by_name), bands=bands, resolution=resolution)]
+        if merge:
+            members = [
+                info
+                for info in members
+                if not (data_dir / info.filename).is_file()
+                or (data_dir / info.filename).stat().st_size != info.file_size
+            ]
+        for info in members:
+            zip_file.extract(info, partial_dir)
+
+    if merge:
+        for info in members:
+            (data_dir / info.filename).parent.mkdir(parents=True, exist_ok=True)
+            os.replace(partial_dir / info.filename, data_dir / info.filename)
+        shutil.rmtree(partial_dir, ignore_errors=True)
+    else:
+        shutil.rmtree(data_dir, ignore_errors=True)
+        os.replace(partial_dir, data_dir)
+    update_entry(output_folder, title, unzipped=True, extracted=[*previous, selection])
+
+
+def crop_product(
+    output: Path,
+    title: str,
+    geojson: Path,
+    geojson_crs: str = "epsg:4326",
+    *,
+    bands: List[str] | None = None,
+    resolution: int | None = None,
+) -> List[Path]:
+    """
+    Crops the bands of a downloaded product by a geometry (see `raster.apply_mask`), and removes its full tile files.
+
+    Bands are read from the extracted product or straight from its zip file, and written as GTiffs with the same path
+    inside the product folder, e.g., `<title>/<title>.SAFE/GRANULE/<granule>/IMG_DATA/R10m/<tile>_B04_10m.tif`, so
+    `find_band` keeps working. Every JPEG2000 file and the zip file are then removed, and only metadata files are kept.
+
+    :param output: Output folder.
+    :param title: Sentinel-2 product title.
+    :param geojson: Geometry in GeoJSON format.
+    :param geojson_crs: Coordinate reference system of the GeoJSON file.
+    :param bands: Band names to keep, e.g., ["B04", "B08", "SCL"]. If not provided, every band is kept.
+    :param resolution: Resolution in meters of the bands to keep, e.g., 10. If not provided, every resolution is kept.
+    :return: Paths to cropped bands.
+    """
+    folder = Path(output, title)
+    zip_filename = Path(output, f"{title}.zip")
+
+    # Band files by their path relative to the product folder, extracted files first.
+    sources = {}
+    if folder.is_dir():
+        sources = {path.relative_to(folder).as_posix(): str(path) for path in folder.rglob("*.jp2")}
+    if zip_filename.is_file():
+        with zipfile.ZipFile(zip_filename, "r") as zip_file:
+            for name in zip_file.namelist():
+                if name.endswith(".jp2"):
+                    sources.setdefault(name, f"/vsizip/{zip_filename.resolve()}/{name}")
+
+    cropped = []
+    for name in select_blobs(list(sources), bands=bands, resolution=resolution):
+        if "/IMG_DATA/" not in name or not BAND_FILE_PATTERN.search(name):
+            continue
+        target = (folder / name).with_suffix(".tif")
+        apply_mask(sources[name], geojson, geojson_crs, output=target)
+        cropped.append(target)
+
+    if zip_filename.is_file():
+        # Metadata files are kept, as the zip file is removed.
+        with zipfile.ZipFile(zip_filename, "r") as zip_file:
+            for name in zip_file.namelist():
+                if not name.endswith("/") and not name.endswith(".jp2") and not (folder / name).exists():
+                    zip_file.extract(name, folder)
+        zip_filename.unlink()
+    for path in folder.rglob("*.jp2"):
+        path.unlink()
+
+    update_entry(output, title, cropped=True)
+    return cropped
+
+
+def find_band(product: Path, band: str, resolution: int | None = None) -> str:
+    """
+    Finds a band file of a DHuS product, either extracted or inside its zip file.
+
+    Bands of zipped products are given as GDAL `/vsizip/` paths, which are read by rasterio (and so by
+    `band_arithmetic`, `apply_mask` and the rest) without extracting the archive. These paths are strings, as
+    `pathlib.Path` would break the double slash of absolute archive paths.
+
+    :param product: Product folder or zip file, e.g., `output/<title>` or `output/<title>.zip`.
+    :param band: Band name, e.g., "B04".
+    :param resolution: Resolution in meters, e.g., 10. Bands not available at this resolution are taken at the finest
+     coarser one. If not provided, the finest available resolution is used.
+    :return: Path to band file.
+    """
+    product = Path(product)
+    folder = product.with_name(product.name.removesuffix(".zip"))
+    zip_filename = folder.with_name(folder.name + ".zip")
+
+    # Extracted files are preferred, falling back to the zip file for bands not extracted.
+    sources = []
+    if folder.is_dir():
+        sources.append(
+            (str(folder), [path.relative_to(folder).as_posix() for path in folder.rglob("*") if path.is_file()])
+        )
+    if zip_filename.is_file():
+        with zipfile.ZipFile(zip_filename, "r") as zip_file:
+            names = [name for name in zip_file.namelist() if not name.endswith("/")]
+        sources.append((f"/vsizip/{zip_filename.resolve()}", names))
+
+    for prefix, names in sources:
+        images = [
+            name
+            for name in select_blobs(names, bands=[band], resolution=resolution)
+            if "/IMG_DATA/" in name and BAND_FILE_PATTERN.search(name)
+        ]
+        if images:
+            finest = min(images, key=lambda name: int(BAND_FILE_PATTERN.search(name).group("resolution")))
+            return f"{prefix}/{finest}"
+
+    raise FileNotFoundError(f"Band {band} not found in product {folder}")
 
 
 def gcloud_bucket() -> "storage.Client":
@@ -286,51 +1368,169 @@ def gcloud_bucket() -> "storage.Client":
     return client
 
 
-def gcloud_download(titles: List[str], api: "storage.Client", output: Path = Path(".")) -> Iterator[dict]:
+def select_blobs(names: List[str], bands: List[str] | None = None, resolution: int | None = None) -> List[str]:
     """
-    Downloads a list of Sentinel-2 products by a list of titles from Google Cloud.
+    Selects the blobs of a Sentinel-2 L2A product to download by band and resolution.
+
+    Image files are kept if they match the requested bands and resolution. Bands not available at the requested
+    resolution (e.g. SCL at 10m) are taken at their finest available resolution. Every other file but the product
+    metadata at the root of the product (e.g. MTD_MSIL2A.xml) is dropped.
+
+    :param names: Blob names relative to the product folder.
+    :param bands: Band names, e.g., ["B04", "B08", "SCL"]. If not provided, every band is kept.
+    :param resolution: Resolution in meters, e.g., 10. If not provided, every resolution is kept.
+    :return: Selected blob names.
+    """
+    if not bands and not resolution:
+        return list(names)
+
+    wanted = {band.upper() for band in bands} if bands else None
+    selected = [name for name in names if "/" not in name]  # Product metadata
+
+    # Group image files by band, with the resolutions each one is available at.
+    images: dict[str, dict[int, List[str]]] = {}
+    for name in names:
+        if "/IMG_DATA/" not in name or not (match := BAND_FILE_PATTERN.search(name)):
+            continue
+        band, band_resolution = match.group("band"), int(match.group("resolution"))
+        if wanted is None or band in wanted:
+            images.setdefault(band, {}).setdefault(band_resolution, []).append(name)
+
+    for available in images.values():
+        if resolution is None:
+            selected.extend(name for files in available.values() for name in files)
+        elif resolution in available:
+            selected.extend(available[resolution])
+        else:
+            coarser = [r for r in available if r > resolution]
+            selected.extend(available[min(coarser)] if coarser else available[max(available)])
+
+    return selected
+
+
+def gcloud_download(
+    titles: List[str],
+    api: StorageBackend,
+    output: Path = Path("."),
+    *,
+    bands: List[str] | None = None,
+    resolution: int | None = None,
+    workers: int = 8,
+    bucket: str = GCLOUD_BUCKET,
+    shared_cache: Path | None = None,
+) -> Iterator[dict]:
+    """
+    Downloads a list of Sentinel-2 products by a list of titles from Google Cloud, or any storage backend with the same
+    layout, e.g., a local mirror.
+
+    Blobs are filtered by band and resolution before fetching, see `select_blobs`, and downloaded concurrently. Each
+    blob is checked against its Google Cloud checksum. Complete products are recorded in the output folder manifest and
+    skipped in later runs, while the verified files of partial ones are kept.
 
     :param titles: Sentinel-2 product titles.
-    :param api: Google Cloud client object.
+    :param api: Google Cloud client object, or other storage backend, see `greensenti.storage.StorageBackend`.
     :param output: Output folder.
+    :param bands: Band names to download, e.g., ["B04", "B08", "SCL"]. If not provided, every band is downloaded.
+    :param resolution: Resolution in meters of the bands to download, e.g., 10. If not provided, every resolution is
+     downloaded.
+    :param workers: Number of concurrent blob downloads.
+    :param bucket: Bucket name.
+    :param shared_cache: Folder of a download cache shared by every output folder, see `greensenti.cache`. Cached
+     blobs are placed in the output folder without downloading them.
     :return: Yields an iterator of dictionaries with the product status
     """
 
-    for title in titles:
-        try:
-            gcloud_path = get_gcloud_path(title)
-            product_folder = Path(gcloud_path).name.removesuffix(".SAFE")
+    def download_blob(blob: Blob, local_blob_path: Path) -> str | None:
+        # Make sure output folder exists
+        local_blob_path.parent.mkdir(parents=True, exist_ok=True)
+        md5 = b64_to_hex(blob.md5_hash) if blob.md5_hash else None
 
-            blobs = api.list_blobs("gcp-public-data-sentinel-2", prefix=gcloud_path)
+        # Download if doesn't exist or is not the same as the remote blob, e.g. truncated
+        if blob_is_verified(blob, local_blob_path):
+            print("File exists, skipping")
+        elif shared_cache and download_cache.get(shared_cache, md5, local_blob_path):
+            pass
+        else:
+            # Download to a temporary file that is renamed once verified, so partial files are never left in place.
+            part_path = local_blob_path.with_name(local_blob_path.name + ".part")
+            blob.download_to_filename(part_path)
+            if not blob_is_verified(blob, part_path):
+                part_path.unlink()
+                raise ValueError(f"Checksum mismatch for blob {blob.name}")
+            os.replace(part_path, local_blob_path)
+            if shared_cache:
+                download_cache.put(shared_cache, md5, local_blob_path)
 
-            for blob in blobs:
-                if blob.name.endswith("/") or blob.name.endswith("$folder$"):  # Ignore folders and GCloud files
+        return md5
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for title in titles:
+            if (entry := get_entry(output, title)) and entry.get("status") == "complete":
+                # Products verified in previous runs are skipped if they include the requested bands.
+                if (entry.get("bands") is None and entry.get("resolution") is None) or (
+                    entry.get("bands") == (sorted(bands) if bands else None) and entry.get("resolution") == resolution
+                ):
+                    yield {
+                        "title": title,
+                        "status": "ok",
+                    }
                     continue
 
-                # Prepare path to local file
+            try:
+                gcloud_path = get_gcloud_path(title)
+                product_folder = Path(gcloud_path).name.removesuffix(".SAFE")
                 output_folder = output.resolve() / product_folder
-                local_blob_name = Path(blob.name.removeprefix(gcloud_path + "/"))
-                local_blob_path = output_folder / local_blob_name
 
-                # Make sure output folder exists
-                local_blob_path.parent.mkdir(parents=True, exist_ok=True)
+                blobs = {
+                    blob.name.removeprefix(gcloud_path + "/"): blob
+                    for blob in api.list_blobs(bucket, prefix=gcloud_path)
+                    # Ignore folders and GCloud files
+                    if not (blob.name.endswith("/") or blob.name.endswith("$folder$"))
+                }
 
-                # Download if doesn't exist
-                if not Path.is_file(local_blob_path):
-                    blob.download_to_filename(local_blob_path)
-                else:
-                    print("File exists, skipping")
+                update_entry(
+                    output, title, status="partial", source="mirror" if isinstance(api, LocalMirror) else "gcloud"
+                )
+                futures = {
+                    name: pool.submit(download_blob, blobs[name], output_folder / name)
+                    for name in select_blobs(list(blobs), bands=bands, resolution=resolution)
+                }
+                files = {name: future.result() for name, future in futures.items()}
 
-            yield {
-                "title": title,
-                "status": "ok",
-            }
-        except Exception as e:
-            yield {
-                "title": title,
-                "status": "failed",
-                "error": str(e),
-            }
+                update_entry(
+                    output,
+                    title,
+                    status="complete",
+                    bands=sorted(bands) if bands else None,
+                    resolution=resolution,
+                    files=files,
+                )
+
+                yield {
+                    "title": title,
+                    "status": "ok",
+                }
+            except Exception as e:
+                yield {
+                    "title": title,
+                    "status": "failed",
+                    "error": str(e),
+                }
+
+
+def blob_is_verified(blob: Blob, filename: Path) -> bool:
+    """
+    Checks if a local file has the same content as a Google Cloud blob, by MD5 checksum or size if not available.
+
+    :param blob: Google Cloud blob.
+    :param filename: Path to local file.
+    :return: True if the file exists and matches the blob.
+    """
+    if not filename.is_file():
+        return False
+    if blob.md5_hash:
+        return md5sum(filename) == b64_to_hex(blob.md5_hash)
+    return blob.size is not None and filename.stat().st_size == blob.size
 
 
 def get_gcloud_path(title: str) -> str:
@@ -0,0 +1,89 @@
+import json
+import os
+from pathlib import Path
+
+from greensenti import __version__
+from greensenti.manifest import md5sum
+
+
+def sidecar(output: Path) -> Path:
+    """
+    Gets the sidecar file recording the inputs an output was computed from (`<output>.inputs.json`).
+    """
+    return Path(f"{output}.inputs.json")
+
+
+def _source_file(path: str | Path) -> Path:
+    """
+    File an input is read from. Inputs inside archives, e.g., GDAL `/vsizip/` paths, are read from the archive.
+    """
+    path = str(path)
+    if path.startswith("/vsizip/") and ".zip" in path:
+        archive = path.removeprefix("/vsizip/")
+        return Path(archive[: archive.index(".zip") + len(".zip")])
+    return Path(path)
+
+
+def input_fingerprint(path: str | Path, checksum: bool = False) -> dict:
+    """
+    Fingerprints an input file by its size and modification time, or its checksum.
+
+    :param path: Path to input file, or GDAL virtual path.
+    :param checksum: Use the MD5 checksum of the file, which is slower but doesn't change if the file is copied.
+    :return: Fingerprint dictionary.
+    """
+    source = _source_file(path)
+    if checksum:
+        return {"path": str(path), "md5": md5sum(source)}
+    stat = source.stat()
+    return {"path": str(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def fingerprint(function: str, inputs: dict, parameters: dict | None = None, *, checksum: bool = False) -> dict:
+    """
+    Fingerprints the computation of an output: the function, its input files and parameters, and the version of the
+    package.
+
+    :param function: Function name, e.g., "ndvi".
+    :param inputs: Dictionary of input names to paths.
+    :param parameters: Other parameters of the function. Values must be JSON serializable.
+    :param checksum: Fingerprint input files by their checksum instead of their size and modification time.
+    :return: Fingerprint dictionary.
+    """
+    return {
+        "function": function,
+        "version": __version__,
+        "inputs": {name: input_fingerprint(path, checksum) for name, path in sorted(inputs.items())},
+        # Parameters are compared after a JSON round trip, e.g., tuples as lists.
+        "parameters": json.loads(json.dumps(parameters or {}, default=str)),
+    }
+
+
+def is_up_to_date(output: Path, expected: dict) -> bool:
+    """
+    Checks if an output exists and was computed from the same inputs.
+
+    :param output: Path to output file.
+    :param expected: Fingerprint of the computation, see `fingerprint`.
+    :return: True if the output can be reused.
+    """
+    if not Path(output).is_file() or not sidecar(output).is_file():
+        return False
+    with open(sidecar(output)) as f:
+        try:
+            return json.load(f) == expected
+        except json.JSONDecodeError:
+            return False
+
+
+def record(output: Path, computed: dict) -> None:
+    """
+    Records the fingerprint of an output once written. The sidecar file is replaced atomically.
+
+    :param output: Path to output file.
+    :param computed: Fingerprint of the computation, see `fingerprint`.
+    """
+    tmp = Path(f"{sidecar(output)}.{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(computed, f, indent=2)
+    os.replace(tmp, sidecar(output))
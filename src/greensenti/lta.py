@@ -0,0 +1,123 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+LTA_STATE_FILENAME = ".greensenti-lta.json"
+
+# Statuses of offline products: waiting to be triggered, or with a retrieval request to the Long Term Archive.
+LTA_STATUSES = ("queued", "triggered")
+
+_STATE_LOCK = threading.Lock()
+
+
+def read_state(output: Path) -> dict:
+    """
+    Reads the Long Term Archive (LTA) retrieval state of an output folder, which records its offline products.
+
+    :param output: Output folder.
+    :return: Dictionary of product ids to their state entry.
+    """
+    state = Path(output, LTA_STATE_FILENAME)
+    if not state.is_file():
+        return {}
+    with open(state) as f:
+        return json.load(f)
+
+
+def _write_state(output: Path, state: dict) -> None:
+    Path(output).mkdir(parents=True, exist_ok=True)
+    tmp = Path(output, f"{LTA_STATE_FILENAME}.{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, Path(output, LTA_STATE_FILENAME))
+
+
+def backoff(attempts: int, base_delay: float = 300, max_delay: float = 3 * 3600) -> float:
+    """
+    Computes the delay before checking an offline product again, doubling it on every attempt.
+
+    :param attempts: Number of checks of the product so far.
+    :param base_delay: Delay in seconds after the first attempt.
+    :param max_delay: Maximum delay in seconds.
+    :return: Delay in seconds.
+    """
+    return min(base_delay * 2 ** max(attempts - 1, 0), max_delay)
+
+
+def track(output: Path, uuid: str, title: str, status: str = "triggered", *, base_delay: float = 300) -> dict:
+    """
+    Adds an offline product to the retrieval state. Products already tracked keep their state.
+
+    :param output: Output folder.
+    :param uuid: Sentinel-2 product id.
+    :param title: Sentinel-2 product title.
+    :param status: "triggered" if its retrieval was already requested, or "queued" to request it later.
+    :param base_delay: Delay in seconds before checking the product.
+    :return: State entry.
+    """
+    if status not in LTA_STATUSES:
+        raise ValueError(f"Unknown status {status}, expected one of {LTA_STATUSES}.")
+    with _STATE_LOCK:
+        state = read_state(output)
+        if uuid not in state:
+            state[uuid] = {
+                "uuid": uuid,
+                "title": title,
+                "status": status,
+                "attempts": 0,
+                "next_check": time.time() + (base_delay if status == "triggered" else 0),
+            }
+            _write_state(output, state)
+        return state[uuid]
+
+
+def update_request(output: Path, uuid: str, **fields) -> dict:
+    """
+    Updates the retrieval state of an offline product. The state file is replaced atomically.
+
+    :param output: Output folder.
+    :param uuid: Sentinel-2 product id.
+    :param fields: Fields to set in the entry, e.g., `status="triggered"`.
+    :return: Updated entry.
+    """
+    with _STATE_LOCK:
+        state = read_state(output)
+        state[uuid] = {**state[uuid], **fields}
+        _write_state(output, state)
+        return state[uuid]
+
+
+def retry_later(output: Path, uuid: str, *, base_delay: float = 300, max_delay: float = 3 * 3600, **fields) -> dict:
+    """
+    Schedules the next check of an offline product with exponential backoff.
+
+    :param output: Output folder.
+    :param uuid: Sentinel-2 product id.
+    :param base_delay: Delay in seconds after the first attempt.
+    :param max_delay: Maximum delay in seconds.
+    :param fields: Other fields to set in the entry.
+    :return: Updated entry.
+    """
+    attempts = read_state(output)[uuid]["attempts"] + 1
+    return update_request(
+        output,
+        uuid,
+        attempts=attempts,
+        next_check=time.time() + backoff(attempts, base_delay, max_delay),
+        **fields,
+    )
+
+
+def remove_request(output: Path, uuid: str) -> None:
+    """
+    Removes a product from the retrieval state, once downloaded or given up.
+
+    :param output: Output folder.
+    :param uuid: Sentinel-2 product id.
+    """
+    with _STATE_LOCK:
+        state = read_state(output)
+        if state.pop(uuid, None) is not None:
+            _write_state(output, state)
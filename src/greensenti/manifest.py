@@ -0,0 +1,129 @@
+import base64
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where manifests are only locked between threads.
+    fcntl = None
+
+MANIFEST_FILENAME = ".greensenti-manifest.json"
+
+_MANIFEST_LOCK = threading.Lock()
+
+
+@contextmanager
+def _locked(output: Path) -> Iterator[None]:
+    """
+    Locks the manifest of an output folder between threads, and between processes sharing the folder.
+    """
+    with _MANIFEST_LOCK:
+        if fcntl is None:
+            yield
+            return
+        Path(output).mkdir(parents=True, exist_ok=True)
+        with open(Path(output, f"{MANIFEST_FILENAME}.lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def md5sum(filename: Path, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Computes the MD5 checksum of a file.
+
+    :param filename: Path to file.
+    :param chunk_size: Size of the chunks the file is read in.
+    :return: Hexadecimal MD5 checksum.
+    """
+    md5 = hashlib.md5()
+    with open(filename, "rb") as f:
+        while chunk := f.read(chunk_size):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def b64_to_hex(checksum: str) -> str:
+    """
+    Converts a base64 encoded checksum, as given by Google Cloud Storage, to hexadecimal.
+
+    :param checksum: Base64 encoded checksum.
+    :return: Hexadecimal checksum.
+    """
+    return base64.b64decode(checksum).hex()
+
+
+def read_manifest(output: Path) -> dict:
+    """
+    Reads the download manifest of an output folder, which records the products completely downloaded to it.
+
+    :param output: Output folder.
+    :return: Dictionary of product titles to their manifest entry.
+    """
+    manifest = Path(output, MANIFEST_FILENAME)
+    if not manifest.is_file():
+        return {}
+    with open(manifest) as f:
+        return json.load(f)
+
+
+def get_entry(output: Path, title: str | None = None, *, uuid: str | None = None) -> dict | None:
+    """
+    Gets the manifest entry of a product, by title or DHuS id.
+
+    :param output: Output folder.
+    :param title: Sentinel-2 product title.
+    :param uuid: Sentinel-2 product id.
+    :return: Manifest entry, or None if the product is not in the manifest.
+    """
+    manifest = read_manifest(output)
+    if title is not None:
+        return manifest.get(title)
+    return next((entry for entry in manifest.values() if entry.get("uuid") == uuid), None)
+
+
+def update_entry(output: Path, title: str, **fields) -> dict:
+    """
+    Updates the manifest entry of a product. The manifest is locked while it is updated, so concurrent processes don't
+    lose updates, and replaced atomically, so it is never left half written.
+
+    :param output: Output folder.
+    :param title: Sentinel-2 product title.
+    :param fields: Fields to set in the entry, e.g., `status="complete"`.
+    :return: Updated entry.
+    """
+    with _locked(output):
+        manifest = read_manifest(output)
+        entry = {**manifest.get(title, {}), "title": title, **fields, "updated": datetime.now().isoformat()}
+        manifest[title] = entry
+
+        Path(output).mkdir(parents=True, exist_ok=True)
+        tmp = Path(output, f"{MANIFEST_FILENAME}.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp, Path(output, MANIFEST_FILENAME))
+
+    return entry
+
+
+def complete_entries(output: Path) -> dict[str, dict]:
+    """
+    Gets the manifest entries of the products completely downloaded to an output folder, reading the manifest once.
+
+    :param output: Output folder.
+    :return: Dictionary of Sentinel-2 product ids to their manifest entry.
+    """
+    return {
+        entry["uuid"]: entry
+        for entry in read_manifest(output).values()
+        if entry.get("status") == "complete" and "uuid" in entry
+    }
@@ -0,0 +1,187 @@
+import math
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Iterator, List, Sequence
+
+import numpy as np
+import rasterio
+from rasterio.features import geometry_mask
+from rasterio.transform import from_origin
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import Resampling, transform_bounds
+from rasterio.windows import Window
+from sentinelsat import read_geojson
+from shapely.geometry import box
+
+from greensenti.band_arithmetic import SCL_CLOUD_VALUES
+from greensenti.raster import (
+    build_overviews,
+    default_overviews,
+    project_shape,
+    write_profile,
+)
+
+MOSAIC_RULES = ("first", "least-cloudy")
+
+
+def warped(src: rasterio.DatasetReader, kwargs: dict, resampling: Resampling) -> WarpedVRT:
+    """
+    Virtually reprojects a dataset onto a grid, e.g., of a mosaic. Sentinel-2 bands without nodata use 0 as nodata.
+    """
+    return WarpedVRT(
+        src,
+        crs=kwargs["crs"],
+        transform=kwargs["transform"],
+        width=kwargs["width"],
+        height=kwargs["height"],
+        src_nodata=src.nodata if src.nodata is not None else 0,
+        nodata=kwargs["nodata"],
+        resampling=resampling,
+    )
+
+
+def windows(width: int, height: int, size: int = 512) -> Iterator[Window]:
+    """
+    Iterates over the windows of a grid, so it is processed with bounded memory.
+    """
+    for row in range(0, height, size):
+        for col in range(0, width, size):
+            yield Window(col, row, min(size, width - col), min(size, height - row))
+
+
+def aligned_grid(bounds: Sequence[float], crs: str, resolution: float) -> dict:
+    """
+    Gets a grid covering some bounds, with its origin snapped to multiples of the resolution. Sentinel-2 tiles are
+    aligned to it, so rasters of different dates, or cropped by different shapes, share the same pixels.
+
+    :param bounds: Bounds (min x, min y, max x, max y) in the CRS of the grid.
+    :param crs: Coordinate reference system of the grid.
+    :param resolution: Resolution of the grid.
+    :return: Grid metadata (crs, transform, width and height).
+    """
+    # Bounds are rounded first, so floating point errors of reprojected bounds don't add a pixel.
+    min_x, min_y, max_x, max_y = (round(bound / resolution, 6) for bound in bounds)
+    left, top = math.floor(min_x) * resolution, math.ceil(max_y) * resolution
+    return {
+        "crs": crs,
+        "transform": from_origin(left, top, resolution, resolution),
+        "width": max(math.ceil(max_x - left / resolution), 1),
+        "height": max(math.ceil(top / resolution - min_y), 1),
+    }
+
+
+def aoi_cloud_fraction(scl: Path, geom: dict, kwargs: dict) -> float:
+    """
+    Computes the fraction of cloudy pixels of a SCL band inside an area of interest, window by window.
+
+    :param scl: SCL band for Sentinel-2 (20m).
+    :param geom: Area of interest geometry, in the CRS of the grid.
+    :param kwargs: Grid metadata (crs, transform, width and height) to evaluate the SCL band on.
+    :return: Fraction of cloudy pixels over valid ones, from 0 to 1. Products without valid pixels return 1.
+    """
+    cloudy = valid = 0
+    with rasterio.open(scl) as src, warped(src, {**kwargs, "nodata": 0}, Resampling.nearest) as vrt:
+        for window in windows(vrt.width, vrt.height):
+            inside = geometry_mask(
+                [geom], out_shape=(window.height, window.width), transform=vrt.window_transform(window), invert=True
+            )
+            classes = vrt.read(1, window=window)
+            is_valid = inside & (classes != 0)
+            valid += np.count_nonzero(is_valid)
+            cloudy += np.count_nonzero(is_valid & np.isin(classes, SCL_CLOUD_VALUES))
+    return cloudy / valid if valid else 1.0
+
+
+def mosaic(
+    filenames: List[Path],
+    geojson: Path,
+    output: Path,
+    geojson_crs: str = "epsg:4326",
+    *,
+    crs: str | None = None,
+    resolution: float | None = None,
+    rule: str = "first",
+    scl: List[Path] | None = None,
+    resampling: str = "nearest",
+) -> Path:
+    """
+    Mosaics several same-date rasters, e.g., the same band of two Sentinel-2 tiles, cropped by an area of interest.
+
+    Rasters may be in different CRS (UTM zones). Each one is reprojected window by window onto a common grid aligned to
+    the area of interest, so memory usage doesn't depend on the number or size of the rasters.
+
+    Overlapping pixels are resolved by a rule:
+
+    * "first": first valid pixel, in the order of `filenames`.
+    * "least-cloudy": first valid pixel, with rasters sorted by the cloud fraction of their SCL band inside the area.
+
+    :param filenames: Paths to input rasters.
+    :param geojson: Area of interest in GeoJSON format.
+    :param output: Path to output file.
+    :param geojson_crs: Coordinate reference system of the GeoJSON file.
+    :param crs: Coordinate reference system of the mosaic. Defaults to the one of the first raster.
+    :param resolution: Resolution of the mosaic. Defaults to the one of the first raster.
+    :param rule: Rule to resolve overlaps, one of "first" or "least-cloudy".
+    :param scl: SCL bands of each raster, in the same order as `filenames`. Required by the "least-cloudy" rule.
+    :param resampling: Resampling method, one of `rasterio.enums.Resampling`.
+    :return: Path to output file.
+    """
+    if rule not in MOSAIC_RULES:
+        raise ValueError(f"Unknown mosaic rule {rule}, expected one of {MOSAIC_RULES}.")
+    if rule == "least-cloudy" and (not scl or len(scl) != len(filenames)):
+        raise ValueError("The least-cloudy rule requires a SCL band for each raster.")
+
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+
+    with rasterio.open(filenames[0]) as first:
+        kwargs = first.meta.copy()
+        crs = crs or first.crs
+        resolution = resolution or first.res[0]
+
+    geom = read_geojson(geojson)["features"][0]["geometry"]
+    aoi = project_shape(geom, scs=geojson_crs, dcs=str(crs))
+
+    # Grid is snapped to multiples of the resolution, so mosaics of different dates are aligned.
+    kwargs.update(
+        driver="GTiff",
+        **aligned_grid(aoi.bounds, crs, resolution),
+        nodata=kwargs["nodata"] if kwargs["nodata"] is not None else 0,
+    )
+
+    if rule == "least-cloudy":
+        cloud_fractions = [aoi_cloud_fraction(s, aoi.__geo_interface__, kwargs) for s in scl]
+        filenames = [f for _, f in sorted(zip(cloud_fractions, filenames, strict=True), key=lambda x: x[0])]
+
+    with ExitStack() as stack, rasterio.open(output, "w", **write_profile(kwargs)) as dst:
+        sources = []
+        for filename in filenames:
+            src = stack.enter_context(rasterio.open(filename))
+            footprint = box(*transform_bounds(src.crs, crs, *src.bounds))
+            sources.append((stack.enter_context(warped(src, kwargs, Resampling[resampling])), footprint))
+
+        for window in windows(dst.width, dst.height):
+            window_box = box(*dst.window_bounds(window))
+            outside = geometry_mask(
+                [aoi], out_shape=(window.height, window.width), transform=dst.window_transform(window)
+            )
+            data = np.full((dst.count, window.height, window.width), dst.nodata, dtype=dst.dtypes[0])
+            missing = ~outside
+
+            for vrt, footprint in sources:
+                if not missing.any():
+                    break
+                if not footprint.intersects(window_box):
+                    continue
+                block = vrt.read(window=window, masked=True)
+                fill = missing & ~np.ma.getmaskarray(block).any(axis=0)
+                data[:, fill] = block.data[:, fill]
+                missing &= ~fill
+
+            dst.write(data, window=window)
+
+    levels, overview_resampling = default_overviews()
+    if levels != "none":
+        build_overviews(output, levels=levels, resampling=overview_resampling)
+
+    return output
@@ -0,0 +1,363 @@
+import inspect
+import os
+import shutil
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterator, List, Union
+
+import greensenti.band_arithmetic as ba
+from greensenti import catalog as product_catalog
+from greensenti import compute, dhus, raster, stats
+from greensenti.incremental import fingerprint, is_up_to_date, record
+from greensenti.manifest import update_entry
+
+# Band arithmetic steps, computed from the bands of each product.
+INDEX_STEPS: dict[str, Callable] = {
+    "cloud-mask": ba.cloud_mask,
+    "tc": ba.true_color,
+    "bri": ba.bri,
+    "bsi": ba.bsi,
+    "cri1": ba.cri1,
+    "evi": ba.evi,
+    "evi2": ba.evi2,
+    "mndwi": ba.mndwi,
+    "moisture": ba.moisture,
+    "ndre": ba.ndre,
+    "ndsi": ba.ndsi,
+    "ndvi": ba.ndvi,
+    "ndwi": ba.ndwi,
+    "ndyi": ba.ndyi,
+    "osavi": ba.osavi,
+    "ri": ba.ri,
+}
+
+# Raster steps, applied to the output of every band arithmetic step.
+RASTER_STEPS = ("quicklook", "stats")
+
+# Bands of band arithmetic parameters not named after them.
+BAND_PARAMETERS = {"r": "B04", "g": "B03", "b": "B02", "scl": "SCL"}
+
+# Bands resampled to 10m by band arithmetic steps, e.g., B05 of BRI. They are taken at their native resolution, and
+# the rest of bands of the step at 10m.
+RESAMPLED_BANDS = {"bri": ["B05"], "bsi": ["B11"]}
+
+
+def step_bands(step: str) -> dict[str, str]:
+    """
+    Gets the bands a band arithmetic step is computed from.
+
+    :param step: Step name, one of `INDEX_STEPS`.
+    :return: Dictionary of step function parameters to band names, e.g., {"b4": "B04", "b8": "B08"}.
+    """
+    parameters = inspect.signature(INDEX_STEPS[step]).parameters.values()
+    return {
+        parameter.name: BAND_PARAMETERS.get(parameter.name, f"B{parameter.name[1:].zfill(2).upper()}")
+        for parameter in parameters
+        if parameter.kind == parameter.POSITIONAL_OR_KEYWORD and parameter.default is parameter.empty
+    }
+
+
+def _find_bands(product: Path, bands: List[str], resolution: int, resampled: List[str] = ()) -> dict[str, str]:
+    """
+    Finds the bands of a product at a common resolution, the coarsest one any of them is available at. Bands resampled
+    by the step are taken at their finest resolution instead, and the rest at 10m.
+    """
+    if resampled:
+        return {band: dhus.find_band(product, band, None if band in resampled else 10) for band in bands}
+    found = {band: dhus.find_band(product, band, resolution) for band in bands}
+    coarsest = max(int(dhus.BAND_FILE_PATTERN.search(path).group("resolution")) for path in found.values())
+    if coarsest == resolution:
+        return found
+    return {band: dhus.find_band(product, band, coarsest) for band in bands}
+
+
+def process_product(
+    product: Path,
+    output: Path,
+    steps: List[str],
+    geojson: Path | None = None,
+    geojson_crs: str = "epsg:4326",
+    resolution: int = 10,
+    scl_classes: List[int] | None = None,
+    backend: str | None = None,
+    incremental: bool = False,
+) -> dict[str, str]:
+    """
+    Runs a list of processing steps on a downloaded product.
+
+    The validity mask of each band arithmetic step covers pixels with data in the bands of the step, not of the other
+    steps, and not of the given SCL classes. Band and SCL files are read once and shared by every step, see
+    `band_arithmetic.valid_mask`.
+
+    :param product: Product folder or zip file.
+    :param output: Output folder of the product.
+    :param steps: Step names, from `INDEX_STEPS` and `RASTER_STEPS`.
+    :param geojson: Area of interest in GeoJSON format. If provided, bands are cropped by it before any step.
+    :param geojson_crs: Coordinate reference system of the GeoJSON file.
+    :param resolution: Preferred band resolution in meters.
+    :param scl_classes: SCL classes masked as no data in every output, e.g., `band_arithmetic.SCL_CLOUD_VALUES`.
+    :param backend: Compute backend of band arithmetic steps, see `compute.get_backend`.
+    :param incremental: Skip outputs computed from the same inputs and parameters in a previous run, see
+     `incremental.is_up_to_date`.
+    :return: Dictionary of output names to paths.
+    """
+    output = Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    outputs = {}
+
+    index_steps = [step for step in steps if step in INDEX_STEPS]
+    paths = {
+        step: _find_bands(product, list(step_bands(step).values()), resolution, RESAMPLED_BANDS.get(step, []))
+        for step in index_steps
+    }
+    # Resolution of the output of each step, the finest of its bands.
+    resolutions = {
+        step: min(int(dhus.BAND_FILE_PATTERN.search(path).group("resolution")) for path in step_paths.values())
+        for step, step_paths in paths.items()
+    }
+    scl = {res: dhus.find_band(product, "SCL", res) for res in set(resolutions.values())} if scl_classes else {}
+
+    if geojson:
+        # Each band file is cropped once, even if used by several steps.
+        cropped = {}
+        for path in {path for step_paths in [*paths.values(), scl] for path in step_paths.values()}:
+            cropped[path] = raster.apply_mask(
+                path, geojson, geojson_crs, output=output / f"{Path(path).stem}_masked.tif", incremental=incremental
+            )
+        paths = {step: {band: cropped[path] for band, path in step_paths.items()} for step, step_paths in paths.items()}
+        scl = {res: cropped[path] for res, path in scl.items()}
+
+    # Steps not masking invalid pixels, e.g., "tc", don't take a validity mask nor a compute backend.
+    masked_steps = [step for step in index_steps if "valid" in inspect.signature(INDEX_STEPS[step]).parameters]
+    band_masks, scl_bands = {}, {}
+
+    def valid_mask(step: str):
+        # Masks are read on first use, so they are not read at all if every output is up to date. Each band and SCL
+        # file is read once, even if used by several steps.
+        for path in paths[step].values():
+            if path not in band_masks:
+                band_masks[path] = ba.read_valid_mask(path)
+        res = resolutions[step]
+        if scl and res not in scl_bands:
+            scl_bands[res] = ba.read_band(scl[res])[0]
+        return ba.valid_mask(
+            *(band_masks[path] for path in paths[step].values()), scl=scl_bands.get(res), scl_classes=scl_classes or []
+        )
+
+    for step in index_steps:
+        bands = step_bands(step)
+        filename = output / f"{step}.tif"
+        inputs = dict(paths[step])
+        if step in masked_steps and scl:
+            inputs["SCL"] = scl[resolutions[step]]
+        computed = fingerprint(step, inputs, {"scl_classes": scl_classes}) if incremental else None
+        if not incremental or not is_up_to_date(filename, computed):
+            options = {"valid": valid_mask(step), "backend": backend} if step in masked_steps else {}
+            INDEX_STEPS[step](
+                **{parameter: paths[step][band] for parameter, band in bands.items()}, **options, output=filename
+            )
+            if incremental:
+                record(filename, computed)
+        outputs[step] = str(filename)
+
+        if "stats" in steps:
+            stats.raster_stats(filename)
+        if "quicklook" in steps:
+            quicklook = output / f"{step}.png"
+            computed = fingerprint("quicklook", {"filename": filename}) if incremental else None
+            if not incremental or not is_up_to_date(quicklook, computed):
+                raster.quicklook(filename, quicklook)
+                if incremental:
+                    record(quicklook, computed)
+            outputs[f"{step}-quicklook"] = str(quicklook)
+
+    return outputs
+
+
+def remove_product(folder: Path, title: str) -> None:
+    """
+    Removes the raw files of a downloaded product, keeping its manifest entry as removed so it is downloaded again if
+    needed.
+
+    :param folder: Download folder.
+    :param title: Sentinel-2 product title.
+    """
+    shutil.rmtree(Path(folder, title), ignore_errors=True)
+    Path(folder, f"{title}.zip").unlink(missing_ok=True)
+    update_entry(folder, title, status="removed")
+
+
+def step_outputs(output: Path, title: str, steps: List[str]) -> dict[str, Path]:
+    """
+    Gets the outputs processing steps write for a product.
+
+    :param output: Output folder of processed files.
+    :param title: Sentinel-2 product title.
+    :param steps: Step names, from `INDEX_STEPS` and `RASTER_STEPS`.
+    :return: Dictionary of output names to paths, as returned by `process_product`.
+    """
+    outputs = {}
+    for step in steps:
+        if step in INDEX_STEPS:
+            outputs[step] = Path(output, title, f"{step}.tif")
+            if "quicklook" in steps:
+                outputs[f"{step}-quicklook"] = Path(output, title, f"{step}.png")
+    return outputs
+
+
+def processed_titles(catalog: Path, output: Path, steps: List[str]) -> set[str]:
+    """
+    Finds the products every output of a list of steps was recorded for in the catalog, and still exists.
+
+    :param catalog: Path to SQLite catalog file.
+    :param output: Output folder of processed files.
+    :param steps: Step names, from `INDEX_STEPS` and `RASTER_STEPS`.
+    :return: Product titles.
+    """
+    processed = set()
+    for product in product_catalog.products(status="processed", catalog=catalog):
+        expected = step_outputs(output, product["title"], steps)
+        recorded = product["outputs"]
+        if all(
+            name in recorded and Path(recorded[name]).resolve() == path.resolve() and path.is_file()
+            for name, path in expected.items()
+        ):
+            processed.add(product["title"])
+    return processed
+
+
+def download_and_process(
+    geojson: Path = None,
+    text_match: str | None = "*",
+    from_date: Union[str, datetime] = None,
+    to_date: Union[str, datetime] = None,
+    *,
+    steps: List[str] = ("ndvi",),
+    output: Path = Path("."),
+    downloads: Path | None = None,
+    crop: bool = True,
+    geojson_crs: str = "epsg:4326",
+    resolution: int = 10,
+    scl_classes: List[int] | None = None,
+    backend: str | None = None,
+    incremental: bool = False,
+    io_workers: int = 4,
+    cpu_workers: int | None = None,
+    queue_size: int | None = None,
+    delete_raw: bool = False,
+    catalog: Path | None = os.environ.get("GREENSENTI_CATALOG", None),
+    **kwargs,
+) -> Iterator[dict]:
+    """
+    Downloads Sentinel-2 products and processes each one as soon as it is downloaded, so the network and the CPU are
+    used at the same time.
+
+    Completed downloads are fed to a bounded queue of processing jobs. When the queue is full, no more downloads are
+    started until a job finishes, so at most `queue_size` products (plus those being downloaded) are on disk. Only
+    the bands required by the steps are extracted.
+
+    :param geojson: GeoJSON file with product geometries.
+    :param text_match: Regular expresion to match the product filename.
+    :param from_date: From date %Y-%m-%d (begin date).
+    :param to_date: To date %Y-%m-%d (end date).
+    :param steps: Processing steps, e.g., ["ndvi", "evi", "quicklook"]. Band arithmetic steps (`INDEX_STEPS`) write
+     `<output>/<title>/<step>.tif`, and raster steps (`RASTER_STEPS`) are applied to each of them.
+    :param output: Output folder of processed files.
+    :param downloads: Download folder. Defaults to `<output>/downloads`.
+    :param crop: Crop bands by the GeoJSON geometry before processing them.
+    :param geojson_crs: Coordinate reference system of the GeoJSON file.
+    :param resolution: Preferred band resolution in meters.
+    :param scl_classes: SCL classes masked as no data in every output, e.g., `band_arithmetic.SCL_CLOUD_VALUES`.
+    :param backend: Compute backend of band arithmetic steps, one of "numpy", "numexpr" or "numba". Taken from
+     enviroment as GREENSENTI_COMPUTE_BACKEND if available.
+    :param incremental: Skip outputs computed from the same inputs and parameters in a previous run. Fingerprints of
+     the inputs are recorded next to each output (`<output>.inputs.json`).
+    :param io_workers: Number of concurrent downloads.
+    :param cpu_workers: Number of products processed at the same time. Defaults to the number of CPUs.
+    :param queue_size: Maximum number of downloaded products waiting to be processed. Defaults to twice `cpu_workers`.
+    :param delete_raw: Remove the downloaded files of each product once it is processed.
+    :param catalog: Local SQLite product catalog. Processed outputs are recorded in it, and products with every output
+     of the steps already processed are skipped. Products downloaded but not processed, e.g., by an interrupted run,
+     are processed. Taken from enviroment as GREENSENTI_CATALOG if available.
+    :param kwargs: Other parameters of `dhus.download`, e.g., `max_clouds`.
+    :return: Yields an iterator of dictionaries with the product metadata, status and processed outputs
+    """
+    steps = steps.split(",") if isinstance(steps, str) else list(steps)
+    unknown = [step for step in steps if step not in INDEX_STEPS and step not in RASTER_STEPS]
+    if unknown:
+        raise ValueError(f"Unknown steps {unknown}, expected any of {list(INDEX_STEPS) + list(RASTER_STEPS)}.")
+
+    output = Path(output)
+    downloads = Path(downloads) if downloads else output / "downloads"
+    cpu_workers = cpu_workers or os.cpu_count() or 1
+    queue_size = queue_size or 2 * cpu_workers
+    bands = sorted({band for step in steps if step in INDEX_STEPS for band in step_bands(step).values()})
+    if scl_classes:
+        bands = sorted({*bands, "SCL"})
+
+    skip = list(kwargs.pop("skip", None) or [])
+    if catalog:
+        processed = processed_titles(catalog, output, steps)
+        if processed:
+            print(f"Skipping {len(processed)} products already processed")
+            skip.extend(processed)
+
+    products = dhus.download(
+        geojson,
+        text_match,
+        from_date,
+        to_date,
+        skip=skip,
+        output=downloads,
+        bands=bands,
+        resolution=resolution,
+        workers=io_workers,
+        catalog=catalog,
+        extract="bands",
+        **kwargs,
+    )
+
+    def finish(future, product: dict) -> dict:
+        try:
+            outputs = future.result()
+        except Exception as e:
+            return {**product, "status": "failed", "error": str(e)}
+        if catalog:
+            for name, path in outputs.items():
+                product_catalog.add_output(catalog, product["title"], name, path)
+        if delete_raw:
+            remove_product(downloads, product["title"])
+        return {**product, "outputs": outputs}
+
+    with ProcessPoolExecutor(max_workers=cpu_workers, mp_context=compute.mp_context()) as executor:
+        pending = {}
+        for product in products:
+            if product["status"] != "ok":
+                yield product
+                continue
+
+            # Wait for a free slot in the queue, yielding finished products meanwhile.
+            while len(pending) >= queue_size:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield finish(future, pending.pop(future))
+
+            job = executor.submit(
+                process_product,
+                Path(product.get("path") or downloads / product["title"]),
+                output / product["title"],
+                steps,
+                geojson if crop else None,
+                geojson_crs,
+                resolution,
+                scl_classes,
+                backend,
+                incremental,
+            )
+            pending[job] = product
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield finish(future, pending.pop(future))
@@ -1,10 +1,13 @@
+import os
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Optional, Sequence, Tuple
 
 import numpy as np
 import pyproj
 import rasterio
+from matplotlib import colormaps
 from matplotlib import pyplot as plt
+from matplotlib.colors import Normalize
 from rasterio import mask
 from rasterio.plot import adjust_band, reshape_as_image, reshape_as_raster
 from rasterio.warp import Resampling, reproject
@@ -12,6 +15,9 @@ from sentinelsat import read_geojson
 from shapely.geometry import Polygon, shape
 from shapely.ops import transform
 
+from greensenti.incremental import fingerprint, is_up_to_date, record
+from greensenti.stats import cached_stats, percentile_key, raster_stats
+
 
 def crop_by_shape(filename: Path, geom: Polygon, output: str, override_no_data: float | None = None) -> None:
     """
@@ -31,8 +37,107 @@ def crop_by_shape(filename: Path, geom: Polygon, output: str, override_no_data:
     out_meta.update(
         {"driver": "GTiff", "height": out_image.shape[1], "width": out_image.shape[2], "transform": out_transform}
     )
-    with rasterio.open(output, "w", **out_meta) as dest:
-        dest.write(out_image)
+    write_raster(output, out_image, out_meta)
+
+
+def overview_levels(width: int, height: int, min_size: int = 256) -> list[int]:
+    """
+    Computes power of two overview decimation factors for a raster, stopping once the overview is smaller than a tile.
+
+    :param width: Raster width.
+    :param height: Raster height.
+    :param min_size: Minimum size (in pixels) of the largest side of the coarsest overview.
+    :return: List of decimation factors, e.g., [2, 4, 8, 16].
+    """
+    levels = []
+    factor = 2
+    while max(width, height) // factor >= min_size:
+        levels.append(factor)
+        factor *= 2
+    return levels
+
+
+def build_overviews(
+    filename: Path, levels: Sequence[int] | int | str = "auto", resampling: str = "nearest"
+) -> list[int]:
+    """
+    Build internal overviews (pyramids) of an existing raster, so zoomed-out reads don't decode the full resolution.
+
+    :param filename: Path to raster file. It is modified in place.
+    :param levels: Overview decimation factors, e.g., 2,4,8,16. Use "auto" to compute them from the raster size.
+    :param resampling: Resampling method, one of `rasterio.enums.Resampling`, e.g., "nearest", "average" or "bilinear".
+    :return: Overview decimation factors built.
+    """
+    with rasterio.open(filename, "r+") as dst:
+        if levels == "auto":
+            levels = overview_levels(dst.width, dst.height)
+        elif isinstance(levels, int):
+            levels = [levels]
+        if not levels:
+            return []
+        levels = [int(level) for level in levels]
+        dst.build_overviews(levels, Resampling[resampling])
+        dst.update_tags(ns="rio_overview", resampling=resampling)
+    return levels
+
+
+def write_raster(
+    output: Path | str,
+    data: np.ndarray,
+    kwargs: dict,
+    *,
+    overviews: Sequence[int] | str | None = None,
+    resampling: str | None = None,
+) -> None:
+    """
+    Write raster data to file. This is the shared write path of every raster output of the package: GTiff outputs are
+    tiled and get internal overviews.
+
+    :param output: Path to output file.
+    :param data: Raster d-array to write, with shape (bands, height, width).
+    :param kwargs: Raster metadata.
+    :param overviews: Overview decimation factors, "auto" to compute them from the raster size or "none" to skip them.
+     Taken from enviroment as GREENSENTI_OVERVIEWS (comma separated factors) if available, defaults to "auto".
+    :param resampling: Overview resampling method. Taken from enviroment as GREENSENTI_OVERVIEW_RESAMPLING if
+     available, defaults to "nearest".
+    """
+    kwargs = write_profile(kwargs)
+
+    with rasterio.open(output, "w", **kwargs) as dest:
+        dest.write(data)
+
+    if kwargs.get("driver") == "GTiff":
+        default_levels, default_resampling = default_overviews()
+        levels = default_levels if overviews is None else overviews
+        if levels != "none":
+            build_overviews(output, levels=levels, resampling=resampling or default_resampling)
+
+
+def write_profile(kwargs: dict) -> dict:
+    """
+    Get the raster metadata used to write outputs. GTiff outputs are tiled, so windowed reads only decode the blocks
+    they need.
+
+    :param kwargs: Raster metadata.
+    :return: Copy of the raster metadata with the creation options.
+    """
+    kwargs = kwargs.copy()
+    if kwargs.get("driver") == "GTiff" and min(kwargs["width"], kwargs["height"]) >= 256:
+        kwargs.update(tiled=True, blockxsize=256, blockysize=256)
+    return kwargs
+
+
+def default_overviews() -> Tuple[Sequence[int] | str, str]:
+    """
+    Get the overview levels and resampling method applied to written rasters.
+
+    :return: Overview levels, taken from enviroment as GREENSENTI_OVERVIEWS (comma separated factors, "auto" or
+     "none") if available, and resampling method, taken from enviroment as GREENSENTI_OVERVIEW_RESAMPLING if available.
+    """
+    levels: Sequence[int] | str = os.environ.get("GREENSENTI_OVERVIEWS", "auto")
+    if levels not in ("auto", "none"):
+        levels = [int(level) for level in str(levels).split(",") if level.strip()]
+    return levels, os.environ.get("GREENSENTI_OVERVIEW_RESAMPLING", "nearest")
 
 
 def project_shape(geom: Polygon, scs: str = "epsg:4326", dcs: str = "epsg:32630") -> Polygon:
@@ -72,17 +177,15 @@ def save_as_img(raster: np.ndarray, output: Path, **kwargs) -> None:
     plt.close(fig)
 
 
-def transform_image(band: Path, color_map: Optional[str], output: Path) -> None:
+def raster_to_image(source: np.ndarray, limits: Sequence[Tuple[float, float]] | None = None) -> np.ndarray:
     """
-    Transform raster to image. See full list of accepted drivers at https://gdal.org/drivers/raster/index.html.
+    Reshape raster data to image, stretching each band by its min/max when there are 3+ bands so it plots as RGB.
 
-    :param band: TIF band image.
-    :param color_map: Color map to use.
-    :param output: Path to output file.
+    :param source: Raster d-array, with shape (bands, height, width). Masked arrays are supported.
+    :param limits: Per band (low, high) values to stretch between, e.g., from `greensenti.stats.raster_stats`.
+     If not provided, the min/max of the array are used.
+    :return: Image array, with shape (height, width) or (height, width, bands).
     """
-    with rasterio.open(band) as b:
-        source = b.read().astype(np.float32)
-
     # If the source is a numpy array, reshape it to image if it has 3+ bands.
     source = np.ma.squeeze(source)
     if len(source.shape) >= 3:
@@ -93,31 +196,154 @@ def transform_image(band: Path, color_map: Optional[str], output: Path) -> None:
         # Adjust each band by the min/max so it will plot as RGB.
         arr = reshape_as_raster(arr)
         for ii, band in enumerate(arr):
-            arr[ii] = adjust_band(band, kind="linear")
+            if limits:
+                low, high = limits[ii]
+                arr[ii] = np.clip((band - low) / ((high - low) or 1), 0, 1)
+            else:
+                arr[ii] = adjust_band(band, kind="linear")
         arr = reshape_as_image(arr)
+    return arr
+
+
+def stretch_limits(
+    band_stats: list[dict], percentiles: Tuple[float, float] | None = None
+) -> list[Tuple[float, float]] | None:
+    """
+    Gets the per band (low, high) values to stretch a raster between from its statistics.
+
+    :param band_stats: Statistics of each band, as returned by `greensenti.stats.raster_stats`.
+    :param percentiles: Percentiles to stretch between, e.g., (2, 98). If not provided, min/max are used.
+    :return: List of (low, high) values, or None if any band has no valid data or misses the percentiles.
+    """
+    if not all(band["count"] for band in band_stats):
+        return None
+    if percentiles:
+        keys = [percentile_key(p) for p in percentiles]
+        if not all(key in band["percentiles"] for band in band_stats for key in keys):
+            return None
+        return [tuple(band["percentiles"][key] for key in keys) for band in band_stats]
+    return [(band["min"], band["max"]) for band in band_stats]
+
+
+def transform_image(
+    band: Path, color_map: Optional[str], output: Path, percentiles: Tuple[float, float] | None = None
+) -> None:
+    """
+    Transform raster to image. See full list of accepted drivers at https://gdal.org/drivers/raster/index.html.
+
+    :param band: TIF band image.
+    :param color_map: Color map to use.
+    :param output: Path to output file.
+    :param percentiles: Percentiles to stretch RGB images between, e.g., (2, 98). Defaults to min/max.
+    """
+    with rasterio.open(band) as b:
+        source = b.read().astype(np.float32)
+
+    limits = None
+    if source.shape[0] >= 3:
+        # Statistics are streamed and cached next to the raster, so they are only computed once.
+        limits = stretch_limits(raster_stats(band, percentiles=percentiles or (2, 98)), percentiles)
+
+    arr = raster_to_image(source, limits)
 
     save_as_img(raster=arr, output=output, cmap=color_map)
 
 
+def quicklook(
+    band: Path,
+    output: Path,
+    size: int = 512,
+    color_map: Optional[str] = None,
+    percentiles: Tuple[float, float] | None = None,
+) -> None:
+    """
+    Write a small preview image of a raster, e.g., an index GTiff or a product TCI band, with the same stretch and
+    color map as `transform_image`. Data is read decimated, so overviews (or JPEG2000 resolution levels) are used
+    instead of decoding the raster at full resolution.
+
+    :param band: Raster image.
+    :param output: Path to output file.
+    :param size: Size in pixels of the largest side of the preview.
+    :param color_map: Color map to use. Only applies to single band rasters.
+    :param percentiles: Percentiles to stretch between, e.g., (2, 98). Defaults to min/max.
+    """
+    with rasterio.open(band) as b:
+        scale = max(b.width, b.height) / size
+        if scale > 1:
+            out_shape = (b.count, max(1, round(b.height / scale)), max(1, round(b.width / scale)))
+        else:
+            out_shape = (b.count, b.height, b.width)
+        source = b.read(out_shape=out_shape, masked=True).astype(np.float32)
+
+    # Full resolution statistics are used if they are already cached, otherwise the preview itself is stretched.
+    limits = None
+    if (band_stats := cached_stats(band)) is not None:
+        limits = stretch_limits(band_stats, percentiles)
+    if limits is None and percentiles:
+        pixels = np.ma.masked_invalid(source.reshape((len(source), -1)))
+        limits = [tuple(np.percentile(p.compressed(), percentiles)) if p.count() else (0, 1) for p in pixels]
+
+    arr = raster_to_image(source, limits)
+
+    if arr.ndim == 2:
+        # Masked pixels are mapped to the transparent "bad" color of the color map.
+        cmap = colormaps[color_map or plt.rcParams["image.cmap"]]
+        norm = Normalize(*limits[0]) if limits else Normalize()
+        rgba = cmap(norm(arr))
+    else:
+        rgba = np.ones((*arr.shape[:2], 4), dtype=np.float32)
+        rgba[..., :3] = np.ma.filled(arr[..., :3], 0)
+        rgba[..., 3] = ~np.ma.getmaskarray(arr[..., :3]).all(axis=-1)
+
+    plt.imsave(output, rgba)
+
+
+def local_folder(filename: str | Path) -> Path:
+    """
+    Gets the folder of a raster file. Files inside a zip file, given as GDAL `/vsizip/` paths, are placed next to it.
+
+    :param filename: Path to raster file.
+    :return: Local folder.
+    """
+    if str(filename).startswith("/vsizip/"):
+        archive, _ = str(filename).removeprefix("/vsizip/").split(".zip/", 1)
+        return Path(archive + ".zip").parent
+    return Path(filename).parent
+
+
 def apply_mask(
     filename: Path,
     geojson: Path,
     geojson_crs: str = "epsg:4326",
     output: Path | None = None,
     override_no_data: float | None = None,
+    *,
+    incremental: bool = False,
 ) -> Path:
     """
     Crop image data (jp2 imagery file) by shape.
 
-    :param filename: Path to input file.
+    :param filename: Path to input file, or GDAL virtual path, e.g., `/vsizip//data/<title>.zip/<band>.jp2`.
     :param geojson: Geometry in GeoJSON format.
     :param geojson_crs: Coordinate reference system of the GeoJSON file. If different from the input file, the shape will be projected.
-    :param output: Path to output file. If not provided, the output will be saved in the same directory as the input file.
+    :param output: Path to output file. If not provided, the output will be saved in the same directory as the input file
+     (or its zip file).
     :param override_no_data: Value to fill outside the crop area. Useful to separate no data of fill. Raises `ValueError` if this value is present in the raster.
+    :param incremental: Skip the crop if the output was computed from the same inputs, see `incremental.is_up_to_date`.
     :return: Path to output file.
     """
     if not output:
-        output = filename.parent / f"{filename.stem}_masked.tif"
+        output = local_folder(filename) / f"{Path(filename).stem}_masked.tif"
+    output = Path(output)
+
+    if incremental:
+        computed = fingerprint(
+            "apply_mask",
+            {"filename": filename, "geojson": geojson},
+            {"geojson_crs": geojson_crs, "override_no_data": override_no_data},
+        )
+        if is_up_to_date(output, computed):
+            return output
 
     if not output.parent.exists():
         output.parent.mkdir(parents=True)
@@ -127,12 +353,15 @@ def apply_mask(
 
     geojson = read_geojson(geojson)
     if geojson_crs != dsc:
-        shp = project_shape(geojson["features"][0]["geometry"])
+        shp = project_shape(geojson["features"][0]["geometry"], scs=geojson_crs, dcs=str(dsc))
     else:
         shp = geojson["features"][0]["geometry"]
 
     crop_by_shape(filename=filename, output=str(output), geom=shp, override_no_data=override_no_data)
 
+    if incremental:
+        record(output, computed)
+
     return output
 
 
@@ -0,0 +1,295 @@
+import inspect
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.transform import rowcol
+from rasterio.warp import transform
+
+import greensenti.band_arithmetic as ba
+from greensenti import dhus
+from greensenti.compute import evaluate
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Column names of point coordinates in CSV files.
+COORDINATE_COLUMNS = [("x", "y"), ("lon", "lat"), ("longitude", "latitude")]
+
+SENSING_TIME_PATTERN = re.compile(r"_(\d{8}T\d{6})_")
+
+
+def read_points(points: Path) -> pd.DataFrame:
+    """
+    Reads labelled points from a GeoJSON file of point features, or a CSV file with coordinate columns (x and y, lon
+    and lat, or longitude and latitude).
+
+    :param points: GeoJSON or CSV file.
+    :return: Points dataframe, with a "point_id" column (taken from the file if available), "x" and "y" coordinates,
+     and the rest of properties or columns.
+    """
+    points = Path(points)
+    if points.suffix.lower() in (".geojson", ".json"):
+        with open(points) as f:
+            features = json.load(f)["features"]
+        rows = []
+        for i, feature in enumerate(features):
+            if feature["geometry"]["type"] != "Point":
+                raise ValueError(f"Expected point features, found {feature['geometry']['type']}.")
+            x, y = feature["geometry"]["coordinates"][:2]
+            rows.append({"point_id": feature.get("id", i), **feature.get("properties", {}), "x": x, "y": y})
+        df = pd.DataFrame(rows)
+    else:
+        df = pd.read_csv(points)
+        columns = {column.lower(): column for column in df.columns}
+        x, y = next(((x, y) for x, y in COORDINATE_COLUMNS if x in columns and y in columns), (None, None))
+        if x is None:
+            raise ValueError(f"Coordinate columns not found in {points}, expected one of {COORDINATE_COLUMNS}.")
+        df = df.rename(columns={columns[x]: "x", columns[y]: "y"})
+
+    if "point_id" not in df.columns:
+        df.insert(0, "point_id", df.get("id", df.index))
+    return df
+
+
+def index_bands(index: str) -> dict[str, str]:
+    """
+    Gets the bands an index expression is evaluated from.
+
+    :param index: Index name, one of `band_arithmetic.INDEX_EXPRESSIONS`.
+    :return: Dictionary of expression variables to band names, e.g., {"b4": "B04", "b8": "B08"}.
+    """
+    variables = re.findall(r"\bb\w+\b", ba.INDEX_EXPRESSIONS[index])
+    return {variable: f"B{variable[1:].zfill(2).upper()}" for variable in sorted(set(variables))}
+
+
+def _coefficients(index: str) -> dict[str, float]:
+    """
+    Default coefficients of an index, e.g., Y of OSAVI, taken from its band arithmetic function.
+    """
+    parameters = inspect.signature(getattr(ba, index)).parameters.values()
+    return {
+        parameter.name: parameter.default
+        for parameter in parameters
+        if parameter.kind == parameter.POSITIONAL_OR_KEYWORD and parameter.default is not parameter.empty
+    }
+
+
+def sample_band(filename: str | Path, xs: np.ndarray, ys: np.ndarray, crs: str = "epsg:4326") -> np.ndarray:
+    """
+    Samples the pixels of a band at a set of points. Points are grouped by the internal blocks of the raster, and only
+    the blocks containing points are read.
+
+    :param filename: Path to band file, e.g., a `/vsizip/` path of `dhus.find_band`.
+    :param xs: Point x coordinates.
+    :param ys: Point y coordinates.
+    :param crs: Coordinate reference system of the points.
+    :return: Array of pixel values as float32, NaN for points outside the raster or without data (zero).
+    """
+    values = np.full(len(xs), np.nan, dtype=np.float32)
+    if len(xs) == 0:
+        return values
+
+    with rasterio.open(filename) as src:
+        x, y = transform(crs, src.crs, list(xs), list(ys))
+        rows, cols = (np.asarray(axis) for axis in rowcol(src.transform, x, y))
+        inside = (rows >= 0) & (rows < src.height) & (cols >= 0) & (cols < src.width)
+
+        block_height, block_width = src.block_shapes[0]
+        block_cols = -(-src.width // block_width)
+        blocks = (rows // block_height) * block_cols + cols // block_width
+        for block in np.unique(blocks[inside]):
+            selected = inside & (blocks == block)
+            window = src.block_window(1, block // block_cols, block % block_cols)
+            data = src.read(1, window=window)
+            values[selected] = data[rows[selected] - window.row_off, cols[selected] - window.col_off]
+
+    values[values == 0] = np.nan
+    return values
+
+
+def sample_product(
+    product: Path,
+    points: pd.DataFrame,
+    indices: List[str] = ("ndvi",),
+    bands: List[str] = (),
+    resolution: int = 10,
+    points_crs: str = "epsg:4326",
+    backend: str | None = None,
+) -> pd.DataFrame:
+    """
+    Samples band and index values of a product at a set of points. Indices are evaluated at the sampled pixels only,
+    so no full tile raster is computed.
+
+    :param product: Product folder or zip file.
+    :param points: Points dataframe, see `read_points`.
+    :param indices: Index names, from `band_arithmetic.INDEX_EXPRESSIONS`.
+    :param bands: Band names to sample, e.g., ["B04", "SCL"].
+    :param resolution: Preferred band resolution in meters. Each band is sampled at its finest resolution from it.
+    :param points_crs: Coordinate reference system of the points.
+    :param backend: Compute backend, see `compute.get_backend`.
+    :return: Long format dataframe, with a row per point and variable (band or index) with data.
+    """
+    required = {band for index in indices for band in index_bands(index).values()} | set(bands)
+
+    # Points outside the tile are discarded with the first band, so the rest of bands are only read where needed.
+    values = {}
+    for band in sorted(required):
+        values[band] = sample_band(dhus.find_band(product, band, resolution), points["x"], points["y"], points_crs)
+        if len(values) == 1:
+            covered = ~np.isnan(values[band])
+            points = points[covered]
+            values[band] = values[band][covered]
+
+    variables = {band: values[band] for band in bands}
+    for index in indices:
+        band_values = {variable: values[band] for variable, band in index_bands(index).items()}
+        index_values = evaluate(ba.INDEX_EXPRESSIONS[index], backend, **band_values, **_coefficients(index))
+        if index in ba.INDEX_THRESHOLDS:
+            # Thresholded as the index rasters, e.g., snow (1) or not (0) for NDSI.
+            threshold = index_values > ba.INDEX_THRESHOLDS[index]
+            index_values = np.where(np.isfinite(index_values), threshold, np.nan).astype(np.float32)
+        variables[index] = index_values
+
+    title = Path(product).name.removesuffix(".zip")
+    sensing_time = SENSING_TIME_PATTERN.search(title)
+    samples = []
+    for variable, variable_values in variables.items():
+        samples.append(
+            points.assign(
+                title=title,
+                date=datetime.strptime(sensing_time.group(1), "%Y%m%dT%H%M%S") if sensing_time else None,
+                variable=variable,
+                value=variable_values,
+            )
+        )
+    if not samples:
+        return pd.DataFrame()
+    samples = pd.concat(samples, ignore_index=True)
+    return samples[np.isfinite(samples["value"])]
+
+
+def product_paths(products: List[Path] | Path) -> List[Path]:
+    """
+    Lists product folders or zip files. Download folders are expanded to the products in them.
+
+    :param products: Product folders, zip files or download folders.
+    :return: Product paths, preferring extracted folders over zip files of the same product.
+    """
+    products = [products] if isinstance(products, (str, Path)) else products
+    paths = {}
+    for path in map(Path, products):
+        title = path.name.removesuffix(".zip")
+        if path.is_dir() and not title.startswith("S2"):
+            for child in sorted(path.iterdir()):
+                child_title = child.name.removesuffix(".zip")
+                if not child_title.startswith("S2"):
+                    continue
+                if child.is_dir() or (child.suffix == ".zip" and child_title not in paths):
+                    paths[child_title] = child
+        else:
+            paths[title] = path
+    return list(paths.values())
+
+
+def sample(
+    points: Path,
+    products: List[Path] | Path,
+    *,
+    indices: List[str] = ("ndvi",),
+    bands: List[str] = (),
+    output: Path = Path("samples.csv"),
+    resolution: int = 10,
+    points_crs: str = "epsg:4326",
+    backend: str | None = None,
+    workers: int = 4,
+) -> Path:
+    """
+    Samples band and index values of many products at a set of labelled points, e.g., to build a training set. Only
+    the blocks of the bands containing points are read, and indices are evaluated at the sampled pixels only.
+
+    :param points: GeoJSON or CSV file of points, see `read_points`.
+    :param products: Product folders, zip files or download folders.
+    :param indices: Index names, e.g., ["ndvi", "evi"], from `band_arithmetic.INDEX_EXPRESSIONS`.
+    :param bands: Band names to sample, e.g., ["B04", "SCL"].
+    :param output: Output table in long format, with a row per point, product and variable. Written as Parquet if its
+     extension is `.parquet` (requires `pyarrow`), else as CSV.
+    :param resolution: Preferred band resolution in meters.
+    :param points_crs: Coordinate reference system of the points.
+    :param backend: Compute backend, see `compute.get_backend`.
+    :param workers: Number of products sampled at the same time.
+    :return: Path to output table.
+    """
+    indices = indices.split(",") if isinstance(indices, str) else list(indices)
+    bands = bands.split(",") if isinstance(bands, str) else list(bands)
+    unknown = [index for index in indices if index not in ba.INDEX_EXPRESSIONS]
+    if unknown:
+        raise ValueError(f"Unknown indices {unknown}, expected any of {list(ba.INDEX_EXPRESSIONS)}.")
+
+    points_df = read_points(points)
+    paths = product_paths(products)
+    print(f"Sampling {len(points_df)} points in {len(paths)} products")
+
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.unlink(missing_ok=True)
+    parquet = output.suffix == ".parquet"
+    if parquet and pyarrow is None:
+        raise ImportError("Writing Parquet files requires pyarrow, install greensenti[parquet].")
+
+    # Samples are written as each product is sampled, so only the samples of the products in progress are kept in
+    # memory.
+    writer, written = None, 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                sample_product,
+                product,
+                points_df,
+                indices,
+                bands,
+                resolution=resolution,
+                points_crs=points_crs,
+                backend=backend,
+            ): product
+            for product in paths
+        }
+        try:
+            for future in as_completed(futures):
+                try:
+                    samples = future.result()
+                except FileNotFoundError as e:
+                    print(f"Skipping {futures[future]}: {e}")
+                    continue
+                if samples.empty:
+                    continue
+                if parquet:
+                    table = pyarrow.Table.from_pandas(
+                        samples, schema=writer.schema if writer else None, preserve_index=False
+                    )
+                    writer = writer or pyarrow.parquet.ParquetWriter(output, table.schema)
+                    writer.write_table(table)
+                else:
+                    samples.to_csv(output, mode="a", header=not written, index=False)
+                written += len(samples)
+        finally:
+            if writer:
+                writer.close()
+
+    if not written and parquet:
+        pd.DataFrame().to_parquet(output, index=False)
+    elif not written:
+        pd.DataFrame().to_csv(output, index=False)
+
+    print(f"Written {written} samples to {output}")
+
+    return output
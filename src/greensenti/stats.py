@@ -0,0 +1,163 @@
+import json
+import os
+from pathlib import Path
+from typing import Sequence
+
+import numpy as np
+import rasterio
+
+from greensenti.incremental import input_fingerprint
+
+
+def _sidecar(filename: Path) -> Path:
+    return Path(f"{filename}.stats.json")
+
+
+def percentile_key(percentile: float) -> str:
+    """
+    Key of a percentile in the statistics dictionary, e.g., "2" or "99.5".
+    """
+    return format(float(percentile), "g")
+
+
+def _read_windows(src: rasterio.DatasetReader):
+    """
+    Iterates over the blocks of a raster, yielding masked arrays of shape (bands, pixels) without invalid values.
+    """
+    for _, window in src.block_windows(1):
+        data = src.read(window=window, masked=True).astype(np.float64)
+        data = np.ma.masked_invalid(data)
+        yield data.reshape((src.count, -1))
+
+
+def _percentiles_from_histogram(counts: np.ndarray, edges: np.ndarray, percentiles: Sequence[float]) -> dict:
+    """
+    Approximates percentiles by linear interpolation inside the histogram bins.
+    """
+    total = counts.sum()
+    if total == 0:
+        return {percentile_key(p): None for p in percentiles}
+    cumulative = np.concatenate(([0], np.cumsum(counts)))
+    values = np.interp([p / 100 * total for p in percentiles], cumulative, edges)
+    return {percentile_key(p): float(v) for p, v in zip(percentiles, values, strict=True)}
+
+
+def compute_stats(filename: Path, bins: int = 256, percentiles: Sequence[float] = (2, 98)) -> list[dict]:
+    """
+    Computes per band statistics of a raster window by window, so memory usage doesn't depend on the raster size.
+
+    Two passes are done over the data: the first one computes min, max, mean and standard deviation, and the
+    second one a fixed-bins histogram between min and max, which is used to approximate the percentiles.
+
+    :param filename: Path to raster file.
+    :param bins: Number of histogram bins.
+    :param percentiles: Percentiles to approximate, between 0 and 100.
+    :return: List with the statistics of each band.
+    """
+    with rasterio.open(filename) as src:
+        count = np.zeros(src.count, dtype=np.int64)
+        total = np.zeros(src.count, dtype=np.float64)
+        total_sq = np.zeros(src.count, dtype=np.float64)
+        minimum = np.full(src.count, np.inf)
+        maximum = np.full(src.count, -np.inf)
+
+        for data in _read_windows(src):
+            count += data.count(axis=1)
+            total += data.sum(axis=1).filled(0)
+            total_sq += (data**2).sum(axis=1).filled(0)
+            minimum = np.fmin(minimum, data.min(axis=1).filled(np.inf))
+            maximum = np.fmax(maximum, data.max(axis=1).filled(-np.inf))
+
+        histograms = np.zeros((src.count, bins), dtype=np.int64)
+        edges = [
+            np.linspace(lo, hi, bins + 1) if n else np.zeros(bins + 1)
+            for lo, hi, n in zip(minimum, maximum, count, strict=True)
+        ]
+        for data in _read_windows(src):
+            for i, band in enumerate(data):
+                if count[i] and minimum[i] < maximum[i]:
+                    histograms[i] += np.histogram(band.compressed(), bins=edges[i])[0]
+        # Constant bands have every value in the last bin.
+        for i in np.flatnonzero((count > 0) & (minimum == maximum)):
+            histograms[i, -1] = count[i]
+
+    stats = []
+    for i in range(len(count)):
+        if not count[i]:
+            stats.append({"count": 0, "min": None, "max": None, "mean": None, "std": None})
+            continue
+        mean = total[i] / count[i]
+        std = np.sqrt(max(total_sq[i] / count[i] - mean**2, 0))
+        stats.append(
+            {
+                "count": int(count[i]),
+                "min": float(minimum[i]),
+                "max": float(maximum[i]),
+                "mean": float(mean),
+                "std": float(std),
+                "histogram": {"counts": histograms[i].tolist(), "edges": edges[i].tolist()},
+                "percentiles": _percentiles_from_histogram(histograms[i], edges[i], percentiles),
+            }
+        )
+    return stats
+
+
+def cached_stats(filename: Path) -> list[dict] | None:
+    """
+    Reads the statistics of a raster from its sidecar file (`<filename>.stats.json`).
+
+    :param filename: Path to raster file.
+    :return: List with the statistics of each band, or None if there is no sidecar or the raster changed since.
+    """
+    sidecar = _sidecar(filename)
+    if not sidecar.is_file():
+        return None
+    with open(sidecar) as f:
+        cache = json.load(f)
+    if cache.get("source") != input_fingerprint(filename):
+        return None
+    return cache["bands"]
+
+
+def raster_stats(
+    filename: Path, bins: int = 256, percentiles: Sequence[float] = (2, 98), *, cache: bool = True
+) -> list[dict]:
+    """
+    Gets min/max, mean/std, histogram and approximate percentiles of each band of a raster.
+
+    Results are cached in a sidecar file next to the raster (`<filename>.stats.json`) and reused while the raster
+    doesn't change, so renderers don't need to scan the data again. Rasters in read-only folders are not cached.
+
+    :param filename: Path to raster file.
+    :param bins: Number of histogram bins.
+    :param percentiles: Percentiles to approximate, between 0 and 100.
+    :param cache: Read and write the sidecar file.
+    :return: List with the statistics of each band.
+    """
+    # Rasters inside archives, e.g., GDAL `/vsizip/` paths, have no place for a sidecar file.
+    cache = cache and not str(filename).startswith("/vsi")
+    percentiles = tuple(percentiles) if isinstance(percentiles, (list, tuple)) else (percentiles,)
+
+    if cache and (stats := cached_stats(filename)) is not None:
+        # Reuse the cache as long as it has the requested histogram and percentiles.
+        valid = [band for band in stats if band["count"]]
+        if all(
+            len(band["histogram"]["counts"]) == bins
+            and all(percentile_key(p) in band["percentiles"] for p in percentiles)
+            for band in valid
+        ):
+            return stats
+
+    stats = compute_stats(filename, bins=bins, percentiles=percentiles)
+
+    if cache:
+        # The sidecar is replaced atomically, and not written at all if the folder of the raster is read-only.
+        tmp = Path(f"{_sidecar(filename)}.{os.getpid()}.tmp")
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"source": input_fingerprint(filename), "bands": stats}, f)
+            os.replace(tmp, _sidecar(filename))
+        except OSError:
+            tmp.unlink(missing_ok=True)
+
+    return stats
@@ -0,0 +1,87 @@
+import os
+import shutil
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, Protocol
+
+# Google Cloud public bucket of Sentinel-2 data.
+GCLOUD_BUCKET = "gcp-public-data-sentinel-2"
+
+
+class Blob(Protocol):
+    """
+    File of a storage backend, as used by `dhus.gcloud_download`. Matches `google.cloud.storage.Blob`.
+    """
+
+    name: str
+    size: int | None
+    md5_hash: str | None  # Base64 encoded MD5 checksum, if known
+
+    def download_to_filename(self, filename: str | Path) -> None:
+        ...
+
+
+class StorageBackend(Protocol):
+    """
+    Storage backend Sentinel-2 products are downloaded from, with the bucket layout of `dhus.get_gcloud_path`,
+    e.g., `L2/tiles/30/S/UF/<title>.SAFE`. Matches `google.cloud.storage.Client`.
+    """
+
+    def list_blobs(self, bucket: str, prefix: str | None = None) -> Iterator[Blob]:
+        ...
+
+
+@dataclass
+class LocalBlob:
+    """
+    File of a local mirror.
+    """
+
+    name: str
+    path: Path
+    size: int
+    link: bool = False
+    md5_hash: str | None = None  # Mirrors are trusted, so files are only checked by size
+
+    def download_to_filename(self, filename: str | Path) -> None:
+        if self.link:
+            try:
+                os.link(self.path, filename)
+                return
+            except OSError:
+                # Different filesystem, or not supported by it
+                pass
+        shutil.copyfile(self.path, filename)
+
+
+class LocalMirror:
+    """
+    Local filesystem storage backend, mirroring the layout of the Google Cloud bucket from its root, e.g.,
+    `<root>/L2/tiles/30/S/UF/<title>.SAFE`. It can be populated by copying the bucket, e.g., with `gsutil rsync`, and
+    shared by every worker of a node.
+    """
+
+    def __init__(self, root: str | Path, *, link: bool = False):
+        """
+        :param root: Mirror root folder.
+        :param link: Hard link files instead of copying them, when in the same filesystem. Linked files must not be
+         modified, as they are shared with the mirror.
+        """
+        self.root = Path(root)
+        self.link = link
+
+    def list_blobs(self, bucket: str = GCLOUD_BUCKET, prefix: str | None = None) -> Iterator[LocalBlob]:
+        """
+        Lists the files of the mirror under a prefix. The bucket name is ignored, as the mirror holds a single one.
+
+        :param bucket: Bucket name.
+        :param prefix: Folder prefix, e.g., `L2/tiles/30/S/UF/<title>.SAFE`.
+        :return: Yields an iterator of files, named by their path relative to the mirror root.
+        """
+        folder = self.root / prefix if prefix else self.root
+        for dirpath, _, filenames in os.walk(folder):
+            for filename in sorted(filenames):
+                path = Path(dirpath, filename)
+                yield LocalBlob(
+                    name=path.relative_to(self.root).as_posix(), path=path, size=path.stat().st_size, link=self.link
+                )
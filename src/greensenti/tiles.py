@@ -0,0 +1,194 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from matplotlib import colormaps
+from matplotlib import pyplot as plt
+from matplotlib.colors import Normalize
+from rasterio.transform import from_bounds
+from rasterio.warp import Resampling, reproject, transform_bounds
+
+from greensenti import compute, raster
+from greensenti.stats import raster_stats
+
+TILE_SIZE = 256
+
+# Half the side of the Web Mercator (EPSG:3857) square, in meters.
+WEB_MERCATOR_EXTENT = math.pi * 6378137.0
+WEB_MERCATOR_MAX_LATITUDE = 85.0511287798066
+
+
+def tile_bounds(z: int, x: int, y: int) -> tuple[float, float, float, float]:
+    """
+    Computes the Web Mercator bounds of a XYZ tile.
+
+    :param z: Zoom level.
+    :param x: Tile column.
+    :param y: Tile row (origin at the top-left corner).
+    :return: Tile bounds as (left, bottom, right, top) in EPSG:3857.
+    """
+    size = 2 * WEB_MERCATOR_EXTENT / 2**z
+    left = -WEB_MERCATOR_EXTENT + x * size
+    top = WEB_MERCATOR_EXTENT - y * size
+    return left, top - size, left + size, top
+
+
+def tiles_for_bounds(bounds: tuple[float, float, float, float], zoom: int) -> list[tuple[int, int, int]]:
+    """
+    Lists the XYZ tiles that intersect a bounding box.
+
+    :param bounds: Bounding box as (west, south, east, north) in EPSG:4326.
+    :param zoom: Zoom level.
+    :return: List of (z, x, y) tiles.
+    """
+    west, south, east, north = bounds
+    south = max(south, -WEB_MERCATOR_MAX_LATITUDE)
+    north = min(north, WEB_MERCATOR_MAX_LATITUDE)
+
+    def to_tile(lon: float, lat: float) -> tuple[int, int]:
+        n = 2**zoom
+        lat_rad = math.radians(lat)
+        x = int((lon + 180.0) / 360.0 * n)
+        y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+        return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+    min_x, min_y = to_tile(west, north)
+    max_x, max_y = to_tile(east, south)
+    return [(zoom, x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)]
+
+
+def _overview_level(src: rasterio.DatasetReader, zoom: int) -> int | None:
+    """
+    Selects the coarsest overview of a dataset whose resolution is still finer than the one of a zoom level.
+
+    :param src: Opened dataset.
+    :param zoom: Zoom level.
+    :return: Overview level to open the dataset with, or None to use full resolution.
+    """
+    tile_resolution = 2 * WEB_MERCATOR_EXTENT / (TILE_SIZE * 2**zoom)
+    level = None
+    for i, factor in enumerate(src.overviews(1)):
+        if src.res[0] * factor <= tile_resolution:
+            level = i
+    return level
+
+
+def _render_tiles(
+    index: Path,
+    tiles: list[tuple[int, int, int]],
+    output: Path,
+    color_map: str,
+    vmin: float,
+    vmax: float,
+    resampling: Resampling,
+) -> int:
+    """
+    Renders a batch of tiles of the same zoom level. Runs on a worker process.
+
+    :return: Number of tiles written.
+    """
+    cmap = colormaps[color_map]
+    norm = Normalize(vmin=vmin, vmax=vmax, clip=True)
+    written = 0
+
+    with rasterio.open(index) as src:
+        level = _overview_level(src, tiles[0][0])
+
+    with rasterio.open(index, overview_level=level) as src:
+        for z, x, y in tiles:
+            tile = np.full((TILE_SIZE, TILE_SIZE), np.nan, dtype=np.float32)
+            reproject(
+                source=rasterio.band(src, 1),
+                destination=tile,
+                src_nodata=src.nodata,
+                dst_transform=from_bounds(*tile_bounds(z, x, y), TILE_SIZE, TILE_SIZE),
+                dst_crs="EPSG:3857",
+                dst_nodata=np.nan,
+                resampling=resampling,
+            )
+
+            # Tiles with no valid data are not written, viewers render them as transparent.
+            nodata = np.isnan(tile)
+            if nodata.all():
+                continue
+
+            rgba = cmap(norm(tile), bytes=True)
+            rgba[nodata] = 0
+
+            tile_path = output / str(z) / str(x) / f"{y}.png"
+            tile_path.parent.mkdir(parents=True, exist_ok=True)
+            plt.imsave(tile_path, rgba)
+            written += 1
+
+    return written
+
+
+def generate_tiles(
+    index: Path,
+    output: Path,
+    min_zoom: int = 8,
+    max_zoom: int = 14,
+    *,
+    color_map: str = "RdYlGn",
+    vmin: float | None = None,
+    vmax: float | None = None,
+    resampling: str = "bilinear",
+    build_overviews: bool = False,
+    workers: int | None = None,
+) -> Path:
+    """
+    Generates a Web Mercator XYZ tile pyramid (`{z}/{x}/{y}.png`) from a single band raster, e.g., an index GTiff.
+
+    Tiles are rendered in parallel across processes and those without any valid data are skipped. Overviews present in
+    the raster are used to render the lower zoom levels, so building them beforehand speeds up the process considerably.
+
+    :param index: Path to input raster.
+    :param output: Output folder.
+    :param min_zoom: Minimum zoom level.
+    :param max_zoom: Maximum zoom level.
+    :param color_map: Matplotlib color map to use.
+    :param vmin: Value mapped to the lowest color. If not provided, the raster minimum is used.
+    :param vmax: Value mapped to the highest color. If not provided, the raster maximum is used.
+    :param resampling: Resampling method, one of `rasterio.enums.Resampling`.
+    :param build_overviews: Build internal overviews in the input raster if it has none.
+    :param workers: Number of processes. Defaults to the number of CPUs.
+    :return: Path to output folder.
+    """
+    index, output = Path(index), Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+
+    if build_overviews:
+        with rasterio.open(index) as src:
+            has_overviews = bool(src.overviews(1))
+        if not has_overviews:
+            raster.build_overviews(index, resampling=resampling)
+
+    with rasterio.open(index) as src:
+        bounds = transform_bounds(src.crs, "EPSG:4326", *src.bounds)
+
+    if vmin is None or vmax is None:
+        # Color scale must be the same for every tile, so it is taken from the (cached) raster statistics.
+        band_stats = raster_stats(index)[0]
+        vmin = band_stats["min"] if vmin is None else vmin
+        vmax = band_stats["max"] if vmax is None else vmax
+
+    batches = []
+    for zoom in range(min_zoom, max_zoom + 1):
+        tiles = tiles_for_bounds(bounds, zoom)
+        # Split each zoom level in chunks, so every worker opens the raster once per chunk.
+        chunk_size = max(1, math.ceil(len(tiles) / (workers or os.cpu_count() or 1)))
+        batches.extend(tiles[i : i + chunk_size] for i in range(0, len(tiles), chunk_size))
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=compute.mp_context()) as executor:
+        futures = [
+            executor.submit(_render_tiles, index, batch, output, color_map, vmin, vmax, Resampling[resampling])
+            for batch in batches
+        ]
+        written = sum(future.result() for future in as_completed(futures))
+
+    print(f"Written {written} tiles to {output}")
+
+    return output
@@ -2,8 +2,11 @@ from pathlib import Path
 
 import numpy as np
 import pytest
+import rasterio
+from rasterio.transform import from_origin
 
 from greensenti.band_arithmetic import (
+    aoi_cloud_percentage,
     bri,
     bsi,
     cloud_cover_percentage,
@@ -11,6 +14,7 @@ from greensenti.band_arithmetic import (
     cri1,
     evi,
     evi2,
+    masked,
     mndwi,
     moisture,
     ndre,
@@ -19,8 +23,10 @@ from greensenti.band_arithmetic import (
     ndwi,
     ndyi,
     osavi,
+    read_valid_mask,
     ri,
     true_color,
+    valid_mask,
 )
 
 
@@ -48,6 +54,27 @@ def test_cloud_mask():
     assert value == 0.0
 
 
+@pytest.mark.parametrize(
+    "origin, value, expected", [((364000, 4066000), 9, 100.0), ((364000, 4066000), 4, 0.0), ((0, 0), 4, 100.0)]
+)
+def test_aoi_cloud_percentage(tmp_path: Path, origin: tuple, value: int, expected: float):
+    scl = tmp_path / "SCL.tif"
+    profile = {
+        "driver": "GTiff",
+        "width": 200,
+        "height": 200,
+        "count": 1,
+        "dtype": np.uint8,
+        "crs": "EPSG:32630",
+        "transform": from_origin(*origin, 20, 20),
+    }
+    with rasterio.open(scl, "w", **profile) as dst:
+        dst.write(np.full((1, 200, 200), value, dtype=np.uint8))
+
+    # Rasters not overlapping the geometry are considered cloudy
+    assert aoi_cloud_percentage(scl, Path("geojson/teatinos.geojson")) == expected
+
+
 def test_cri1():
     band = cri1(b2=Path("tests/data/B1.jp2"), b3=Path("tests/data/B1.jp2"), output=None)
     value = np.nanmean(band)
@@ -134,6 +161,16 @@ def test_true_color():
     assert np.array_equal(tc, np.array([[[85]], [[170]], [[255]]]))
 
 
+def test_true_color_stretches_with_output_stats(tmp_path: Path):
+    output = tmp_path / "tc.tif"
+    tc = true_color(
+        r=Path("tests/data/B1.jp2"), g=Path("tests/data/B2.jp2"), b=Path("tests/data/B3.jp2"), output=output
+    )
+    assert np.array_equal(tc, np.array([[[85]], [[170]], [[255]]]))
+    # The statistics of the output are cached for its renderers.
+    assert Path(f"{output}.stats.json").is_file()
+
+
 def test_bsi():
     band = bsi(
         b2=Path("tests/data/B1.jp2"),
@@ -144,3 +181,32 @@ def test_bsi():
     )
     value = np.nanmean(band)
     assert pytest.approx(value, 0.000001) == 0.11111111
+
+
+def test_valid_mask():
+    b1 = np.array([[[1, 0], [3, 4]]], dtype=np.float32)
+    b2 = np.array([[[1, 2], [0, 4]]], dtype=np.float32)
+    scl = np.array([[[4, 9]]])
+
+    assert valid_mask(b1, b2).tolist() == [[[True, False], [False, True]]]
+    # SCL is resampled to the shape of the bands
+    assert valid_mask(b1, scl=scl, scl_classes=[9]).tolist() == [[[True, False], [True, False]]]
+
+
+def test_masked():
+    index = np.array([[[0.5, np.inf], [-np.inf, 0.25]]], dtype=np.float32)
+    valid = np.array([[[True, True], [True, False]]])
+
+    result = masked(index, valid)
+
+    assert result.dtype == np.float32
+    assert np.isnan(result).tolist() == [[[False, True], [True, True]]]
+    with pytest.raises(ValueError):
+        masked(index, valid[:, :1])
+
+
+def test_shared_valid_mask():
+    bands = {"b4": Path("tests/data/B1.jp2"), "b8": Path("tests/data/B2.jp2")}
+    valid = read_valid_mask(*bands.values())
+
+    np.testing.assert_array_equal(ndvi(**bands, valid=valid), ndvi(**bands))
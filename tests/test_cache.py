@@ -0,0 +1,64 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from greensenti import cache
+
+
+def test_parse_size():
+    assert cache.parse_size(1024) == 1024
+    assert cache.parse_size("500M") == 500 * 1024**2
+    assert cache.parse_size("1.5g") == int(1.5 * 1024**3)
+    with pytest.raises(ValueError):
+        cache.parse_size("lots")
+
+
+def test_put_and_get(tmp_path: Path):
+    source = tmp_path / "output1" / "band.jp2"
+    source.parent.mkdir()
+    source.write_text("band")
+
+    cache.put(tmp_path / "cache", "abcdef", source)
+    assert cache.object_path(tmp_path / "cache", "abcdef").read_text() == "band"
+
+    target = tmp_path / "output2" / "band.jp2"
+    assert cache.get(tmp_path / "cache", "abcdef", target)
+    assert target.read_text() == "band"
+    assert not cache.get(tmp_path / "cache", "123456", tmp_path / "output2" / "other.jp2")
+    assert not cache.get(tmp_path / "cache", None, tmp_path / "output2" / "other.jp2")
+
+
+def test_evict_least_recently_used(tmp_path: Path):
+    for i, md5 in enumerate(["aa", "bb", "cc"]):
+        source = tmp_path / md5
+        source.write_bytes(b"x" * 100)
+        cache.put(tmp_path / "cache", md5, source, max_size=1000)
+        # Only cached files are left
+        source.unlink()
+        os.utime(cache.object_path(tmp_path / "cache", md5), (1000 + i, 1000 + i))
+
+    # "aa" is used after the rest
+    assert cache.get(tmp_path / "cache", "aa", tmp_path / "output" / "aa")
+    assert (tmp_path / "output" / "aa").read_bytes() == b"x" * 100
+    (tmp_path / "output" / "aa").unlink()
+
+    assert cache.evict(tmp_path / "cache", max_size=150) == 200
+    assert [md5 for md5 in ["aa", "bb", "cc"] if cache.object_path(tmp_path / "cache", md5).exists()] == ["aa"]
+
+
+def test_evict_skips_hardlinked_files(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    # Without reflinks, as on Windows, files are placed by hardlink.
+    monkeypatch.setattr(cache, "fcntl", None)
+    for md5 in ["aa", "bb"]:
+        source = tmp_path / "output" / md5
+        source.parent.mkdir(exist_ok=True)
+        source.write_bytes(b"x" * 100)
+        cache.put(tmp_path / "cache", md5, source, max_size=1000)
+    (tmp_path / "output" / "bb").unlink()
+
+    # "aa" shares its data with the output, so removing it from the cache wouldn't free any space.
+    assert cache.evict(tmp_path / "cache", max_size=0) == 100
+    assert cache.object_path(tmp_path / "cache", "aa").exists()
+    assert not cache.object_path(tmp_path / "cache", "bb").exists()
+    assert (tmp_path / "output" / "aa").read_bytes() == b"x" * 100
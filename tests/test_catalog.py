@@ -0,0 +1,65 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from greensenti import catalog
+
+
+@pytest.fixture
+def products_df() -> pd.DataFrame:
+    """Create a products dataframe like the ones returned by sentinelsat."""
+    return pd.DataFrame.from_dict(
+        {
+            "uuid1": {
+                "uuid": "uuid1",
+                "title": "S2B_MSIL2A_20221005T105819_N0400_R094_T30SUF_20221005T135951",
+                "beginposition": datetime(2022, 10, 5, 10, 58, 19),
+                "cloudcoverpercentage": 1.5,
+                "footprint": "MULTIPOLYGON (((-4.5 36.0, -3.3 36.0, -3.3 37.0, -4.5 37.0, -4.5 36.0)))",
+            },
+            "uuid2": {
+                "uuid": "uuid2",
+                "title": "S2A_MSIL2A_20221110T105821_N0400_R094_T30SUF_20221110T150234",
+                "beginposition": datetime(2022, 11, 10, 10, 58, 21),
+                "cloudcoverpercentage": 20.0,
+                "footprint": "MULTIPOLYGON (((-4.5 36.0, -3.3 36.0, -3.3 37.0, -4.5 37.0, -4.5 36.0)))",
+            },
+        },
+        orient="index",
+    )
+
+
+def test_get_tile():
+    assert catalog.get_tile("S2B_MSIL2A_20221005T105819_N0400_R094_T30SUF_20221005T135951") == "30SUF"
+    assert catalog.get_tile("unknown") is None
+
+
+def test_catalog_lifecycle(tmp_path, products_df):
+    db = tmp_path / "catalog.sqlite"
+    first, second = products_df["title"]
+
+    catalog.register_products(db, products_df)
+    assert [p["status"] for p in catalog.products(catalog=db)] == ["queried", "queried"]
+    assert catalog.ready_products(db, [first, second]) == {}
+
+    catalog.set_status(db, first, "downloaded", path=tmp_path / first)
+    catalog.register_products(db, products_df)  # status is kept when queried again
+    assert catalog.ready_products(db, [first, second]) == {
+        first: {"status": "downloaded", "path": str(tmp_path / first)}
+    }
+
+    catalog.add_output(db, first, "ndvi", tmp_path / "ndvi.tif")
+    (ready,) = catalog.products(tile="T30SUF", month="2022-10", status="ready", catalog=db)
+    assert ready["title"] == first
+    assert ready["status"] == "processed"
+    assert ready["cloud_cover"] == 1.5
+    assert ready["outputs"] == {"ndvi": str(tmp_path / "ndvi.tif")}
+
+    assert catalog.products(tile="30SUF", month="2022-11", status="ready", catalog=db) == []
+    assert len(catalog.products(tile="30SUF", catalog=db)) == 2
+
+
+def test_set_status_rejects_unknown_status(tmp_path):
+    with pytest.raises(ValueError):
+        catalog.set_status(tmp_path / "catalog.sqlite", "title", "unknown")
@@ -0,0 +1,63 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from greensenti.change import change_detection
+from greensenti.mosaic import aligned_grid
+
+
+def write_index(filepath: Path, left: float, top: float, size: int, value: float) -> Path:
+    """Create a temporary 10m float index raster, with a no data pixel at its top left corner."""
+    data = np.full((1, size, size), value, dtype=np.float32)
+    data[0, 0, 0] = np.nan
+    profile = {
+        "driver": "GTiff",
+        "width": size,
+        "height": size,
+        "count": 1,
+        "dtype": np.float32,
+        "transform": from_origin(left, top, 10, 10),
+        "crs": "EPSG:32630",
+        "nodata": np.nan,
+    }
+    with rasterio.open(filepath, "w", **profile) as dst:
+        dst.write(data)
+    return filepath
+
+
+def test_aligned_grid():
+    grid = aligned_grid((300004.0, 4099795.0, 300196.0, 4099999.9999999), "EPSG:32630", 10)
+
+    assert grid["transform"] == from_origin(300000, 4100000, 10, 10)
+    assert (grid["width"], grid["height"]) == (20, 21)
+
+
+@pytest.mark.parametrize("operation, expected", [("difference", 0.3), ("ratio", 2.5)])
+def test_change_detection_aligns_grids(tmp_path: Path, operation: str, expected: float):
+    # Crops of two dates, off by one pixel and of different sizes.
+    before = write_index(tmp_path / "before.tif", 300000, 4100000, 20, 0.2)
+    after = write_index(tmp_path / "after.tif", 300010, 4099990, 25, 0.5)
+    output = tmp_path / "change.tif"
+
+    [stats] = change_detection(before, after, output, operation=operation, window_size=8)
+
+    with rasterio.open(output) as src:
+        change = src.read(1)
+        assert src.transform == from_origin(300010, 4099990, 10, 10)
+        assert src.shape == (19, 19)
+    # No data pixel of the second raster.
+    assert np.isnan(change[0, 0])
+    assert np.allclose(change[~np.isnan(change)], expected)
+    assert stats["count"] == 19 * 19 - 1
+    assert stats["mean"] == pytest.approx(expected)
+
+
+def test_change_detection_rejects_disjoint_rasters(tmp_path: Path):
+    before = write_index(tmp_path / "before.tif", 300000, 4100000, 20, 0.2)
+    after = write_index(tmp_path / "after.tif", 400000, 4100000, 20, 0.5)
+
+    with pytest.raises(ValueError):
+        change_detection(before, after, tmp_path / "change.tif")
@@ -0,0 +1,67 @@
+import inspect
+
+import numpy as np
+import pytest
+
+import greensenti.band_arithmetic as ba
+from greensenti import compute
+
+BANDS = {
+    "b2": "tests/data/B1.jp2",
+    "b3": "tests/data/B2.jp2",
+    "b4": "tests/data/B3.jp2",
+    "b5": "tests/data/B1.jp2",
+    "b8": "tests/data/B2.jp2",
+    "b8a": "tests/data/B3.jp2",
+    "b9": "tests/data/B1.jp2",
+    "b11": "tests/data/B2.jp2",
+}
+
+INDICES = [
+    ba.bri,
+    ba.bsi,
+    ba.cri1,
+    ba.evi,
+    ba.evi2,
+    ba.mndwi,
+    ba.moisture,
+    ba.ndre,
+    ba.ndsi,
+    ba.ndvi,
+    ba.ndwi,
+    ba.ndyi,
+    ba.osavi,
+    ba.ri,
+]
+
+
+def bands_of(index) -> dict:
+    return {name: band for name, band in BANDS.items() if name in inspect.signature(index).parameters}
+
+
+@pytest.mark.parametrize("backend", ["numexpr", "numba"])
+@pytest.mark.parametrize("index", INDICES, ids=lambda index: index.__name__)
+def test_backends_match_numpy(backend: str, index):
+    pytest.importorskip(backend)
+
+    expected = index(**bands_of(index), backend="numpy")
+    result = index(**bands_of(index), backend=backend)
+
+    assert result.dtype == np.float32
+    np.testing.assert_allclose(result, expected, rtol=1e-5, equal_nan=True)
+
+
+def test_evaluate_falls_back_to_numpy(monkeypatch, capsys):
+    monkeypatch.setattr(compute, "_INSTALLED", {**compute._INSTALLED, "numba": False})
+    monkeypatch.setattr(compute, "_WARNED", set())
+    monkeypatch.setenv("GREENSENTI_COMPUTE_BACKEND", "numba")
+
+    result = compute.evaluate("(b8 - b4) / (b8 + b4)", b4=np.float32(1), b8=np.float32(3))
+
+    assert result == np.float32(0.5)
+    assert "falling back to numpy" in capsys.readouterr().out
+
+
+def test_get_backend_rejects_unknown():
+    with pytest.raises(ValueError):
+        compute.get_backend("cuda")
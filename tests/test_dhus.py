@@ -1,6 +1,24 @@
-from unittest.mock import MagicMock
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import threading
+import zipfile
+from datetime import datetime, timedelta
+from pathlib import Path
+from unittest.mock import ANY, MagicMock
 
-from greensenti import dhus
+import numpy as np
+import pandas as pd
+import pytest
+import rasterio
+import shapely.wkt
+from rasterio.transform import from_origin
+
+from greensenti import dhus, lta
+
+TEATINOS = Path(__file__).parents[1] / "geojson" / "teatinos.geojson"
 
 
 def test_gcloud_path_is_valid():
@@ -8,9 +26,10 @@ def test_gcloud_path_is_valid():
     assert gcloud_path == "L2/tiles/30/S/UF/S2B_MSIL2A_20221005T105819_N0400_R094_T30SUF_20221005T135951.SAFE"
 
 
-def test_copernicous_download_returns_correct_dataframe(monkeypatch):
-    # Mock sentinelsat.sentinel.SentinelAPI.download_all
+def test_copernicous_download_returns_correct_dataframe(monkeypatch, tmp_path):
+    # Mock sentinelsat.sentinel.SentinelAPI.download
     mock = MagicMock()
+    mock.download.side_effect = lambda id_, output: {"title": f"title-{id_}", "md5": "abc"}
 
     # Mock unzip
     monkeypatch.setattr(dhus, "unzip_product", lambda *args: None)
@@ -25,6 +44,7 @@ def test_copernicous_download_returns_correct_dataframe(monkeypatch):
                 "uuid5",
             ],
             api=mock,
+            output=tmp_path,
         )
     )
 
@@ -36,4 +56,730 @@ def test_copernicous_download_returns_correct_dataframe(monkeypatch):
         {"uuid": "uuid5", "status": "ok"},
     ]
 
-    assert status == expected_status
+    # Products are yielded in completion order.
+    assert sorted(status, key=lambda product: product["uuid"]) == expected_status
+
+
+def test_copernicous_download_reports_lta_products(monkeypatch, tmp_path):
+    mock = MagicMock()
+    mock.api_url = "https://lta.example.com/dhus/"
+
+    def download(id_, output):
+        if id_ == "offline":
+            raise dhus.LTATriggered(id_)
+        if id_ == "broken":
+            raise dhus.LTAError("Failed", None)
+        return {"title": id_}
+
+    mock.download.side_effect = download
+    monkeypatch.setattr(dhus, "unzip_product", lambda *args: None)
+
+    status = list(dhus.copernicous_download(ids=["online", "offline", "broken"], api=mock, output=tmp_path, workers=3))
+
+    assert sorted(status, key=lambda product: product["uuid"]) == [
+        {"uuid": "broken", "status": "failed"},
+        {"uuid": "offline", "status": "triggered"},
+        {"uuid": "online", "status": "ok"},
+    ]
+
+
+def test_copernicous_download_limits_downloads_per_host_to_workers(monkeypatch, tmp_path):
+    mock = MagicMock()
+    mock.api_url = "https://workers.example.com/dhus/"
+    # Every download waits for the rest, so it only finishes if all of them run at the same time.
+    barrier = threading.Barrier(4, timeout=5)
+
+    def download(id_, output):
+        barrier.wait()
+        return {"title": f"title-{id_}"}
+
+    monkeypatch.setattr(dhus, "unzip_product", lambda *args: None)
+    # A previous download from the host with a lower limit doesn't bind later ones.
+    mock.download.side_effect = lambda id_, output: {"title": f"title-{id_}"}
+    list(dhus.copernicous_download(ids=["uuid0"], api=mock, output=tmp_path, workers=1))
+    mock.download.side_effect = download
+
+    ids = ["uuid1", "uuid2", "uuid3", "uuid4"]
+    status = list(dhus.copernicous_download(ids=ids, api=mock, output=tmp_path, workers=4))
+
+    assert sorted(product["uuid"] for product in status if product["status"] == "ok") == ids
+
+
+def test_copernicous_download_starts_downloads_as_products_are_consumed(monkeypatch, tmp_path):
+    mock = MagicMock()
+    mock.download.side_effect = lambda id_, output: {"title": f"title-{id_}"}
+    monkeypatch.setattr(dhus, "unzip_product", lambda *args: None)
+
+    ids = [f"uuid{i}" for i in range(10)]
+    products = dhus.copernicous_download(ids, api=mock, output=tmp_path, workers=2, unzip_workers=1)
+    next(products)
+
+    # Only the first downloads are started while the consumer doesn't ask for more products.
+    assert mock.download.call_count == 3
+    assert len(list(products)) == 9
+    assert mock.download.call_count == 10
+
+
+PRODUCT_BLOBS = [
+    "MTD_MSIL2A.xml",
+    "manifest.safe",
+    "GRANULE/L2A_T30SUF_A029079_20221005T110345/MTD_TL.xml",
+    "GRANULE/L2A_T30SUF_A029079_20221005T110345/QI_DATA/MSK_CLDPRB_20m.jp2",
+    "GRANULE/L2A_T30SUF_A029079_20221005T110345/IMG_DATA/R10m/T30SUF_20221005T105819_B04_10m.jp2",
+    "GRANULE/L2A_T30SUF_A029079_20221005T110345/IMG_DATA/R10m/T30SUF_20221005T105819_B08_10m.jp2",
+    "GRANULE/L2A_T30SUF_A029079_20221005T110345/IMG_DATA/R20m/T30SUF_20221005T105819_B04_20m.jp2",
+    "GRANULE/L2A_T30SUF_A029079_20221005T110345/IMG_DATA/R20m/T30SUF_20221005T105819_SCL_20m.jp2",
+    "GRANULE/L2A_T30SUF_A029079_20221005T110345/IMG_DATA/R60m/T30SUF_20221005T105819_SCL_60m.jp2",
+]
+
+
+def test_select_blobs_by_band_and_resolution():
+    selected = dhus.select_blobs(PRODUCT_BLOBS, bands=["B04", "B08", "SCL"], resolution=10)
+    assert sorted(selected) == sorted(
+        [
+            "MTD_MSIL2A.xml",
+            "manifest.safe",
+            "GRANULE/L2A_T30SUF_A029079_20221005T110345/IMG_DATA/R10m/T30SUF_20221005T105819_B04_10m.jp2",
+            "GRANULE/L2A_T30SUF_A029079_20221005T110345/IMG_DATA/R10m/T30SUF_20221005T105819_B08_10m.jp2",
+            # SCL is not available at 10m, so the finest resolution is used
+            "GRANULE/L2A_T30SUF_A029079_20221005T110345/IMG_DATA/R20m/T30SUF_20221005T105819_SCL_20m.jp2",
+        ]
+    )
+
+
+def test_select_blobs_without_filters_keeps_everything():
+    assert dhus.select_blobs(PRODUCT_BLOBS) == PRODUCT_BLOBS
+
+
+def test_gcloud_download_only_fetches_selected_blobs(tmp_path):
+    title = "S2B_MSIL2A_20221005T105819_N0400_R094_T30SUF_20221005T135951"
+    prefix = dhus.get_gcloud_path(title)
+    blobs = []
+    for name in PRODUCT_BLOBS:
+        blob = MagicMock()
+        blob.name = f"{prefix}/{name}"
+        blob.md5_hash = base64.b64encode(hashlib.md5(b"data").digest()).decode()
+        blob.download_to_filename.side_effect = lambda path: path.write_text("data")
+        blobs.append(blob)
+    api = MagicMock()
+    api.list_blobs.return_value = blobs
+
+    status = list(dhus.gcloud_download([title], api, output=tmp_path, bands=["B08"], resolution=10, workers=2))
+
+    assert status == [{"title": title, "status": "ok"}]
+    downloaded = sorted(
+        str(path.relative_to(tmp_path / title)) for path in (tmp_path / title).rglob("*") if path.is_file()
+    )
+    assert downloaded == [
+        "GRANULE/L2A_T30SUF_A029079_20221005T110345/IMG_DATA/R10m/T30SUF_20221005T105819_B08_10m.jp2",
+        "MTD_MSIL2A.xml",
+        "manifest.safe",
+    ]
+
+
+def test_copernicous_download_skips_complete_products(monkeypatch, tmp_path):
+    mock = MagicMock()
+    mock.download.side_effect = lambda id_, output: {"title": f"title-{id_}", "md5": "abc"}
+    monkeypatch.setattr(dhus, "unzip_product", lambda *args: None)
+
+    list(dhus.copernicous_download(ids=["uuid1"], api=mock, output=tmp_path))
+    assert dhus.get_entry(tmp_path, "title-uuid1")["status"] == "complete"
+
+    status = list(dhus.copernicous_download(ids=["uuid1", "uuid2"], api=mock, output=tmp_path))
+
+    assert sorted(status, key=lambda product: product["uuid"]) == [
+        {"uuid": "uuid1", "status": "ok"},
+        {"uuid": "uuid2", "status": "ok"},
+    ]
+    assert [call.args[0] for call in mock.download.call_args_list] == ["uuid1", "uuid2"]
+
+
+def test_unzip_product_replaces_partial_extraction(tmp_path):
+    title = "S2B_MSIL2A_20221005T105819_N0400_R094_T30SUF_20221005T135951"
+    with zipfile.ZipFile(tmp_path / f"{title}.zip", "w") as zip_file:
+        zip_file.writestr(f"{title}.SAFE/MTD_MSIL2A.xml", "metadata")
+
+    # Leftovers of an interrupted extraction
+    (tmp_path / title).mkdir()
+    (tmp_path / f"{title}.partial").mkdir()
+
+    dhus.unzip_product(tmp_path, title)
+
+    assert (tmp_path / title / f"{title}.SAFE" / "MTD_MSIL2A.xml").read_text() == "metadata"
+    assert not (tmp_path / f"{title}.partial").exists()
+    assert dhus.get_entry(tmp_path, title)["unzipped"]
+
+
+@pytest.fixture
+def zipped_product(tmp_path):
+    title = "S2B_MSIL2A_20221005T105819_N0400_R094_T30SUF_20221005T135951"
+    img_data = f"{title}.SAFE/GRANULE/L2A_T30SUF_A029115_20221005T110745/IMG_DATA"
+    with zipfile.ZipFile(tmp_path / f"{title}.zip", "w") as zip_file:
+        zip_file.writestr(f"{title}.SAFE/MTD_MSIL2A.xml", "metadata")
+        for resolution, bands in {10: ["B04", "B08"], 20: ["B04", "SCL"], 60: ["B04", "SCL"]}.items():
+            for band in bands:
+                zip_file.writestr(f"{img_data}/R{resolution}m/T30SUF_20221005T105819_{band}_{resolution}m.jp2", band)
+    return title, img_data
+
+
+def test_unzip_product_extracts_selected_bands(tmp_path, zipped_product):
+    title, img_data = zipped_product
+
+    dhus.unzip_product(tmp_path, title, ["B08", "SCL"], 10)
+
+    extracted = sorted(
+        path.relative_to(tmp_path / title).as_posix() for path in (tmp_path / title).rglob("*") if path.is_file()
+    )
+    assert extracted == [
+        f"{img_data}/R10m/T30SUF_20221005T105819_B08_10m.jp2",
+        f"{img_data}/R20m/T30SUF_20221005T105819_SCL_20m.jp2",
+        f"{title}.SAFE/MTD_MSIL2A.xml",
+    ]
+    assert dhus.get_entry(tmp_path, title)["extracted"] == [{"bands": ["B08", "SCL"], "resolution": 10}]
+
+
+def test_unzip_product_keeps_extracted_bands(tmp_path, zipped_product):
+    title, img_data = zipped_product
+
+    dhus.unzip_product(tmp_path, title, ["B04"], 10)
+    dhus.unzip_product(tmp_path, title, ["SCL"], 20)
+
+    # Bands extracted before are kept, and only the new ones extracted.
+    assert (tmp_path / title / img_data / "R10m" / "T30SUF_20221005T105819_B04_10m.jp2").is_file()
+    assert (tmp_path / title / img_data / "R20m" / "T30SUF_20221005T105819_SCL_20m.jp2").is_file()
+    assert not (tmp_path / f"{title}.partial").exists()
+    entry = dhus.get_entry(tmp_path, title)
+    assert dhus.is_extracted(entry, ["B04"], 10) and dhus.is_extracted(entry, ["SCL"], 20)
+    assert not dhus.is_extracted(entry, ["B08"], 10)
+
+
+def test_copernicous_download_extracts_more_bands_of_complete_products(tmp_path, zipped_product):
+    title, img_data = zipped_product
+    mock = MagicMock()
+    mock.download.side_effect = lambda id_, output: {"title": title}
+
+    list(dhus.copernicous_download(["uuid1"], mock, output=tmp_path, extract="bands", bands=["B04"], resolution=10))
+    status = list(
+        dhus.copernicous_download(["uuid1"], mock, output=tmp_path, extract="bands", bands=["B08"], resolution=10)
+    )
+
+    # The product is not downloaded again, but the new bands are extracted.
+    assert status == [{"uuid": "uuid1", "status": "ok"}]
+    assert mock.download.call_count == 1
+    assert dhus.find_band(tmp_path / title, "B08", 10) == str(
+        tmp_path / title / img_data / "R10m" / "T30SUF_20221005T105819_B08_10m.jp2"
+    )
+
+
+def test_find_band(tmp_path, zipped_product):
+    title, img_data = zipped_product
+
+    # Bands of zipped products are read through GDAL virtual paths.
+    assert dhus.find_band(tmp_path / f"{title}.zip", "B04") == (
+        f"/vsizip/{tmp_path}/{title}.zip/{img_data}/R10m/T30SUF_20221005T105819_B04_10m.jp2"
+    )
+    assert dhus.find_band(tmp_path / title, "SCL", 10).endswith("R20m/T30SUF_20221005T105819_SCL_20m.jp2")
+
+    # Extracted bands are preferred, falling back to the zip file for the rest.
+    dhus.unzip_product(tmp_path, title, ["SCL"], 20)
+    assert dhus.find_band(tmp_path / title, "SCL", 20) == str(
+        tmp_path / title / img_data / "R20m" / "T30SUF_20221005T105819_SCL_20m.jp2"
+    )
+    assert dhus.find_band(tmp_path / title, "B08").startswith("/vsizip/")
+
+    with pytest.raises(FileNotFoundError):
+        dhus.find_band(tmp_path / title, "B01")
+
+
+def test_copernicous_download_without_extraction(monkeypatch, tmp_path):
+    mock = MagicMock()
+    mock.download.side_effect = lambda id_, output: {"title": f"title-{id_}"}
+    monkeypatch.setattr(dhus, "unzip_product", lambda *args: pytest.fail("Product extracted"))
+
+    status = list(dhus.copernicous_download(ids=["uuid1"], api=mock, output=tmp_path, extract="none"))
+
+    assert status == [{"uuid": "uuid1", "status": "ok"}]
+    assert dhus.get_entry(tmp_path, "title-uuid1")["status"] == "complete"
+
+
+def test_gcloud_download_redownloads_truncated_files(tmp_path):
+    title = "S2B_MSIL2A_20221005T105819_N0400_R094_T30SUF_20221005T135951"
+    blob = MagicMock()
+    blob.name = f"{dhus.get_gcloud_path(title)}/MTD_MSIL2A.xml"
+    blob.md5_hash = base64.b64encode(hashlib.md5(b"metadata").digest()).decode()
+    blob.download_to_filename.side_effect = lambda path: path.write_text("metadata")
+    api = MagicMock()
+    api.list_blobs.return_value = [blob]
+
+    (tmp_path / title).mkdir()
+    (tmp_path / title / "MTD_MSIL2A.xml").write_text("meta")  # truncated
+
+    assert list(dhus.gcloud_download([title], api, output=tmp_path)) == [{"title": title, "status": "ok"}]
+    assert (tmp_path / title / "MTD_MSIL2A.xml").read_text() == "metadata"
+    assert blob.download_to_filename.call_count == 1
+
+    # Complete products are skipped without listing the bucket again
+    assert list(dhus.gcloud_download([title], api, output=tmp_path)) == [{"title": title, "status": "ok"}]
+    assert api.list_blobs.call_count == 1
+
+
+def test_download_skips_products_ready_in_catalog(monkeypatch, tmp_path):
+    titles = {
+        "uuid1": "S2B_MSIL2A_20221005T105819_N0400_R094_T30SUF_20221005T135951",
+        "uuid2": "S2A_MSIL2A_20221010T105821_N0400_R094_T30SUF_20221010T150234",
+    }
+    api = MagicMock()
+    api.query.return_value = {uuid: {"uuid": uuid, "title": title} for uuid, title in titles.items()}
+    api.to_dataframe.side_effect = dhus.SentinelAPI.to_dataframe
+    api.download.side_effect = lambda id_, output: {"title": titles[id_]}
+    monkeypatch.setattr(dhus, "SentinelAPI", lambda *args, **kwargs: api)
+    monkeypatch.setattr(dhus, "unzip_product", lambda *args: None)
+    monkeypatch.setenv("GREENSENTI_CACHE_DIR", str(tmp_path / "cache"))
+
+    db = tmp_path / "catalog.sqlite"
+    output = tmp_path / "output"
+    (output / titles["uuid1"]).mkdir(parents=True)
+    dhus.product_catalog.set_status(db, titles["uuid1"], "unzipped", path=output.resolve() / titles["uuid1"])
+
+    products = list(dhus.download(text_match="*T30SUF*", output=output, catalog=db))
+
+    # Available products are yielded with their location, without downloading them.
+    assert [(product["title"], product["status"], product.get("path")) for product in products] == [
+        (titles["uuid1"], "ok", str(output.resolve() / titles["uuid1"])),
+        (titles["uuid2"], "ok", None),
+    ]
+    assert [call.args[0] for call in api.download.call_args_list] == ["uuid2"]
+    assert set(dhus.product_catalog.ready_products(db, list(titles.values()))) == set(titles.values())
+
+    # Products available in another output folder are downloaded again.
+    products = list(dhus.download(text_match="*T30SUF*", output=tmp_path / "other", catalog=db))
+
+    assert [product.get("path") for product in products] == [None, None]
+    assert sorted(call.args[0] for call in api.download.call_args_list) == ["uuid1", "uuid2", "uuid2"]
+
+
+@pytest.fixture
+def query_api(monkeypatch, tmp_path):
+    """Mock sentinelsat API for queries, caching results in a temporary folder."""
+    monkeypatch.setenv("GREENSENTI_CACHE_DIR", str(tmp_path / "cache"))
+    api = MagicMock()
+    api.api_url = "https://dhus.example.com/"
+    api.query.return_value = {"uuid1": {"uuid": "uuid1", "title": "S2B_MSIL2A_20221005T105819_N0400_R094_T30SUF"}}
+    api.to_dataframe.side_effect = dhus.SentinelAPI.to_dataframe
+    return api
+
+
+def test_query_products_uses_cache(query_api):
+    footprint = "POLYGON((0 0,1 0,1 1,0 1,0 0))"
+    params = {"text_match": None, "from_date": datetime(2022, 10, 1), "max_clouds": 20, "split_days": 0}
+
+    first = dhus.query_products(query_api, footprint, to_date=datetime.now(), **params)
+    # Same polygon, different starting vertex
+    second = dhus.query_products(query_api, "POLYGON((1 0,1 1,0 1,0 0,1 0))", to_date=datetime.now(), **params)
+    assert query_api.query.call_count == 1
+    assert first.equals(second)
+
+    dhus.query_products(query_api, footprint, to_date=datetime.now(), refresh=True, **params)
+    assert query_api.query.call_count == 2
+
+    dhus.query_products(query_api, footprint, to_date=datetime.now(), ttl=0, **params)
+    assert query_api.query.call_count == 3
+
+
+def test_query_products_cache_expires_for_open_ranges(query_api, tmp_path):
+    footprint = "POLYGON((0 0,1 0,1 1,0 1,0 0))"
+    params = {"text_match": None, "from_date": datetime(2022, 10, 1), "max_clouds": 20, "split_days": 0}
+
+    dhus.query_products(query_api, footprint, to_date=datetime.now(), **params)
+    dhus.query_products(query_api, footprint, to_date=datetime(2022, 10, 31), **params)
+
+    # Make every cached result older than the TTL
+    for cache_file in (tmp_path / "cache").rglob("*.json"):
+        os.utime(cache_file, (0, 0))
+
+    dhus.query_products(query_api, footprint, to_date=datetime.now(), **params)
+    assert query_api.query.call_count == 3
+    # Closed past ranges never expire
+    dhus.query_products(query_api, footprint, to_date=datetime(2022, 10, 31), **params)
+    assert query_api.query.call_count == 3
+
+
+def test_query_products_cache_expires_for_recent_ranges(query_api, tmp_path):
+    footprint = "POLYGON((0 0,1 0,1 1,0 1,0 0))"
+    params = {"text_match": None, "from_date": datetime(2022, 10, 1), "max_clouds": 20, "split_days": 0}
+
+    first = dhus.query_products(query_api, footprint, to_date=datetime.now() - timedelta(days=1), **params)
+    for cache_file in (tmp_path / "cache").rglob("*.json"):
+        os.utime(cache_file, (0, 0))
+
+    # Ranges ending yesterday may still get late ingested products.
+    second = dhus.query_products(query_api, footprint, to_date=datetime.now() - timedelta(days=1), **params)
+    assert query_api.query.call_count == 2
+    assert first.equals(second)
+
+
+def test_query_products_cache_keys_recent_ranges_by_day(query_api):
+    footprint = "POLYGON((0 0,1 0,1 1,0 1,0 0))"
+    params = {"text_match": None, "from_date": datetime(2022, 10, 1), "max_clouds": 20, "split_days": 0}
+
+    dhus.query_products(query_api, footprint, to_date=datetime.now(), **params)
+    # A recent range ending another day doesn't get the results of the first one.
+    dhus.query_products(query_api, footprint, to_date=datetime.now() - timedelta(days=5), **params)
+    assert query_api.query.call_count == 2
+    assert query_api.query.call_args.kwargs["date"][1].date() == (datetime.now() - timedelta(days=5)).date()
+
+    dhus.query_products(query_api, footprint, to_date=datetime.now(), **params)
+    assert query_api.query.call_count == 2
+
+
+def test_split_date_range():
+    assert dhus.split_date_range(datetime(2022, 1, 1), datetime(2022, 3, 1), 30) == [
+        (datetime(2022, 1, 1), datetime(2022, 1, 31)),
+        (datetime(2022, 1, 31), datetime(2022, 3, 1)),
+    ]
+    assert dhus.split_date_range(datetime(2022, 1, 1), datetime(2022, 3, 1), None) == [
+        (datetime(2022, 1, 1), datetime(2022, 3, 1))
+    ]
+
+
+def test_split_footprint():
+    footprint = "POLYGON((0 0,3 0,0 3,0 0))"
+    parts = [shapely.wkt.loads(part) for part in dhus.split_footprint(footprint, 2)]
+
+    # The (2, 2) cell only touches the triangle
+    assert len(parts) == 3
+    assert sum(part.area for part in parts) == pytest.approx(4.5)
+    assert dhus.split_footprint(footprint, 5) == [footprint]
+
+
+def test_query_products_merges_sub_queries(query_api):
+    def query(area, date, **kwargs):
+        # Products are found by several sub-queries.
+        day = date[0].strftime("%Y%m%d")
+        return {
+            uuid: {"uuid": uuid, "title": f"S2B_MSIL2A_{day}T105819_N0400_R094_{uuid}"}
+            for uuid in [f"uuid-{day}", "uuid-shared"]
+        }
+
+    query_api.query.side_effect = query
+
+    products = dhus.query_products(
+        query_api,
+        "POLYGON((0 0,3 0,3 1,0 1,0 0))",
+        None,
+        datetime(2022, 1, 1),
+        datetime(2022, 3, 1),
+        split_days=30,
+        split_degrees=2,
+    )
+
+    # 2 date ranges by 2 areas
+    assert query_api.query.call_count == 4
+    assert sorted(products.index) == ["uuid-20220101", "uuid-20220131", "uuid-shared"]
+
+
+def test_query_products_splits_from_sentinel2_launch(query_api):
+    dhus.query_products(query_api, None, None, datetime(1970, 1, 1), datetime(2016, 1, 1), split_days=90)
+
+    # No sub-queries before any product was sensed
+    assert query_api.query.call_count == 3
+    assert query_api.query.call_args_list[0].kwargs["date"][0] == dhus.SENTINEL2_EPOCH
+
+
+@pytest.fixture
+def download_api(monkeypatch, tmp_path):
+    """Mock sentinelsat API for downloads of two products."""
+    monkeypatch.setenv("GREENSENTI_CACHE_DIR", str(tmp_path / "cache"))
+    titles = {
+        "uuid1": "S2B_MSIL2A_20221005T105819_N0400_R094_T30SUF_20221005T135951",
+        "uuid2": "S2A_MSIL2A_20221010T105821_N0400_R094_T30SUF_20221010T150234",
+    }
+    api = MagicMock()
+    api.query.return_value = {
+        uuid: {"uuid": uuid, "title": title, "cloudcoverpercentage": 10.0} for uuid, title in titles.items()
+    }
+    api.to_dataframe.side_effect = dhus.SentinelAPI.to_dataframe
+    api.download.side_effect = lambda id_, output: {"title": titles[id_]}
+    monkeypatch.setattr(dhus, "SentinelAPI", lambda *args, **kwargs: api)
+    monkeypatch.setattr(dhus, "unzip_product", lambda *args: None)
+    return titles
+
+
+def test_download_async(download_api, tmp_path):
+    async def download_products():
+        return [product async for product in dhus.download_async(text_match="*T30SUF*", output=tmp_path)]
+
+    products = asyncio.run(download_products())
+
+    assert sorted((product["uuid"], product["title"], product["status"]) for product in products) == [
+        (uuid, title, "ok") for uuid, title in download_api.items()
+    ]
+    assert all(product["cloudcoverpercentage"] == 10.0 for product in products)
+
+
+def test_stream_writes_ndjson(download_api, tmp_path, capsys):
+    dhus.stream(text_match="*T30SUF*", output=tmp_path)
+
+    captured = capsys.readouterr()
+    products = [json.loads(line) for line in captured.out.splitlines()]
+    assert sorted(product["title"] for product in products) == sorted(download_api.values())
+    assert "Found 2 scenes" in captured.err
+
+
+def test_download_splits_queries(download_api, tmp_path):
+    api = dhus.SentinelAPI()
+
+    list(dhus.download(text_match="*T30SUF*", from_date="2022-01-01", to_date="2022-03-01", output=tmp_path))
+    assert api.query.call_count == 1
+
+    list(
+        dhus.download(
+            text_match="*T30SUF*",
+            from_date="2022-01-01",
+            to_date="2022-03-01",
+            output=tmp_path,
+            split_days=30,
+            refresh=True,
+        )
+    )
+    assert api.query.call_count == 3
+
+
+@pytest.fixture
+def cloudy_download(download_api, monkeypatch, tmp_path):
+    """Mock DHuS downloads of zipped products with an SCL band, 75% cloudy over the area of interest."""
+
+    def download(id_, output):
+        title = download_api[id_]
+        with zipfile.ZipFile(Path(output, f"{title}.zip"), "w") as zip_file:
+            zip_file.writestr(f"{title}.SAFE/GRANULE/L2A_T30SUF/IMG_DATA/R20m/T30SUF_20221005T105819_SCL_20m.jp2", "")
+        return {"title": title}
+
+    api = dhus.SentinelAPI()
+    api.download.side_effect = download
+    percentages = []
+    monkeypatch.setattr(dhus, "aoi_cloud_percentage", lambda *args: percentages.append(args[0]) or 75.0)
+    return api, percentages
+
+
+def test_download_skips_cloudy_products_in_later_runs(cloudy_download, tmp_path):
+    api, percentages = cloudy_download
+
+    products = list(dhus.download(TEATINOS, "*T30SUF*", output=tmp_path, max_aoi_clouds=50, query_cache_ttl=0))
+    assert [product["status"] for product in products] == ["cloudy", "cloudy"]
+    assert not list(tmp_path.glob("*.zip"))
+    assert api.download.call_count == 2
+
+    # Cloudy products are neither downloaded nor triaged again.
+    products = list(dhus.download(TEATINOS, "*T30SUF*", output=tmp_path, max_aoi_clouds=50, query_cache_ttl=0))
+    assert [(product["status"], product["aoi_cloud_percentage"]) for product in products] == [("cloudy", 75.0)] * 2
+    assert api.download.call_count == 2
+    assert len(percentages) == 2
+
+    # Unless the threshold is raised above their cloud percentage.
+    products = list(dhus.download(TEATINOS, "*T30SUF*", output=tmp_path, max_aoi_clouds=90, query_cache_ttl=0))
+    assert [product["status"] for product in products] == ["ok", "ok"]
+    assert api.download.call_count == 4
+
+
+def test_download_reuses_cloud_percentage_of_cropped_products(cloudy_download, monkeypatch, tmp_path):
+    api, percentages = cloudy_download
+
+    def crop_product(output, title, *args, **kwargs):
+        # Cropping removes the zip file and the bands not requested, like SCL.
+        Path(output, f"{title}.zip").unlink()
+        dhus.update_entry(output, title, cropped=True)
+
+    monkeypatch.setattr(dhus, "crop_product", crop_product)
+    params = {"output": tmp_path, "bands": ["B04"], "crop": True, "max_aoi_clouds": 90, "query_cache_ttl": 0}
+
+    assert [product["status"] for product in dhus.download(TEATINOS, "*T30SUF*", **params)] == ["ok", "ok"]
+    products = list(dhus.download(TEATINOS, "*T30SUF*", **params))
+
+    assert [(product["status"], product["aoi_cloud_percentage"]) for product in products] == [("ok", 75.0)] * 2
+    assert api.download.call_count == 2
+    assert len(percentages) == 2
+
+
+def test_retrieve_offline(monkeypatch, tmp_path):
+    clock = [1000.0]
+    monkeypatch.setattr(dhus.time, "time", lambda: clock[0])
+    monkeypatch.setattr(dhus.time, "sleep", lambda seconds: clock.__setitem__(0, clock[0] + seconds))
+    monkeypatch.setattr(dhus, "unzip_product", lambda *args: None)
+    for uuid in ["uuid1", "uuid2", "uuid3"]:
+        lta.track(tmp_path, uuid, f"title-{uuid}", "queued")
+
+    api = MagicMock()
+    online = {"uuid1": [False, True], "uuid2": [True]}
+    api.is_online.side_effect = lambda uuid: online[uuid].pop(0)
+    # uuid3 is already online when requested
+    api.trigger_offline_retrieval.side_effect = lambda uuid: uuid != "uuid3"
+    api.download.side_effect = lambda id_, output: {"title": f"title-{id_}"}
+
+    products = list(dhus.retrieve_offline(tmp_path, api=api, max_active=2, base_delay=10))
+
+    assert sorted(product["uuid"] for product in products) == ["uuid1", "uuid2", "uuid3"]
+    assert all(product["status"] == "ok" for product in products)
+    # uuid3 is only requested once a retrieval slot is free, and uuid1 is checked again with backoff.
+    assert [call.args[0] for call in api.trigger_offline_retrieval.call_args_list] == ["uuid1", "uuid2", "uuid3"]
+    assert clock[0] == 1020
+    assert lta.read_state(tmp_path) == {}
+
+
+def test_retrieve_offline_gives_up(monkeypatch, tmp_path):
+    monkeypatch.setattr(dhus.time, "sleep", lambda seconds: None)
+    lta.track(tmp_path, "uuid1", "title-uuid1", base_delay=0)
+    api = MagicMock()
+    api.is_online.return_value = False
+
+    products = list(dhus.retrieve_offline(tmp_path, api=api, base_delay=0, max_attempts=3))
+
+    assert products == [{"uuid": "uuid1", "title": "title-uuid1", "status": "failed", "error": ANY}]
+    assert api.is_online.call_count == 3
+
+
+def test_retrieve_offline_gives_up_on_rejected_requests(monkeypatch, tmp_path):
+    monkeypatch.setattr(dhus.time, "sleep", lambda seconds: None)
+    lta.track(tmp_path, "uuid1", "title-uuid1", "queued")
+    lta.track(tmp_path, "uuid2", "title-uuid2", "queued")
+    api = MagicMock()
+    api.trigger_offline_retrieval.side_effect = dhus.LTAError("Quota exceeded", None)
+
+    products = list(dhus.retrieve_offline(tmp_path, api=api, base_delay=0, max_rejections=3))
+
+    # Requests rejected every time are given up, instead of requested again forever.
+    assert sorted(product["uuid"] for product in products) == ["uuid1", "uuid2"]
+    assert all(product["status"] == "failed" for product in products)
+    assert lta.read_state(tmp_path) == {}
+
+    with pytest.raises(ValueError):
+        next(dhus.retrieve_offline(tmp_path, api=api, max_active=0))
+
+
+def test_download_tracks_offline_products(download_api, tmp_path):
+    def download(id_, output):
+        if id_ == "uuid2":
+            raise dhus.LTATriggered(id_)
+        return {"title": download_api[id_]}
+
+    dhus.SentinelAPI().download.side_effect = download
+
+    products = list(dhus.download(text_match="*T30SUF*", output=tmp_path))
+
+    assert sorted(product["status"] for product in products) == ["ok", "triggered"]
+    assert lta.read_state(tmp_path)["uuid2"]["title"] == download_api["uuid2"]
+
+
+def test_copernicous_download_uses_shared_cache(monkeypatch, tmp_path):
+    def download(id_, output):
+        Path(output, f"title-{id_}.zip").write_text(id_)
+        return {"title": f"title-{id_}", "md5": hashlib.md5(id_.encode()).hexdigest().upper()}
+
+    mock = MagicMock()
+    mock.download.side_effect = download
+    monkeypatch.setattr(dhus, "unzip_product", lambda *args: None)
+    shared_cache = tmp_path / "cache"
+
+    for output in [tmp_path / "output1", tmp_path / "output2"]:
+        output.mkdir()
+        status = list(dhus.copernicous_download(["uuid1"], mock, output=output, shared_cache=shared_cache))
+        assert status == [{"uuid": "uuid1", "status": "ok"}]
+        assert (output / "title-uuid1.zip").read_text() == "uuid1"
+        assert dhus.get_entry(output, "title-uuid1")["status"] == "complete"
+
+    # The second output folder is populated from the cache.
+    assert mock.download.call_count == 1
+
+
+def test_crop_product(tmp_path):
+    title = "S2B_MSIL2A_20221005T105819_N0400_R094_T30SUF_20221005T135951"
+    img_data = f"{title}.SAFE/GRANULE/L2A_T30SUF_A029115_20221005T110745/IMG_DATA"
+    with zipfile.ZipFile(tmp_path / f"{title}.zip", "w") as zip_file:
+        zip_file.writestr(f"{title}.SAFE/MTD_MSIL2A.xml", "metadata")
+        for band, resolution in [("B04", 10), ("B08", 10), ("B04", 20)]:
+            band_file = tmp_path / f"{band}_{resolution}m.tif"
+            width, height = 5000 // resolution, 3000 // resolution
+            with rasterio.open(
+                band_file,
+                "w",
+                driver="GTiff",
+                width=width,
+                height=height,
+                count=1,
+                dtype="uint16",
+                crs="EPSG:32630",
+                transform=from_origin(365000, 4066000, resolution, resolution),
+            ) as dst:
+                dst.write(np.ones((1, height, width), dtype="uint16"))
+            zip_file.write(band_file, f"{img_data}/R{resolution}m/T30SUF_20221005T105819_{band}_{resolution}m.jp2")
+
+    cropped = dhus.crop_product(tmp_path, title, TEATINOS, bands=["B04"], resolution=10)
+
+    assert [path.relative_to(tmp_path / title).as_posix() for path in cropped] == [
+        f"{img_data}/R10m/T30SUF_20221005T105819_B04_10m.tif"
+    ]
+    with rasterio.open(cropped[0]) as src:
+        assert src.width < 500 and src.height < 300
+    # Only cropped bands and metadata are kept.
+    assert not (tmp_path / f"{title}.zip").exists()
+    assert not list((tmp_path / title).rglob("*.jp2"))
+    assert (tmp_path / title / f"{title}.SAFE" / "MTD_MSIL2A.xml").read_text() == "metadata"
+    assert dhus.find_band(tmp_path / title, "B04") == str(cropped[0])
+
+
+def test_footprint_coverage():
+    footprints = pd.Series(
+        [
+            "POLYGON ((0 0, 1 0, 1 1, 0 1, 0 0))",
+            "POLYGON ((5 5, 6 5, 6 6, 5 6, 5 5))",
+            "POLYGON ((0 0, 4 0, 4 4, 0 4, 0 0))",
+        ]
+    )
+
+    coverage = dhus.footprint_coverage(footprints, "POLYGON ((0.5 0, 1.5 0, 1.5 1, 0.5 1, 0.5 0))")
+
+    assert coverage.tolist() == [0.5, 0.0, 1.0]
+    assert dhus.footprint_coverage(footprints, "POINT (0.5 0.5)").tolist() == [1.0, 0.0, 1.0]
+
+
+def test_latest_baselines():
+    products_df = pd.DataFrame(
+        {
+            "title": [
+                "S2B_MSIL2A_20221005T105819_N0400_R094_T30SUF_20221005T135951",
+                "S2B_MSIL2A_20221005T105819_N0509_R094_T30SUF_20230510T080000",
+                "S2B_MSIL2A_20221005T105819_N0400_R094_T30SUG_20221005T135951",
+            ]
+        },
+        index=["uuid1", "uuid2", "uuid3"],
+    )
+
+    assert list(dhus.latest_baselines(products_df).index) == ["uuid2", "uuid3"]
+
+
+def test_download_skips_products_covering_little_of_geometry(download_api, tmp_path):
+    covered = shapely.wkt.loads(dhus.geojson_to_wkt(dhus.read_geojson(TEATINOS))).buffer(0.01).wkt
+    footprints = {"uuid1": covered, "uuid2": "POLYGON ((0 0, 1 0, 1 1, 0 1, 0 0))"}
+    query = dhus.SentinelAPI("user", "password").query.return_value
+    for uuid, footprint in footprints.items():
+        query[uuid]["footprint"] = footprint
+
+    products = list(dhus.download(TEATINOS, "*T30SUF*", output=tmp_path, min_coverage=50, query_cache_ttl=0))
+
+    assert [product["uuid"] for product in products] == ["uuid1"]
+
+
+def test_download_without_results(download_api, tmp_path, capsys):
+    dhus.SentinelAPI("user", "password").query.return_value = {}
+
+    for _ in range(2):  # Queried, then cached
+        products = dhus.download(
+            TEATINOS,
+            "*T30SUF*",
+            output=tmp_path,
+            skip=["title"],
+            catalog=tmp_path / "catalog.sqlite",
+            max_aoi_clouds=50,
+        )
+        assert list(products) == []
+    assert "Found 0 scenes" in capsys.readouterr().out
@@ -0,0 +1,41 @@
+import hashlib
+import zipfile
+from pathlib import Path
+
+from greensenti import incremental
+
+
+def test_fingerprint_of_zipped_input(tmp_path: Path):
+    with zipfile.ZipFile(tmp_path / "product.zip", "w") as zip_file:
+        zip_file.writestr("product.SAFE/band.jp2", "band")
+
+    computed = incremental.fingerprint("ndvi", {"b4": f"/vsizip/{tmp_path}/product.zip/product.SAFE/band.jp2"})
+
+    assert computed["inputs"]["b4"]["size"] == (tmp_path / "product.zip").stat().st_size
+    assert computed["version"] == incremental.__version__
+
+
+def test_is_up_to_date(tmp_path: Path, monkeypatch):
+    source, output = tmp_path / "band.tif", tmp_path / "ndvi.tif"
+    source.write_text("band")
+    computed = incremental.fingerprint("ndvi", {"b4": source}, {"resolution": 10})
+    assert not incremental.is_up_to_date(output, computed)
+
+    output.write_text("ndvi")
+    incremental.record(output, computed)
+    assert incremental.is_up_to_date(output, incremental.fingerprint("ndvi", {"b4": source}, {"resolution": 10}))
+    assert not incremental.is_up_to_date(output, incremental.fingerprint("ndvi", {"b4": source}, {"resolution": 20}))
+
+    # Outputs of other versions are computed again.
+    monkeypatch.setattr(incremental, "__version__", "0.0.0")
+    assert not incremental.is_up_to_date(output, incremental.fingerprint("ndvi", {"b4": source}, {"resolution": 10}))
+
+
+def test_fingerprint_by_checksum(tmp_path: Path):
+    source = tmp_path / "band.tif"
+    source.write_text("band")
+
+    assert incremental.fingerprint("ndvi", {"b4": source}, checksum=True)["inputs"]["b4"] == {
+        "path": str(source),
+        "md5": hashlib.md5(b"band").hexdigest(),
+    }
@@ -0,0 +1,33 @@
+import time
+
+import pytest
+
+from greensenti import lta
+
+
+def test_backoff():
+    assert [lta.backoff(attempts, base_delay=60, max_delay=600) for attempts in range(6)] == [
+        60,
+        60,
+        120,
+        240,
+        480,
+        600,
+    ]
+
+
+def test_track_persists_state(tmp_path):
+    entry = lta.track(tmp_path, "uuid1", "title1")
+    assert entry["status"] == "triggered"
+    assert entry["next_check"] > time.time()
+
+    # Tracking again keeps the state of the product.
+    lta.retry_later(tmp_path, "uuid1", base_delay=60)
+    assert lta.track(tmp_path, "uuid1", "title1", "queued")["attempts"] == 1
+    assert lta.read_state(tmp_path)["uuid1"]["status"] == "triggered"
+
+    lta.remove_request(tmp_path, "uuid1")
+    assert lta.read_state(tmp_path) == {}
+
+    with pytest.raises(ValueError):
+        lta.track(tmp_path, "uuid2", "title2", "online")
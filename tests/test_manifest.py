@@ -0,0 +1,49 @@
+import base64
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from greensenti.compute import mp_context
+from greensenti.manifest import (
+    b64_to_hex,
+    complete_entries,
+    get_entry,
+    md5sum,
+    read_manifest,
+    update_entry,
+)
+
+
+def test_md5sum(tmp_path):
+    filename = tmp_path / "file.txt"
+    filename.write_bytes(b"greensenti")
+    assert md5sum(filename) == hashlib.md5(b"greensenti").hexdigest()
+    assert b64_to_hex(base64.b64encode(hashlib.md5(b"greensenti").digest()).decode()) == md5sum(filename)
+
+
+def test_update_entry(tmp_path):
+    assert read_manifest(tmp_path) == {}
+    assert get_entry(tmp_path, "product") is None
+
+    update_entry(tmp_path, "product", status="partial", uuid="uuid1")
+    assert complete_entries(tmp_path) == {}
+
+    update_entry(tmp_path, "product", status="complete")
+    assert get_entry(tmp_path, "product")["status"] == "complete"
+    assert get_entry(tmp_path, uuid="uuid1")["title"] == "product"
+    assert get_entry(tmp_path, uuid="uuid2") is None
+    # No temporary files are left behind, only the lock file of the manifest.
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        ".greensenti-manifest.json",
+        ".greensenti-manifest.json.lock",
+    ]
+    assert list(complete_entries(tmp_path)) == ["uuid1"]
+
+
+def test_update_entry_from_concurrent_processes(tmp_path):
+    titles = [f"product{i}" for i in range(40)]
+    with ProcessPoolExecutor(max_workers=4, mp_context=mp_context()) as executor:
+        list(executor.map(partial(update_entry, tmp_path, status="complete"), titles))
+
+    # Every update is kept, none is overwritten by another process.
+    assert sorted(read_manifest(tmp_path)) == sorted(titles)
@@ -0,0 +1,92 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.warp import transform_bounds
+from shapely.geometry import box
+
+from greensenti.mosaic import aoi_cloud_fraction, mosaic
+
+
+def write_tile(filepath: Path, crs: str, lonlat_bounds: tuple, value: int) -> Path:
+    """Create a temporary 10m raster covering some lon/lat bounds, filled with a constant value."""
+    left, bottom, right, top = transform_bounds("EPSG:4326", crs, *lonlat_bounds)
+    width, height = int((right - left) // 10), int((top - bottom) // 10)
+    profile = {
+        "driver": "GTiff",
+        "width": width,
+        "height": height,
+        "count": 1,
+        "dtype": np.uint16,
+        "transform": from_origin(left, top, 10, 10),
+        "crs": crs,
+        "nodata": None,
+    }
+    with rasterio.open(filepath, "w", **profile) as dst:
+        dst.write(np.full((1, height, width), value, dtype=np.uint16))
+    return filepath
+
+
+@pytest.fixture
+def geojson(tmp_path: Path) -> Path:
+    """Create a temporary GeoJSON file crossing the boundary between UTM zones 30 and 31."""
+    filepath = tmp_path / "aoi.geojson"
+    coordinates = [[[-0.01, 37.0], [0.01, 37.0], [0.01, 37.01], [-0.01, 37.01], [-0.01, 37.0]]]
+    with open(filepath, "w") as f:
+        json.dump(
+            {
+                "type": "FeatureCollection",
+                "features": [
+                    {"type": "Feature", "properties": {}, "geometry": {"type": "Polygon", "coordinates": coordinates}}
+                ],
+            },
+            f,
+        )
+    return filepath
+
+
+def test_mosaic_across_utm_zones(tmp_path: Path, geojson: Path):
+    west = write_tile(tmp_path / "west.tif", "EPSG:32630", (-0.03, 36.99, 0.0, 37.02), 1)
+    east = write_tile(tmp_path / "east.tif", "EPSG:32631", (0.0, 36.99, 0.03, 37.02), 2)
+
+    output = mosaic([west, east], geojson, tmp_path / "mosaic.tif")
+
+    with rasterio.open(output) as src:
+        assert src.crs.to_epsg() == 32630
+        assert src.res == (10, 10)
+        assert src.transform.c % 10 == 0 and src.transform.f % 10 == 0
+        data = src.read(1)
+
+    values = set(np.unique(data))
+    assert values == {0, 1, 2}  # nodata outside the area and both tiles inside
+    assert np.all(data[data.shape[0] // 2, 5 : data.shape[1] // 3] == 1)
+    assert np.all(data[data.shape[0] // 2, -data.shape[1] // 3 : -5] == 2)
+
+
+def test_mosaic_least_cloudy(tmp_path: Path, geojson: Path):
+    bounds = (-0.03, 36.99, 0.03, 37.02)
+    cloudy = write_tile(tmp_path / "cloudy.tif", "EPSG:32630", bounds, 1)
+    clear = write_tile(tmp_path / "clear.tif", "EPSG:32630", bounds, 2)
+    cloudy_scl = write_tile(tmp_path / "cloudy_scl.tif", "EPSG:32630", bounds, 9)
+    clear_scl = write_tile(tmp_path / "clear_scl.tif", "EPSG:32630", bounds, 4)
+
+    output = mosaic([cloudy, clear], geojson, tmp_path / "mosaic.tif", rule="least-cloudy", scl=[cloudy_scl, clear_scl])
+
+    with rasterio.open(output) as src:
+        data = src.read(1)
+    assert set(np.unique(data)) == {0, 2}
+
+    with rasterio.open(output) as src:
+        kwargs = src.meta
+        aoi = box(*src.bounds).__geo_interface__
+    assert aoi_cloud_fraction(cloudy_scl, aoi, kwargs) == 1.0
+    assert aoi_cloud_fraction(clear_scl, aoi, kwargs) == 0.0
+
+
+def test_mosaic_requires_scl_for_least_cloudy(tmp_path: Path, geojson: Path):
+    tile = write_tile(tmp_path / "tile.tif", "EPSG:32630", (-0.03, 36.99, 0.03, 37.02), 1)
+    with pytest.raises(ValueError):
+        mosaic([tile], geojson, tmp_path / "mosaic.tif", rule="least-cloudy")
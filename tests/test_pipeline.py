@@ -0,0 +1,214 @@
+import os
+from pathlib import Path
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from greensenti import pipeline
+from greensenti.catalog import products, set_status
+
+TITLE = "S2B_MSIL2A_20221005T105819_N0400_R094_T30SUF_20221005T135951"
+
+
+@pytest.fixture
+def downloads(tmp_path: Path) -> Path:
+    """Create an extracted product with B03, B04 and B08 bands at 10m, and B03, B11 and SCL at 20m."""
+    img_data = tmp_path / "downloads" / TITLE / f"{TITLE}.SAFE" / "GRANULE" / "L2A_T30SUF" / "IMG_DATA"
+    rng = np.random.default_rng(42)
+    for band, resolution in [("B03", 10), ("B04", 10), ("B08", 10), ("B03", 20), ("B11", 20), ("SCL", 20)]:
+        size = 200 // resolution
+        filename = img_data / f"R{resolution}m" / f"T30SUF_20221005T105819_{band}_{resolution}m.jp2"
+        filename.parent.mkdir(parents=True, exist_ok=True)
+        profile = {
+            "driver": "GTiff",
+            "width": size,
+            "height": size,
+            "count": 1,
+            "dtype": np.uint16,
+            "crs": "EPSG:32630",
+            "transform": from_origin(300000, 4100000, resolution, resolution),
+        }
+        with rasterio.open(filename, "w", **profile) as dst:
+            if band == "SCL":
+                # Clouds (9) on the top half
+                dst.write(np.repeat([9, 4], size * size // 2).reshape((1, size, size)).astype(np.uint16))
+            else:
+                dst.write(rng.integers(1, 10000, size=(1, size, size), dtype=np.uint16))
+    return tmp_path / "downloads"
+
+
+# Bands of each resolution of L2A products.
+L2A_BANDS = {
+    10: ["B02", "B03", "B04", "B08"],
+    20: ["B02", "B03", "B04", "B05", "B06", "B07", "B8A", "B11", "B12", "SCL"],
+    60: ["B01", "B02", "B03", "B04", "B05", "B06", "B07", "B8A", "B09", "B11", "B12", "SCL"],
+}
+
+
+@pytest.fixture
+def l2a_product(tmp_path: Path) -> Path:
+    """Create an extracted product with every band of L2A products, at their resolutions, over 600x600m."""
+    img_data = tmp_path / "l2a" / TITLE / f"{TITLE}.SAFE" / "GRANULE" / "L2A_T30SUF" / "IMG_DATA"
+    rng = np.random.default_rng(42)
+    for resolution, bands in L2A_BANDS.items():
+        size = 600 // resolution
+        for band in bands:
+            filename = img_data / f"R{resolution}m" / f"T30SUF_20221005T105819_{band}_{resolution}m.jp2"
+            filename.parent.mkdir(parents=True, exist_ok=True)
+            profile = {
+                "driver": "GTiff",
+                "width": size,
+                "height": size,
+                "count": 1,
+                "dtype": np.uint16,
+                "crs": "EPSG:32630",
+                "transform": from_origin(300000, 4100000, resolution, resolution),
+            }
+            with rasterio.open(filename, "w", **profile) as dst:
+                values = np.full((1, size, size), 4) if band == "SCL" else rng.integers(1, 10000, (1, size, size))
+                dst.write(values.astype(np.uint16))
+    return tmp_path / "l2a" / TITLE
+
+
+def test_step_bands():
+    assert pipeline.step_bands("ndvi") == {"b4": "B04", "b8": "B08"}
+    assert pipeline.step_bands("moisture") == {"b8a": "B8A", "b11": "B11"}
+    assert pipeline.step_bands("tc") == {"r": "B04", "g": "B03", "b": "B02"}
+    assert pipeline.step_bands("osavi") == {"b4": "B04", "b8": "B08"}
+
+
+def test_process_product_uses_common_resolution(tmp_path: Path, downloads: Path):
+    outputs = pipeline.process_product(downloads / TITLE, tmp_path / "output", ["ndvi", "ndsi", "stats"])
+
+    assert set(outputs) == {"ndvi", "ndsi"}
+    with rasterio.open(outputs["ndvi"]) as src:
+        assert src.res == (10, 10)
+    # B11 is only available at 20m, so B03 is taken at 20m too.
+    with rasterio.open(outputs["ndsi"]) as src:
+        assert src.res == (20, 20)
+    assert Path(f"{outputs['ndvi']}.stats.json").is_file()
+
+
+def test_process_product_runs_every_step(tmp_path: Path, l2a_product: Path):
+    steps = list(pipeline.INDEX_STEPS)
+
+    outputs = pipeline.process_product(l2a_product, tmp_path / "output", steps, scl_classes=[9])
+
+    assert set(outputs) == set(steps)
+    for step in ("bri", "bsi", "ndvi"):
+        with rasterio.open(outputs[step]) as src:
+            assert src.res == (10, 10)
+            assert np.isfinite(src.read(1)).any()
+
+
+def test_process_product_masks_scl_classes(tmp_path: Path, downloads: Path):
+    outputs = pipeline.process_product(downloads / TITLE, tmp_path / "output", ["ndvi"], scl_classes=[9])
+
+    with rasterio.open(outputs["ndvi"]) as src:
+        ndvi = src.read(1)
+    assert np.isnan(ndvi[:10]).all()
+    assert not np.isnan(ndvi[10:]).any()
+
+
+def test_process_product_masks_own_bands(tmp_path: Path, downloads: Path):
+    # No data in B03, which is used by ndwi but not by ndvi.
+    band = next((downloads / TITLE).rglob("*_B03_10m.jp2"))
+    with rasterio.open(band, "r+") as dst:
+        dst.write(np.zeros((1, 20, 20), dtype=np.uint16))
+
+    outputs = pipeline.process_product(downloads / TITLE, tmp_path / "output", ["ndvi", "ndwi"], scl_classes=[9])
+
+    with rasterio.open(outputs["ndwi"]) as src:
+        assert np.isnan(src.read(1)).all()
+    with rasterio.open(outputs["ndvi"]) as src:
+        ndvi = src.read(1)
+    assert np.isnan(ndvi[:10]).all()
+    assert not np.isnan(ndvi[10:]).any()
+
+
+def test_process_product_incremental(tmp_path: Path, downloads: Path):
+    outputs = pipeline.process_product(
+        downloads / TITLE, tmp_path / "output", ["ndvi", "ndsi", "quicklook"], incremental=True
+    )
+    mtimes = {name: Path(path).stat().st_mtime_ns for name, path in outputs.items()}
+
+    pipeline.process_product(downloads / TITLE, tmp_path / "output", ["ndvi", "ndsi", "quicklook"], incremental=True)
+    assert {name: Path(path).stat().st_mtime_ns for name, path in outputs.items()} == mtimes
+
+    # Only the outputs of a changed band are computed again.
+    band = next((downloads / TITLE).rglob("*_B11_20m.jp2"))
+    os.utime(band, ns=(band.stat().st_atime_ns, band.stat().st_mtime_ns + 1))
+    pipeline.process_product(downloads / TITLE, tmp_path / "output", ["ndvi", "ndsi", "quicklook"], incremental=True)
+    changed = {name for name, path in outputs.items() if Path(path).stat().st_mtime_ns != mtimes[name]}
+    assert changed == {"ndsi", "ndsi-quicklook"}
+
+
+def test_download_and_process(tmp_path: Path, downloads: Path, monkeypatch: pytest.MonkeyPatch):
+    requested = {}
+
+    def download(*args, **kwargs):
+        requested.update(kwargs)
+        yield {"uuid": "uuid1", "title": TITLE, "status": "ok"}
+        yield {"uuid": "uuid2", "title": "offline", "status": "triggered"}
+
+    monkeypatch.setattr(pipeline.dhus, "download", download)
+    catalog = tmp_path / "catalog.sqlite"
+    set_status(catalog, TITLE, "downloaded")
+
+    results = list(
+        pipeline.download_and_process(
+            steps="ndvi,quicklook", output=tmp_path, cpu_workers=1, queue_size=1, delete_raw=True, catalog=catalog
+        )
+    )
+
+    # Only the bands of the steps are extracted.
+    assert requested["bands"] == ["B04", "B08"]
+    assert requested["extract"] == "bands"
+
+    assert sorted(result["status"] for result in results) == ["ok", "triggered"]
+    processed = next(result for result in results if result["status"] == "ok")
+    assert set(processed["outputs"]) == {"ndvi", "ndvi-quicklook"}
+    assert Path(processed["outputs"]["ndvi"]).is_file()
+
+    assert not (downloads / TITLE).exists()
+    [product] = products(catalog=catalog)
+    assert product["status"] == "processed"
+    assert product["outputs"]["ndvi"] == processed["outputs"]["ndvi"]
+
+
+def test_download_and_process_skips_processed_products(
+    tmp_path: Path, downloads: Path, monkeypatch: pytest.MonkeyPatch
+):
+    requested = {}
+
+    def download(*args, **kwargs):
+        requested.update(kwargs)
+        # Products available in the catalog are yielded with their location.
+        yield {"uuid": "uuid1", "title": TITLE, "status": "ok", "path": str(downloads / TITLE)}
+
+    monkeypatch.setattr(pipeline.dhus, "download", download)
+    catalog = tmp_path / "catalog.sqlite"
+    output = tmp_path / "output"
+    # Downloaded by a previous run, which stopped before processing it.
+    set_status(catalog, TITLE, "unzipped", path=downloads / TITLE)
+
+    [result] = pipeline.download_and_process(steps="ndvi", output=output, cpu_workers=1, catalog=catalog)
+    assert Path(result["outputs"]["ndvi"]).is_file()
+    assert requested["skip"] == []
+
+    # Processed products are not downloaded again, unless they miss some output.
+    list(pipeline.download_and_process(steps="ndvi", output=output, cpu_workers=1, catalog=catalog))
+    assert requested["skip"] == [TITLE]
+    list(pipeline.download_and_process(steps="ndvi,evi", output=output, cpu_workers=1, catalog=catalog))
+    assert requested["skip"] == []
+
+    Path(result["outputs"]["ndvi"]).unlink()
+    list(pipeline.download_and_process(steps="ndvi", output=tmp_path / "output", cpu_workers=1, catalog=catalog))
+    assert requested["skip"] == []
+
+
+def test_download_and_process_rejects_unknown_steps():
+    with pytest.raises(ValueError):
+        next(pipeline.download_and_process(steps=["ndvi", "unknown"]))
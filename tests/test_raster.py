@@ -1,17 +1,23 @@
 import json
+import zipfile
 from pathlib import Path
 from typing import Tuple
 
 import numpy as np
 import pytest
 import rasterio
+from matplotlib import pyplot as plt
 from greensenti.raster import (
     apply_mask,
+    build_overviews,
     crop_by_shape,
+    overview_levels,
     project_shape,
+    quicklook,
     rescale_band,
     save_as_img,
     transform_image,
+    write_raster,
 )
 from rasterio import Affine
 from rasterio.crs import CRS
@@ -127,6 +133,37 @@ def test_transform_image(tmp_path: Path, raster: Tuple[Path, np.ndarray]):
     assert output_file.stat().st_size > 0
 
 
+def test_quicklook(tmp_path: Path):
+    data = np.random.randint(1, 10000, size=(3, 1024, 2048)).astype(np.uint16)
+    data[:, :, :100] = 0
+    filepath = tmp_path / "tci.tif"
+    profile = {
+        "driver": "GTiff",
+        "width": 2048,
+        "height": 1024,
+        "count": 3,
+        "dtype": np.uint16,
+        "transform": rasterio.transform.from_bounds(0, 0, 2048, 1024, 2048, 1024),
+        "crs": "EPSG:32630",
+        "nodata": 0,
+    }
+    with rasterio.open(filepath, "w", **profile) as dst:
+        dst.write(data)
+
+    output_file = tmp_path / "quicklook.png"
+    quicklook(filepath, output_file, size=512)
+    image = plt.imread(output_file)
+    assert image.shape == (256, 512, 4)
+    assert image[0, 0, 3] == 0  # nodata is transparent
+    assert image[0, -1, 3] == 1
+
+    profile.update(count=1)
+    with rasterio.open(filepath, "w", **profile) as dst:
+        dst.write(data[:1])
+    quicklook(filepath, output_file, size=128, color_map="RdYlGn")
+    assert plt.imread(output_file).shape == (64, 128, 4)
+
+
 def test_apply_mask(tmp_path: Path, geojson: Path, raster: Tuple[Path, np.ndarray]):
     input_file, _ = raster
     output_file = tmp_path / "masked_image.tif"
@@ -148,6 +185,32 @@ def test_apply_mask(tmp_path: Path, geojson: Path, raster: Tuple[Path, np.ndarra
     assert box(*original_bounds).contains(box(*masked_bounds))
 
 
+def test_apply_mask_reads_zipped_band(tmp_path: Path, geojson: Path, raster: Tuple[Path, np.ndarray]):
+    input_file, _ = raster
+    with zipfile.ZipFile(tmp_path / "product.zip", "w") as zip_file:
+        zip_file.write(input_file, "product.SAFE/band.tif")
+
+    output_path = apply_mask(filename=f"/vsizip/{tmp_path}/product.zip/product.SAFE/band.tif", geojson=geojson)
+
+    # Outputs of zipped bands are written next to the zip file.
+    assert output_path == tmp_path / "band_masked.tif"
+    assert output_path.is_file()
+
+
+def test_apply_mask_incremental(tmp_path: Path, geojson: Path, raster: Tuple[Path, np.ndarray]):
+    input_file, _ = raster
+    output_file = tmp_path / "masked_image.tif"
+    apply_mask(filename=input_file, geojson=geojson, output=output_file, incremental=True)
+    mtime = output_file.stat().st_mtime_ns
+
+    apply_mask(filename=input_file, geojson=geojson, output=output_file, incremental=True)
+    assert output_file.stat().st_mtime_ns == mtime
+
+    # Parameters are part of the fingerprint.
+    apply_mask(filename=input_file, geojson=geojson, geojson_crs="EPSG:4326", output=output_file, incremental=True)
+    assert output_file.stat().st_mtime_ns != mtime
+
+
 def test_rescale_band():
     input_band = np.zeros((3, 2, 2))
     input_kwargs = {
@@ -163,3 +226,45 @@ def test_rescale_band():
     output_band, output_kwargs = rescale_band(input_band, input_kwargs)
     assert output_kwargs["transform"][0] == 10 and output_kwargs["transform"][4] == -10  # check resolution is correct
     assert input_band.size * 2 * 2 == output_band.size  # check if the band is twice as big in each direction
+
+
+def test_overview_levels():
+    assert overview_levels(10980, 10980) == [2, 4, 8, 16, 32]
+    assert overview_levels(300, 200) == []
+
+
+def test_build_overviews(raster: Tuple[Path, np.ndarray]):
+    filename, _ = raster
+    assert build_overviews(filename, levels="auto") == []  # too small to need overviews
+    assert build_overviews(filename, levels=[2], resampling="average") == [2]
+    with rasterio.open(filename) as src:
+        assert src.overviews(1) == [2]
+        assert src.tags(ns="rio_overview")["resampling"] == "average"
+
+
+def test_write_raster_builds_overviews(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    data = np.ones((1, 1024, 512), dtype=np.float32)
+    kwargs = {
+        "driver": "GTiff",
+        "width": 512,
+        "height": 1024,
+        "count": 1,
+        "dtype": np.float32,
+        "transform": rasterio.transform.from_bounds(0, 0, 512, 1024, 512, 1024),
+        "crs": "EPSG:32630",
+    }
+    output = tmp_path / "out.tif"
+    write_raster(output, data, kwargs)
+    with rasterio.open(output) as src:
+        assert src.overviews(1) == [2, 4]
+        assert src.profile["tiled"]
+
+    monkeypatch.setenv("GREENSENTI_OVERVIEWS", "none")
+    write_raster(output, data, kwargs)
+    with rasterio.open(output) as src:
+        assert src.overviews(1) == []
+
+    monkeypatch.setenv("GREENSENTI_OVERVIEWS", "2,8")
+    write_raster(output, data, kwargs)
+    with rasterio.open(output) as src:
+        assert src.overviews(1) == [2, 8]
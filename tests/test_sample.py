@@ -0,0 +1,152 @@
+import json
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from greensenti import band_arithmetic as ba
+from greensenti import sample
+
+TITLE = "S2B_MSIL2A_20221005T105819_N0400_R094_T30SUF_20221005T135951"
+
+
+@pytest.fixture
+def downloads(tmp_path: Path) -> Path:
+    """Create an extracted product with B03, B04, B08 and B11 bands at 10m, tiled in 16x16 blocks, with known values."""
+    img_data = tmp_path / "downloads" / TITLE / f"{TITLE}.SAFE" / "GRANULE" / "L2A_T30SUF" / "IMG_DATA"
+    for band, value in [("B03", 2000), ("B04", 1000), ("B08", 3000), ("B11", 500)]:
+        filename = img_data / "R10m" / f"T30SUF_20221005T105819_{band}_10m.jp2"
+        filename.parent.mkdir(parents=True, exist_ok=True)
+        data = np.full((1, 64, 64), value, dtype=np.uint16)
+        data[:, :16, :16] = 0  # No data
+        profile = {
+            "driver": "GTiff",
+            "width": 64,
+            "height": 64,
+            "count": 1,
+            "dtype": np.uint16,
+            "crs": "EPSG:32630",
+            "transform": from_origin(300000, 4100000, 10, 10),
+            "tiled": True,
+            "blockxsize": 16,
+            "blockysize": 16,
+        }
+        with rasterio.open(filename, "w", **profile) as dst:
+            dst.write(data)
+    return tmp_path / "downloads"
+
+
+@pytest.fixture
+def points(tmp_path: Path) -> Path:
+    """Create a GeoJSON of labelled points in UTM 30N: inside the product, in its no data block and outside it."""
+    coordinates = {"a": [300325.0, 4099675.0], "nodata": [300005.0, 4099995.0], "outside": [200000.0, 4000000.0]}
+    features = [
+        {
+            "type": "Feature",
+            "id": id_,
+            "properties": {"label": "crop"},
+            "geometry": {"type": "Point", "coordinates": xy},
+        }
+        for id_, xy in coordinates.items()
+    ]
+    filename = tmp_path / "points.geojson"
+    filename.write_text(json.dumps({"type": "FeatureCollection", "features": features}))
+    return filename
+
+
+def test_read_points_from_csv(tmp_path: Path):
+    filename = tmp_path / "points.csv"
+    filename.write_text("Longitude,Latitude,label\n-4.5,36.7,olive\n-4.4,36.8,urban\n")
+
+    points = sample.read_points(filename)
+
+    assert points[["point_id", "x", "y", "label"]].values.tolist() == [
+        [0, -4.5, 36.7, "olive"],
+        [1, -4.4, 36.8, "urban"],
+    ]
+
+
+def test_index_bands():
+    assert sample.index_bands("ndvi") == {"b4": "B04", "b8": "B08"}
+    assert sample.index_bands("moisture") == {"b11": "B11", "b8a": "B8A"}
+
+
+def test_sample_band_reads_only_blocks_with_points(downloads: Path, monkeypatch: pytest.MonkeyPatch):
+    band = next(downloads.rglob("*_B04_10m.jp2"))
+    windows = []
+    read = rasterio.DatasetReader.read
+
+    def read_window(self, *args, **kwargs):
+        windows.append(kwargs["window"])
+        return read(self, *args, **kwargs)
+
+    monkeypatch.setattr(rasterio.DatasetReader, "read", read_window)
+
+    values = sample.sample_band(
+        band, np.array([300325.0, 300335.0, 300635.0]), np.array([4099675.0, 4099675.0, 4099675.0]), "epsg:32630"
+    )
+
+    assert values.tolist() == [1000, 1000, 1000]
+    assert [(window.col_off, window.row_off) for window in windows] == [(32, 32), (48, 32)]
+
+
+def test_sample(tmp_path: Path, downloads: Path, points: Path):
+    output = sample.sample(
+        points, downloads, indices="ndvi", bands=["B04"], output=tmp_path / "samples.csv", points_crs="epsg:32630"
+    )
+
+    samples = pd.read_csv(output)
+    assert samples[["point_id", "label", "title", "variable", "value"]].values.tolist() == [
+        ["a", "crop", TITLE, "B04", 1000.0],
+        ["a", "crop", TITLE, "ndvi", 0.5],
+    ]
+    assert samples["date"].tolist() == ["2022-10-05 10:58:19"] * 2
+
+
+def test_sample_thresholds_as_rasters(downloads: Path, points: Path):
+    points_df = sample.read_points(points)
+
+    samples = sample.sample_product(downloads / TITLE, points_df, indices=["ndsi"], points_crs="epsg:32630")
+
+    bands = {band: next(downloads.rglob(f"*_{band}_10m.jp2")) for band in ("B03", "B11")}
+    ndsi = ba.ndsi(bands["B03"], bands["B11"])
+    # NDSI (0.6) is above the snow threshold, so it is sampled as the raster value.
+    assert samples["value"].tolist() == [ndsi[0, 32, 32]] == [1.0]
+
+
+def test_sample_streams_products(tmp_path: Path, downloads: Path, points: Path):
+    other = TITLE.replace("20221005T105819", "20221015T105819")
+    shutil.copytree(downloads / TITLE, downloads / other)
+    # A product without B08 is skipped, instead of failing the rest.
+    missing = "S2B_MSIL2A_20221025T105819_N0400_R094_T30SUF_20221025T135951"
+    shutil.copytree(downloads / TITLE, downloads / missing)
+    next((downloads / missing).rglob("*_B08_10m.jp2")).unlink()
+
+    output = sample.sample(points, downloads, output=tmp_path / "samples.csv", points_crs="epsg:32630", workers=2)
+
+    samples = pd.read_csv(output)
+    assert sorted(samples["title"]) == sorted([TITLE, other])
+    assert samples["value"].tolist() == [0.5, 0.5]
+
+
+def test_sample_to_parquet(tmp_path: Path, downloads: Path, points: Path):
+    pytest.importorskip("pyarrow")
+    other = TITLE.replace("20221005T105819", "20221015T105819")
+    shutil.copytree(downloads / TITLE, downloads / other)
+
+    output = sample.sample(
+        points, downloads, bands=["B04"], output=tmp_path / "samples.parquet", points_crs="epsg:32630", workers=2
+    )
+
+    samples = pd.read_parquet(output).sort_values(["title", "variable"])
+    assert samples[["point_id", "title", "variable", "value"]].values.tolist() == [
+        ["a", TITLE, "B04", 1000.0],
+        ["a", TITLE, "ndvi", 0.5],
+        ["a", other, "B04", 1000.0],
+        ["a", other, "ndvi", 0.5],
+    ]
+    assert samples["date"].dt.day.tolist() == [5, 5, 15, 15]
@@ -0,0 +1,87 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+import rasterio
+
+from greensenti.stats import cached_stats, compute_stats, raster_stats
+
+
+@pytest.fixture
+def raster(tmp_path: Path) -> tuple[Path, np.ndarray]:
+    """Create a temporary tiled two band GeoTIFF with nodata for testing."""
+    rng = np.random.default_rng(42)
+    data = rng.normal(100, 15, size=(2, 600, 520)).astype(np.float32)
+    data[1] = 7
+    data[:, :10, :] = -9999
+    filepath = tmp_path / "test.tif"
+    profile = {
+        "driver": "GTiff",
+        "width": 520,
+        "height": 600,
+        "count": 2,
+        "dtype": np.float32,
+        "tiled": True,
+        "blockxsize": 256,
+        "blockysize": 256,
+        "transform": rasterio.transform.from_bounds(0, 0, 520, 600, 520, 600),
+        "crs": "EPSG:32630",
+        "nodata": -9999,
+    }
+    with rasterio.open(filepath, "w", **profile) as dst:
+        dst.write(data)
+    return filepath, data
+
+
+def test_compute_stats(raster: tuple[Path, np.ndarray]):
+    filename, data = raster
+    valid = data[0, 10:, :]
+
+    band, constant = compute_stats(filename, bins=512, percentiles=(2, 50, 98))
+
+    assert band["count"] == valid.size
+    assert band["min"] == pytest.approx(valid.min())
+    assert band["max"] == pytest.approx(valid.max())
+    assert band["mean"] == pytest.approx(valid.mean(), rel=1e-6)
+    assert band["std"] == pytest.approx(valid.std(), rel=1e-4)
+    assert sum(band["histogram"]["counts"]) == valid.size
+    for p in (2, 50, 98):
+        assert band["percentiles"][str(p)] == pytest.approx(np.percentile(valid, p), abs=0.5)
+
+    assert constant["min"] == constant["max"] == 7
+    assert constant["percentiles"]["50"] == 7
+
+
+def test_raster_stats_uses_sidecar(raster: tuple[Path, np.ndarray], monkeypatch: pytest.MonkeyPatch):
+    filename, _ = raster
+    assert cached_stats(filename) is None
+
+    stats = raster_stats(filename)
+    assert Path(f"{filename}.stats.json").is_file()
+    assert cached_stats(filename) == stats
+
+    # Cache hits don't scan the raster again.
+    monkeypatch.setattr("greensenti.stats.compute_stats", lambda *args, **kwargs: pytest.fail("Raster rescanned"))
+    assert raster_stats(filename) == stats
+
+
+def test_raster_stats_invalidated_on_change(raster: tuple[Path, np.ndarray]):
+    filename, data = raster
+    raster_stats(filename)
+
+    with rasterio.open(filename, "r+") as dst:
+        dst.write(np.where(data[0] == -9999, -9999, data[0] + 1000), 1)
+
+    assert cached_stats(filename) is None
+    assert raster_stats(filename)[0]["min"] > 900
+
+
+def test_raster_stats_unwritable_sidecar(raster: tuple[Path, np.ndarray]):
+    filename, _ = raster
+    # The sidecar can't be written, as in a read-only folder.
+    Path(f"{filename}.stats.json").mkdir()
+
+    stats = raster_stats(filename)
+    assert stats[0]["count"] > 0
+    assert cached_stats(filename) is None
+    assert not list(filename.parent.glob("*.tmp"))
@@ -0,0 +1,74 @@
+import os
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
+
+from greensenti import dhus
+from greensenti.storage import LocalMirror
+
+TEATINOS = Path(__file__).parents[1] / "geojson" / "teatinos.geojson"
+TITLE = "S2B_MSIL2A_20221005T105819_N0400_R094_T30SUF_20221005T135951"
+
+
+@pytest.fixture
+def mirror(tmp_path: Path) -> Path:
+    """Create a local mirror with a product with B04 and SCL bands."""
+    product = tmp_path / "mirror" / dhus.get_gcloud_path(TITLE)
+    img_data = product / "GRANULE" / "L2A_T30SUF_A029115_20221005T110745" / "IMG_DATA"
+    files = {
+        product / "MTD_MSIL2A.xml": "metadata",
+        img_data / "R10m" / "T30SUF_20221005T105819_B04_10m.jp2": "B04",
+        img_data / "R20m" / "T30SUF_20221005T105819_SCL_20m.jp2": "SCL",
+    }
+    for filename, content in files.items():
+        filename.parent.mkdir(parents=True, exist_ok=True)
+        filename.write_text(content)
+    return tmp_path / "mirror"
+
+
+def test_local_mirror_lists_blobs(mirror: Path):
+    prefix = dhus.get_gcloud_path(TITLE)
+    blobs = sorted(LocalMirror(mirror).list_blobs(prefix=prefix), key=lambda blob: blob.name)
+
+    assert [blob.name.removeprefix(prefix + "/") for blob in blobs] == [
+        "GRANULE/L2A_T30SUF_A029115_20221005T110745/IMG_DATA/R10m/T30SUF_20221005T105819_B04_10m.jp2",
+        "GRANULE/L2A_T30SUF_A029115_20221005T110745/IMG_DATA/R20m/T30SUF_20221005T105819_SCL_20m.jp2",
+        "MTD_MSIL2A.xml",
+    ]
+    assert blobs[-1].size == len("metadata")
+    assert list(LocalMirror(mirror).list_blobs(prefix="L2/tiles/29")) == []
+
+
+@pytest.mark.parametrize("link", [False, True])
+def test_gcloud_download_from_local_mirror(tmp_path: Path, mirror: Path, link: bool):
+    output = tmp_path / "output"
+
+    status = list(dhus.gcloud_download([TITLE], LocalMirror(mirror, link=link), output=output, bands=["B04"]))
+
+    assert status == [{"title": TITLE, "status": "ok"}]
+    band = next((output / TITLE).rglob("*_B04_10m.jp2"))
+    assert band.read_text() == "B04"
+    assert not list((output / TITLE).rglob("*_SCL_*"))
+    assert os.path.samefile(band, next(mirror.rglob("*_B04_10m.jp2"))) == link
+    assert dhus.get_entry(output, TITLE)["source"] == "mirror"
+
+
+@pytest.mark.parametrize("max_aoi_clouds, status", [(50, "cloudy"), (90, "ok")])
+def test_download_fetches_bands_of_clear_products(monkeypatch, tmp_path: Path, mirror: Path, max_aoi_clouds, status):
+    monkeypatch.setenv("GREENSENTI_CACHE_DIR", str(tmp_path / "cache"))
+    api = MagicMock()
+    api.query.return_value = {"uuid1": {"uuid": "uuid1", "title": TITLE, "cloudcoverpercentage": 10.0}}
+    api.to_dataframe.side_effect = dhus.SentinelAPI.to_dataframe
+    monkeypatch.setattr(dhus, "SentinelAPI", lambda *args, **kwargs: api)
+    scl = []
+    monkeypatch.setattr(dhus, "aoi_cloud_percentage", lambda *args: scl.append(args[0]) or 75.0)
+    output = tmp_path / "output"
+
+    [product] = dhus.download(TEATINOS, "*", output=output, mirror=mirror, bands=["B04"], max_aoi_clouds=max_aoi_clouds)
+
+    assert product["status"] == status
+    assert product["aoi_cloud_percentage"] == 75.0
+    assert scl[0].endswith("_SCL_20m.jp2")
+    assert bool(list(output.rglob("*_B04_10m.jp2"))) == (status == "ok")
+    assert dhus.get_entry(output, TITLE)["status"] == ("cloudy" if status == "cloudy" else "complete")
@@ -0,0 +1,68 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+import rasterio
+from matplotlib import pyplot as plt
+
+from greensenti.tiles import generate_tiles, tile_bounds, tiles_for_bounds
+
+
+@pytest.fixture
+def index(tmp_path: Path) -> Path:
+    """Create a temporary single band float GeoTIFF in UTM for testing."""
+    data = np.linspace(-1, 1, 512 * 512, dtype=np.float32).reshape((512, 512))
+    data[:, :256] = np.nan
+    filepath = tmp_path / "ndvi.tif"
+    profile = {
+        "driver": "GTiff",
+        "width": 512,
+        "height": 512,
+        "count": 1,
+        "dtype": np.float32,
+        "transform": rasterio.Affine(10.0, 0.0, 365540.0, 0.0, -10.0, 4066920.0),
+        "crs": "EPSG:32630",
+        "nodata": np.nan,
+    }
+    with rasterio.open(filepath, "w", **profile) as dst:
+        dst.write(data, 1)
+    return filepath
+
+
+def test_tile_bounds():
+    left, bottom, right, top = tile_bounds(0, 0, 0)
+    assert round(left, 2) == -20037508.34 and round(top, 2) == 20037508.34
+    assert round(right, 2) == 20037508.34 and round(bottom, 2) == -20037508.34
+
+    left, bottom, right, top = tile_bounds(1, 1, 0)
+    assert left == 0 and bottom == 0
+
+
+def test_tiles_for_bounds():
+    assert tiles_for_bounds((-180, -85, 180, 85), 0) == [(0, 0, 0)]
+    assert tiles_for_bounds((1, 1, 2, 2), 1) == [(1, 1, 0)]
+    assert len(tiles_for_bounds((-180, -85, 180, 85), 2)) == 16
+
+
+def test_generate_tiles(tmp_path: Path, index: Path):
+    output = tmp_path / "tiles"
+    generate_tiles(index, output, min_zoom=10, max_zoom=12, build_overviews=True, workers=2)
+
+    with rasterio.open(index) as src:
+        assert src.overviews(1)
+
+    tiles = list(output.glob("*/*/*.png"))
+    assert tiles
+    assert {tile.parts[-3] for tile in tiles} == {"10", "11", "12"}
+
+    image = plt.imread(tiles[0])
+    assert image.shape == (256, 256, 4)
+
+
+def test_generate_tiles_skips_empty_tiles(tmp_path: Path, index: Path):
+    with rasterio.open(index, "r+") as dst:
+        dst.write(np.full((512, 512), np.nan, dtype=np.float32), 1)
+
+    output = tmp_path / "tiles"
+    generate_tiles(index, output, min_zoom=12, max_zoom=12, vmin=-1, vmax=1, workers=1)
+    assert not list(output.glob("*/*/*.png"))